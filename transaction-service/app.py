@@ -1,54 +1,380 @@
 """
 This module contains the main application logic for the application.
 
-It sets up the Flask application and defines the routes for the API.
+It is a native ASGI application standing in for the third-party transaction
+provider. Requests never occupy a worker thread while they wait, so a single
+process can hold thousands of concurrent requests and load tests measure the
+wallet service instead of the stub.
 
 Routes:
-    - "/" (POST): Handles POST requests to the root URL by asynchronously
-      getting a random status and returning it as a JSON response.
+    - "/" (POST): Handles a transfer request. After a simulated latency it
+      returns a JSON body with 'data' set to 'success' or 'failed' and a
+      'status'. The HTTP status code is 200, or the 'status' of the body
+      with HTTP_ERRORS enabled.
+    - "/batch" (POST): Handles a JSON batch of transfers
+      ({"transfers": [{"id": ..., ...}, ...]}). The batch takes a single
+      latency sample and returns {"results": [{"id", "data", "status"}, ...]}
+      with an independent result per transfer. A timeout fails the batch.
+    - "/_admin/config" (GET, PUT): Returns or updates the fault injection
+      configuration at runtime. PUT takes a partial JSON object.
+    - "/_admin/stats" (GET, DELETE): Returns or resets the request stats.
+
+Transfers are idempotent: a request with the "Idempotency-Key" header of an
+earlier successful request, and a batch transfer with the "id" of an earlier
+successful one, get the earlier result back without being transferred again.
+Concurrent requests with the same key wait for the first one.
+
+Configuration (environment variables, all optional):
+    - LATENCY: The latency distribution. One of "fixed:<seconds>",
+      "lognormal:<median seconds>:<sigma>" or "uniform:<min>:<max>".
+      Defaults to "fixed:1".
+    - SPIKE_RATE, SPIKE_LATENCY: Probability of a tail latency spike and the
+      extra seconds it adds. Default to 0 and 5.
+    - ERROR_RATE: Probability of a failed transfer (status 503). Defaults
+      to 0.1.
+    - HTTP_ERRORS: Answer failed and timed out transfers on "/" with their
+      status as the HTTP status code instead of 200. Defaults to false.
+    - TIMEOUT_RATE, TIMEOUT_LATENCY: Probability that a request hangs and
+      the seconds it hangs before returning a 504. Default to 0 and 30.
+    - IDEMPOTENCY_KEYS: The number of successful transfers remembered for
+      idempotency. Defaults to 100000.
 
 Functions:
-    - simple_request(): Handles POST requests to the root URL.
+    - asgi_app(): The ASGI application.
 """
-import random
 import asyncio
-from flask import Flask, jsonify
-from asgiref.wsgi import WsgiToAsgi
+import json
+import logging
+import math
+import os
+import random
+import time
+from collections import Counter, OrderedDict
+from dataclasses import asdict, dataclass, fields, replace
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEYS = int(os.environ.get('IDEMPOTENCY_KEYS', 100_000))
+STATS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, math.inf)
+
+
+@dataclass
+class Config:
+    latency: str = 'fixed:1'
+    spike_rate: float = 0.0
+    spike_latency: float = 5.0
+    error_rate: float = 0.1
+    timeout_rate: float = 0.0
+    timeout_latency: float = 30.0
+    http_errors: bool = False
+
+    @classmethod
+    def from_env(cls):
+        config = cls()
+        config.update({
+            field.name: os.environ[field.name.upper()]
+            for field in fields(cls)
+            if field.name.upper() in os.environ
+        })
+        return config
+
+    def update(self, values):
+        updated = replace(self, **{
+            field.name: parse(field.type, values[field.name])
+            for field in fields(self)
+            if field.name in values
+        })
+        updated.sample_latency()  # fail early on an invalid distribution
+        self.__dict__.update(updated.__dict__)
+
+    def sample_latency(self):
+        """
+        Returns a latency in seconds drawn from the configured distribution,
+        including tail spikes.
+        """
+        kind, *params = self.latency.split(':')
+        params = [float(param) for param in params]
+        if kind == 'fixed':
+            latency = params[0]
+        elif kind == 'lognormal':
+            median, sigma = params
+            latency = random.lognormvariate(math.log(median), sigma)
+        elif kind == 'uniform':
+            latency = random.uniform(*params)
+        else:
+            raise ValueError(f'Unknown latency distribution: {self.latency}')
+
+        if random.random() < self.spike_rate:
+            latency += self.spike_latency
+        return latency
+
+
+def parse(type, value):
+    if type is bool and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(value)
+
 
-app = Flask(__name__)
+class Stats:
+    def __init__(self):
+        self.reset()
 
+    def reset(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.statuses = Counter()
+        self.batch_items = 0
+        self.duplicates = 0
+        self.buckets = Counter()
+        self.total_latency = 0.0
 
-ERROR_RATE = 0.1
+    def request_started(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self, status, latency):
+        self.in_flight -= 1
+        self.statuses[status] += 1
+        self.total_latency += latency
+        self.buckets[next(b for b in STATS_BUCKETS if latency <= b)] += 1
+
+    def as_dict(self):
+        requests = sum(self.statuses.values())
+        return {
+            'uptime': time.time() - self.started,
+            'requests': requests,
+            'batch_items': self.batch_items,
+            'duplicates': self.duplicates,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'mean_latency': self.total_latency / requests if requests else None,
+            'latency_buckets': {
+                str(bucket): self.buckets[bucket] for bucket in STATS_BUCKETS
+            },
+        }
+
+
+config = Config.from_env()
+stats = Stats()
+# successful transfers by idempotency key, oldest first
+transfers = OrderedDict()
+# futures of the requests in flight by idempotency key
+pending_transfers = {}
+
+
+def remember_transfer(key, result):
+    if result['status'] != 200:
+        return
+    transfers[key] = result
+    while len(transfers) > IDEMPOTENCY_KEYS:
+        transfers.popitem(last=False)
+
+
+async def idempotent_status(key):
+    """
+    Returns the result of the earlier request with the given idempotency
+    key if it succeeded, otherwise gets a new random status. Concurrent
+    requests with the same key share the result of the first one.
+    """
+    if key is None:
+        return await random_status()
+    if key in transfers:
+        stats.duplicates += 1
+        return transfers[key]
+    if key in pending_transfers:
+        stats.duplicates += 1
+        return await asyncio.shield(pending_transfers[key])
+
+    future = asyncio.get_running_loop().create_future()
+    pending_transfers[key] = future
+    try:
+        data = await random_status()
+        remember_transfer(key, data)
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        # nobody may be waiting for the future
+        future.exception()
+        raise
+    finally:
+        del pending_transfers[key]
+
+
+def random_result():
+    if random.random() < config.error_rate:
+        return {'data': 'failed', 'status': 503}
+    return {'data': 'success', 'status': 200}
 
 
 async def random_status():
     """
-    Asynchronously generates a random status with a 1 second delay. If the
-    random number generated is less than the ERROR_RATE, a dictionary with
-    'data' set to 'failed' and 'status' set to 503 is returned. Otherwise, a
-    dictionary with 'data' set to 'success' and 'status' set to 200 is returned.
+    Asynchronously generates a random status after a latency drawn from the
+    configured distribution. With a probability of TIMEOUT_RATE the request
+    hangs for TIMEOUT_LATENCY seconds and a 504 is returned. With a
+    probability of ERROR_RATE a dictionary with 'data' set to 'failed' and
+    'status' set to 503 is returned. Otherwise, a dictionary with 'data' set
+    to 'success' and 'status' set to 200 is returned.
 
     Returns:
-        dict: A dictionary with 'data' set to 'failed' or 'success' and 'status'
-        set to 503 or 200 respectively.
+        dict: A dictionary with 'data' and 'status' keys.
     """
-    await asyncio.sleep(1)
-    if random.random() < ERROR_RATE:
-        return {'data': 'failed', 'status': 503}
+    if random.random() < config.timeout_rate:
+        await asyncio.sleep(config.timeout_latency)
+        return {'data': 'timeout', 'status': 504}
 
-    return {'data': 'success', 'status': 200}
+    await asyncio.sleep(config.sample_latency())
+    return random_result()
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
 
 
-@app.route("/", methods=["POST"])
-async def simple_request():
+async def simple_request(scope, receive, send):
     """
     Handles POST requests to the root URL by asynchronously getting a random
     status and returning it as a JSON response.
     """
-    data = await random_status()
-    return jsonify(data)
+    started = time.perf_counter()
+    stats.request_started()
+    status = 500
+    try:
+        await read_body(receive)
+        headers = dict(scope['headers'])
+        key = headers.get(b'idempotency-key')
+        data = await idempotent_status(key.decode() if key else None)
+        status = data['status'] if config.http_errors else 200
+        await send_json(send, data, status)
+    finally:
+        stats.request_finished(status, time.perf_counter() - started)
+
+
+async def batch_request(scope, receive, send):
+    """
+    Handles POST requests to the batch URL. The whole batch waits for one
+    latency sample, then every transfer gets its own random result unless
+    its id belongs to an earlier successful transfer.
+    """
+    started = time.perf_counter()
+    stats.request_started()
+    status = 500
+    try:
+        try:
+            batch = json.loads(await read_body(receive))['transfers']
+            ids = [transfer['id'] for transfer in batch]
+        except (ValueError, TypeError, KeyError) as e:
+            status = 400
+            await send_json(send, {'detail': f'Invalid batch: {e}'}, status)
+            return
+
+        data = await random_status()
+        if data['status'] == 504:
+            status = 504
+            await send_json(send, data, status)
+            return
+
+        results = []
+        for id in ids:
+            key = str(id)
+            if key in transfers:
+                stats.duplicates += 1
+                result = transfers[key]
+            else:
+                result = random_result()
+                remember_transfer(key, result)
+            results.append({'id': id, **result})
+
+        stats.batch_items += len(ids)
+        status = 200
+        await send_json(send, {'results': results})
+    finally:
+        stats.request_finished(status, time.perf_counter() - started)
+
+
+async def admin_config(scope, receive, send):
+    if scope['method'] == 'PUT':
+        try:
+            config.update(json.loads(await read_body(receive)))
+        except (ValueError, TypeError) as e:
+            await send_json(send, {'detail': str(e)}, 400)
+            return
+    await send_json(send, asdict(config))
+
+
+async def admin_stats(scope, receive, send):
+    if scope['method'] == 'DELETE':
+        stats.reset()
+    await send_json(send, stats.as_dict())
+
+
+ROUTES = {
+    ('POST', '/'): simple_request,
+    ('POST', '/batch'): batch_request,
+    ('GET', '/_admin/config'): admin_config,
+    ('PUT', '/_admin/config'): admin_config,
+    ('GET', '/_admin/stats'): admin_stats,
+    ('DELETE', '/_admin/stats'): admin_stats,
+}
+
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # e.g. websockets, which the server rejects when the app returns
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path'].rstrip('/') or '/'))
+    if handler is None:
+        await send_json(send, {'detail': 'Not found.'}, 404)
+        return
+
+    started = False
+
+    async def send_tracked(message):
+        nonlocal started
+        started = started or message['type'] == 'http.response.start'
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_tracked)
+    except Exception:
+        logger.exception('Error handling %s %s', scope['method'], scope['path'])
+        # the client would wait for a response forever
+        if not started:
+            await send_json(send, {'detail': 'Internal server error.'}, 500)
 
-asgi_app = WsgiToAsgi(app)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8010)
+    from daphne.cli import CommandLineInterface
+
+    CommandLineInterface().run(['-b', '0.0.0.0', '-p', '8010', 'app:asgi_app'])
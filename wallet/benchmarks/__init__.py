@@ -0,0 +1,14 @@
+"""
+Micro-benchmarks for the wallet service.
+
+Run them from the ``wallet`` directory against a database configured the
+same way as the service, e.g. ``python -m benchmarks.connections``.
+"""
+import os
+
+
+def setup():
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wallet.settings')
+    django.setup()
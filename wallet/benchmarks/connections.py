@@ -0,0 +1,61 @@
+"""
+Benchmark the connection setup overhead per request with and without the
+connection pool.
+
+Every iteration simulates the database work of a request or a Celery task:
+get a connection, run a trivial query and close the connection again, like
+Django does at the end of every request and task.
+
+Usage: python -m benchmarks.connections [iterations]
+"""
+import sys
+import time
+from copy import deepcopy
+
+from . import setup
+
+setup()
+
+from django.db import connections  # noqa: E402
+from django.db.utils import load_backend  # noqa: E402
+
+
+def make_connection(pool_options):
+    settings_dict = deepcopy(connections.settings['default'])
+    settings_dict['CONN_MAX_AGE'] = 0
+    settings_dict['OPTIONS'].pop('pool', None)
+    if pool_options:
+        settings_dict['OPTIONS']['pool'] = pool_options
+
+    backend = load_backend(settings_dict['ENGINE'])
+    return backend.DatabaseWrapper(settings_dict, alias=f'bench-{bool(pool_options)}')
+
+
+def run(connection, iterations):
+    # warm up, this also opens the pool
+    connection.ensure_connection()
+    connection.close()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.close()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    results = {
+        'no pool': run(make_connection(None), iterations),
+        'pool': run(make_connection({'min_size': 1, 'max_size': 4}), iterations),
+    }
+
+    for name, seconds in results.items():
+        print(f'{name:>8}: {seconds * 1000:8.3f} ms per request')
+    print(f'speedup: {results["no pool"] / results["pool"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
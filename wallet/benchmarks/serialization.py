@@ -0,0 +1,77 @@
+"""
+Benchmark the wallet retrieve endpoint with the default JSON rendering and
+with the compact renderer.
+
+A wallet with 1000 transactions (500 outgoing, 500 incoming) is created in
+a transaction which is rolled back at the end. Every iteration dispatches a
+GET request through the viewset and renders the response.
+
+Usage: python -m benchmarks.serialization [iterations] [transactions]
+"""
+import sys
+import time
+from datetime import timedelta
+
+from . import setup
+
+setup()
+
+from django.db import transaction  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from transactions.models import Transaction, Wallet  # noqa: E402
+from transactions.renderers import COMPACT_MEDIA_TYPE  # noqa: E402
+from transactions.views import WalletViewSet  # noqa: E402
+
+
+def create_wallet(size):
+    wallet = Wallet.objects.create(balance=100000000)
+    other = Wallet.objects.create(balance=100000000)
+    now = timezone.now()
+    Transaction.objects.bulk_create([
+        Transaction(
+            sender=wallet if i % 2 else other,
+            receiver=other if i % 2 else wallet,
+            amount=123456,
+            scheduled_time=now + timedelta(minutes=i),
+            status=Transaction.Status.SUCCESS,
+        )
+        for i in range(size)
+    ])
+    return wallet
+
+
+def run(wallet, accept, iterations):
+    view = WalletViewSet.as_view({'get': 'retrieve'})
+    request = APIRequestFactory().get(f'/api/wallets/{wallet.uuid}/', HTTP_ACCEPT=accept)
+
+    # warm up
+    size = len(view(request, pk=str(wallet.uuid)).render().content)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        view(request, pk=str(wallet.uuid)).render()
+    return (time.perf_counter() - started) / iterations, size
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+        wallet = create_wallet(size)
+        results = {
+            'default': run(wallet, 'application/json', iterations),
+            'compact': run(wallet, COMPACT_MEDIA_TYPE, iterations),
+        }
+        transaction.set_rollback(True)
+
+    for name, (seconds, length) in results.items():
+        print(f'{name:>8}: {seconds * 1000:8.3f} ms per request, {length} bytes')
+    print(f'speedup: {results["default"][0] / results["compact"][0]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark the requests per second of the API served by gunicorn with 1, 2,
+4, ... Uvicorn workers (see ``gunicorn.conf.py``).
+
+For every worker count a server is started on a free local port, a wallet
+is created and client processes retrieve it for the given number of
+seconds over keep-alive connections. The clients run on the same machine,
+so leave some cores for them: by default the worker counts go up to half of
+the available cores.
+
+Usage: python -m benchmarks.serving [seconds] [worker counts, e.g. 1,2,4]
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+import requests
+
+CLIENTS_PER_WORKER = 2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, port):
+    env = {**os.environ, 'WEB_CONCURRENCY': str(workers), 'WEB_BIND': f'127.0.0.1:{port}'}
+    env.setdefault('DJANGO_ALLOWED_HOSTS', '127.0.0.1')
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', 'wallet.asgi:application'],
+        env=env, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'{url}/api/', timeout=5).raise_for_status()
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    server.terminate()
+    server.wait()
+    raise RuntimeError('The server did not start')
+
+
+def client(args):
+    url, seconds = args
+    latencies = []
+    with requests.Session() as session:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            session.get(url).raise_for_status()
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run(workers, seconds):
+    server, url = start_server(workers, free_port())
+    try:
+        wallet = requests.post(f'{url}/api/wallets/').json()['uuid']
+        wallet_url = f'{url}/api/wallets/{wallet}/'
+        clients = workers * CLIENTS_PER_WORKER
+        # warm up every worker's database connections
+        with Pool(clients) as pool:
+            pool.map(client, [(wallet_url, 0.5)] * clients)
+            latencies = sorted(
+                latency
+                for result in pool.map(client, [(wallet_url, seconds)] * clients)
+                for latency in result
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    return len(latencies) / seconds, latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if len(sys.argv) > 2:
+        counts = [int(count) for count in sys.argv[2].split(',')]
+    else:
+        cores = len(os.sched_getaffinity(0))
+        counts = [2 ** i for i in range(cores.bit_length()) if 2 ** i <= max(1, cores // 2)]
+
+    baseline = None
+    for workers in counts:
+        rate, p50, p99 = run(workers, seconds)
+        baseline = baseline or rate
+        print(f'{workers:>3} workers: {rate:8.0f} requests/s  '
+              f'p50 {p50 * 1000:6.1f} ms  p99 {p99 * 1000:6.1f} ms  '
+              f'{rate / baseline:4.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark the settlement writes of a withdrawal and of a deposit with full
+``save()`` calls, as they used to be written, and with the targeted updates.
+
+The wallets and transactions are created in a transaction which is rolled
+back at the end. Every iteration settles one withdrawal (or applies one
+deposit) and reports the time, the number of queries and the WAL bytes the
+database generated for it.
+
+Usage: python -m benchmarks.settlement [iterations]
+"""
+import sys
+import time
+from datetime import timedelta
+
+from . import setup
+
+setup()
+
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from transactions.models import Transaction, Wallet, WalletDailyAggregate  # noqa: E402
+from transactions.tasks import handle_transaction_success, write_settlement  # noqa: E402
+
+
+def legacy_withdrawal(sender, receiver, withdrawal):
+    handle_transaction_success(sender, receiver, withdrawal)
+    WalletDailyAggregate.objects.record_changes([(sender.uuid, 0, withdrawal.amount, sender.balance)])
+    WalletDailyAggregate.objects.record_changes([(receiver.uuid, withdrawal.amount, 0, receiver.balance)])
+    for obj in [sender, receiver, withdrawal]:
+        obj.save()
+
+
+def targeted_withdrawal(sender, receiver, withdrawal):
+    handle_transaction_success(sender, receiver, withdrawal)
+    write_settlement({sender.uuid: sender, receiver.uuid: receiver}, [withdrawal])
+
+
+@transaction.atomic
+def legacy_deposit(wallet, amount):
+    wallet = Wallet.objects.select_for_update().get(uuid=wallet.uuid)
+    wallet.balance += amount
+    wallet.full_clean()
+    wallet.save()
+    WalletDailyAggregate.objects.record_changes([(wallet.uuid, amount, 0, wallet.balance)])
+
+
+def targeted_deposit(wallet, amount):
+    wallet.deposit(amount)
+
+
+def wal_position():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_insert_lsn()')
+        return cursor.fetchone()[0]
+
+
+def wal_bytes(start, end):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_wal_lsn_diff(%s, %s)', [end, start])
+        return int(cursor.fetchone()[0])
+
+
+def run(settle, iterations):
+    sender = Wallet.objects.create(balance=100000000)
+    receiver = Wallet.objects.create(balance=100000000)
+    now = timezone.now()
+    withdrawals = Transaction.objects.bulk_create([
+        Transaction(
+            sender=sender,
+            receiver=receiver,
+            amount=1234,
+            scheduled_time=now + timedelta(minutes=i),
+        )
+        for i in range(iterations)
+    ])
+
+    elapsed = queries = wal = 0
+    for withdrawal in withdrawals:
+        connection.queries_log.clear()
+        start = wal_position()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            if settle in (legacy_deposit, targeted_deposit):
+                settle(sender, withdrawal.amount)
+            else:
+                settle(sender, receiver, withdrawal)
+            elapsed += time.perf_counter() - started
+        queries += len(context)
+        wal += wal_bytes(start, wal_position())
+    return elapsed / iterations, queries / iterations, wal / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    results = {}
+    with transaction.atomic():
+        for settle in [legacy_withdrawal, targeted_withdrawal, legacy_deposit, targeted_deposit]:
+            results[settle.__name__] = run(settle, iterations)
+        transaction.set_rollback(True)
+
+    for name, (seconds, queries, wal) in results.items():
+        print(f'{name:>20}: {seconds * 1000:7.3f} ms, {queries:4.1f} queries, {wal:7.0f} WAL bytes')
+
+
+if __name__ == '__main__':
+    main()
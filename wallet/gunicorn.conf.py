@@ -0,0 +1,35 @@
+"""
+Gunicorn configuration of the ``webapp`` image.
+
+Gunicorn binds the socket and forks ``WEB_CONCURRENCY`` Uvicorn workers
+(default: one per available CPU), which accept the connections of the
+shared socket. The application is loaded in every worker after the fork,
+so each has its own database pool (``DJANGO_DB_POOL_MAX_SIZE``
+connections) and event hub.
+
+A worker is replaced after ``WEB_MAX_REQUESTS`` requests (plus up to 10%
+jitter, so the workers don't restart together). ``SIGHUP`` starts new
+workers and then stops the old ones, which finish their requests within
+``WEB_GRACEFUL_TIMEOUT`` seconds.
+"""
+import os
+
+
+def env_int(key, default):
+    return int(os.environ.get(key) or default)
+
+
+bind = os.environ.get('WEB_BIND') or '0.0.0.0:8000'
+workers = env_int('WEB_CONCURRENCY', len(os.sched_getaffinity(0)))
+worker_class = 'wallet.workers.WalletUvicornWorker'
+
+max_requests = env_int('WEB_MAX_REQUESTS', 10000)
+max_requests_jitter = max_requests // 10
+
+# event streams are closed when a worker stops, clients reconnect
+graceful_timeout = env_int('WEB_GRACEFUL_TIMEOUT', 30)
+timeout = 30
+keepalive = env_int('WEB_KEEPALIVE', 5)
+
+accesslog = None
+errorlog = '-'
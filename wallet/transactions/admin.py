@@ -1,18 +1,223 @@
+import uuid
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 
 from .models import Transaction, Wallet
+from .money import DECIMAL_PLACES, MAX_DIGITS, from_minor, to_minor
+
+# the changelist query parameter of the keyset cursor
+CURSOR_VAR = 'after'
+
+# tables estimated below this many rows are counted exactly
+EXACT_COUNT_LIMIT = 10000
+
+# the estimates of the leaf tables, i.e. of all partitions of a partitioned
+# table, are summed; reltuples is -1 for tables never analyzed
+ESTIMATE_SQL = """
+    SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint
+    FROM pg_class c
+    WHERE c.relkind = 'r' AND (
+        c.oid = %(table)s::regclass
+        OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass)
+    )
+"""
+
+
+class MoneyFormField(forms.DecimalField):
+    """
+    A decimal amount in the admin forms, integer minor units in the models.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_digits', MAX_DIGITS)
+        kwargs.setdefault('decimal_places', DECIMAL_PLACES)
+        super().__init__(**kwargs)
+
+    def prepare_value(self, value):
+        # the initial value comes from the model, the submitted one doesn't
+        return super().prepare_value(from_minor(value) if isinstance(value, int) else value)
+
+    def has_changed(self, initial, data):
+        return super().has_changed(from_minor(initial) if isinstance(initial, int) else initial, data)
+
+    def clean(self, value):
+        value = super().clean(value)
+        return None if value is None else to_minor(value)
+
+
+class TransactionAdminForm(forms.ModelForm):
+    amount = MoneyFormField(label=_("Amount"), help_text=_("The amount of the transaction."))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator which estimates the number of objects instead of counting
+    them: from the table statistics in ``pg_class`` without filters, from
+    the query plan with filters. Small estimates are counted exactly.
+    """
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        if queryset.query.is_empty():
+            return 0
+        with connections[queryset.db].cursor() as cursor:
+            if queryset.query.where:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+            else:
+                cursor.execute(ESTIMATE_SQL, {'table': queryset.model._meta.db_table})
+                estimate = cursor.fetchone()[0]
+        self.estimated = estimate >= EXACT_COUNT_LIMIT
+        return estimate if self.estimated else queryset.count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A changelist paginated by keyset instead of by offset.
+
+    The rows are always ordered by the ``keyset`` fields of the model admin,
+    which must end with a unique field and share one direction, and each
+    page starts after the last row of the previous one, so a page costs the
+    same index range scan however deep it is. There are only "next" links,
+    no page numbers; the counts come from the paginator.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # changing the filters or the search starts over from the first page
+        return super().get_query_string(new_params, [CURSOR_VAR, *(remove or [])])
+
+    def get_ordering(self, request, queryset):
+        return list(self.model_admin.keyset)
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.cursor = request.GET.get(CURSOR_VAR)
+        queryset = self.queryset
+        if self.cursor:
+            queryset = queryset.filter(self.after(self.cursor))
+        rows = list(queryset[:self.list_per_page + 1])
+
+        self.result_list = rows[:self.list_per_page]
+        self.next_cursor = self.cursor_of(rows[-2]) if len(rows) > self.list_per_page else None
+        self.result_count = paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = paginator
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string()
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+    def cursor_of(self, obj):
+        return ','.join(
+            self.lookup_opts.get_field(field.lstrip('-')).value_to_string(obj)
+            for field in self.model_admin.keyset
+        )
+
+    def after(self, cursor):
+        """
+        Return the filter of the rows after the ``cursor``, e.g. for the
+        keyset ``(-a, -b)`` ``a <= x AND (a < x OR b < y)``, whose first
+        condition bounds the index scan.
+        """
+        names = [field.lstrip('-') for field in self.model_admin.keyset]
+        lookup = 'lt' if self.model_admin.keyset[0].startswith('-') else 'gt'
+        try:
+            values = [
+                self.lookup_opts.get_field(name).to_python(value)
+                for name, value in zip(names, cursor.split(','), strict=True)
+            ]
+        except (ValidationError, ValueError) as e:
+            raise IncorrectLookupParameters(e) from e
+
+        after = Q(**{f'{names[-1]}__{lookup}': values[-1]})
+        for name, value in zip(names[-2::-1], values[-2::-1]):
+            after = Q(**{f'{name}__{lookup}': value}) | Q(**{name: value}) & after
+        return Q(**{f'{names[0]}__{lookup}e': values[0]}) & after
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    A model admin for tables too large to count or to page through by
+    offset: estimated counts, keyset pagination over the ``keyset`` fields,
+    which should be backed by an index, and no sorting by the columns or
+    filter facets, which would scan the table.
+    """
+    keyset = ()
+    paginator = EstimatedCountPaginator
+    change_list_template = 'admin/keyset_change_list.html'
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    sortable_by = ()
+
+    def get_ordering(self, request):
+        return self.keyset
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('uuid', 'sender', 'receiver', 'amount', 'status')
+class TransactionAdmin(LargeTableAdmin):
+    form = TransactionAdminForm
+    list_display = ('uuid', 'sender', 'receiver', 'display_amount', 'status', 'scheduled_time')
+    list_select_related = ('sender', 'receiver')
+    list_filter = ('status', 'scheduled_time')
+    keyset = ('-scheduled_time', '-uuid')
     fields = ('uuid', 'sender', 'receiver', 'amount', 'scheduled_time', 'status', 'error_message', 'created', 'updated')
+    autocomplete_fields = ('sender', 'receiver')
 
     readonly_fields = ['uuid', 'status', 'error_message', 'created', 'updated']
 
+    @admin.display(description=_("Amount"))
+    def display_amount(self, obj):
+        return from_minor(obj.amount)
+
 @admin.register(Wallet)
-class WalletAdmin(admin.ModelAdmin):
-    list_display = ('uuid', 'balance')
-    fields = ('uuid', 'balance', 'created', 'updated')
+class WalletAdmin(LargeTableAdmin):
+    list_display = ('uuid', 'display_balance')
+    keyset = ('uuid',)
+    search_fields = ('=uuid',)
+    fields = ('uuid', 'display_balance', 'created', 'updated')
+
+    readonly_fields = ['uuid', 'display_balance', 'created', 'updated']
+
+    def get_search_results(self, request, queryset, search_term):
+        # an exact match on the primary key instead of the default
+        # UPPER(uuid::text) comparison, which can't use its index
+        if not search_term.strip():
+            return queryset, False
+        try:
+            value = uuid.UUID(search_term.strip())
+        except ValueError:
+            return queryset.none(), False
+        return queryset.filter(uuid=value), False
 
-    readonly_fields = ['uuid', 'balance', 'created', 'updated']
+    @admin.display(description=_("Balance"))
+    def display_balance(self, obj):
+        return from_minor(obj.balance)
@@ -0,0 +1,26 @@
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+
+def get_redis_client(alias: str = 'default'):
+    """
+    Return the Redis client of the given cache, or ``None`` if the cache is
+    not a Redis cache (local development, tests).
+
+    The client shares the connection pool of the cache.
+    """
+    cache = caches[alias]
+    if not isinstance(cache, RedisCache):
+        return None
+    return cache._cache.get_client(write=True)
+
+
+def get_redis_url(alias: str = 'default'):
+    """
+    Return the server URL of the given cache, or ``None`` if the cache is
+    not a Redis cache.
+    """
+    cache = caches[alias]
+    if not isinstance(cache, RedisCache):
+        return None
+    return cache._servers[0]
@@ -0,0 +1,130 @@
+"""
+Coalescing of concurrent deposits to the same wallet.
+
+A burst of deposits to one wallet serializes on the row lock of the
+wallet. With ``WALLET_DEPOSIT_COALESCE_WINDOW`` set (milliseconds), the
+deposits that arrive within the window are applied by a single balance
+update instead:
+
+1. Every request pushes its amount to the wallet's queue in Redis.
+2. The request that takes the wallet's leader lock pops the whole queue,
+   applies the sum and pushes the outcome to the result list of every
+   popped request. Only when other deposits are already queued, i.e. a
+   burst is under way, does it first wait for the window to collect more.
+3. The other requests wait for their result. If the leader goes away
+   before taking their deposit, one of them becomes the next leader.
+
+A deposit without concurrent deposits is applied right away. The waits
+block the thread of the request, which under ASGI is the thread shared by
+the sync views of the worker, so keep the window short: a few
+milliseconds are enough to collect a burst, and a waiting follower would
+otherwise wait for the wallet's row lock.
+
+Coalescing needs the Redis cache and is disabled without it.
+"""
+import json
+import time
+import uuid
+
+from django.conf import settings
+
+from .cache import get_redis_client
+
+POP_ALL_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return items
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class CoalescedDepositError(Exception):
+    pass
+
+
+class CoalescedDepositTimeout(CoalescedDepositError):
+    """
+    No outcome arrived in time: the deposit may or may not have been
+    applied, so retrying it may deposit twice.
+    """
+
+
+def coalescing_enabled() -> bool:
+    return bool(settings.WALLET_DEPOSIT_COALESCE_WINDOW) and get_redis_client() is not None
+
+
+def coalesce_deposit(wallet_uuid, amount: int, apply_deposit, timeout: float = 5) -> None:
+    """
+    Deposit ``amount`` to the wallet together with the concurrent deposits
+    to the same wallet.
+
+    Args:
+        wallet_uuid: The UUID of the wallet.
+        amount (int): The amount of this deposit in minor units.
+        apply_deposit: Called with the wallet UUID and the total amount of
+            the coalesced deposits, must apply them in one database
+            transaction.
+        timeout (float): The seconds to wait for the outcome.
+
+    Raises:
+        CoalescedDepositError: If the coalesced deposit failed.
+        CoalescedDepositTimeout: If no outcome arrived in time. The deposit
+            may or may not have been applied.
+    """
+    client = get_redis_client()
+    window = settings.WALLET_DEPOSIT_COALESCE_WINDOW / 1000
+    request_id = uuid.uuid4().hex
+    queue_key = f'deposits:{wallet_uuid}'
+    lock_key = f'deposits:{wallet_uuid}:leader'
+    result_key = f'deposits:result:{request_id}'
+    ttl = int(timeout) + 1
+
+    client.pipeline() \
+        .rpush(queue_key, json.dumps({'id': request_id, 'amount': amount})) \
+        .expire(queue_key, ttl) \
+        .execute()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.set(lock_key, request_id, nx=True, px=int(timeout * 1000)):
+            try:
+                # no wait without contention
+                if client.llen(queue_key) > 1:
+                    time.sleep(window)
+                _lead(client, queue_key, wallet_uuid, apply_deposit, ttl)
+            finally:
+                client.eval(RELEASE_SCRIPT, 1, lock_key, request_id)
+
+        # a leader pushes the outcome within its window and database transaction
+        result = client.blpop([result_key], timeout=max(window * 2, 0.01))
+        if result is not None:
+            error = json.loads(result[1]).get('error')
+            if error:
+                raise CoalescedDepositError(error)
+            return
+
+    raise CoalescedDepositTimeout('The deposit timed out.')
+
+
+def _lead(client, queue_key, wallet_uuid, apply_deposit, ttl) -> None:
+    items = [json.loads(item) for item in client.eval(POP_ALL_SCRIPT, 1, queue_key)]
+    if not items:
+        return
+
+    outcome = {}
+    try:
+        apply_deposit(wallet_uuid, sum(item['amount'] for item in items))
+    except Exception as e:
+        outcome['error'] = str(e)
+
+    pipeline = client.pipeline()
+    for item in items:
+        pipeline.rpush(f'deposits:result:{item["id"]}', json.dumps(outcome))
+        pipeline.expire(f'deposits:result:{item["id"]}', ttl)
+    pipeline.execute()
@@ -0,0 +1,155 @@
+"""
+Per-wallet event streams.
+
+Settled withdrawals and deposits publish an event to the Redis channel of
+every wallet they touch once their database transaction commits. The
+``GET /api/wallets/<uuid>/events/`` endpoint streams these events to the
+client as server-sent events, so clients wait for the outcome of a
+withdrawal instead of polling the wallet.
+
+Every server process subscribes to Redis over one connection of its
+:class:`EventHub` and fans the messages out to the streams of the process,
+so an idle stream costs a queue and no database access.
+
+Events are best effort: a client that (re)connects should read the wallet
+once after the stream has started. Without the Redis cache nothing is
+published and the endpoint is not available.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction as db_transaction
+
+from .cache import get_redis_client, get_redis_url
+from .money import from_minor
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'wallet-events:'
+
+# events of a slow client beyond this are dropped
+QUEUE_SIZE = 100
+
+
+def channel_name(wallet_uuid) -> str:
+    return f'{CHANNEL_PREFIX}{wallet_uuid}'
+
+
+def publish(wallet_uuid, event: str, data: dict) -> None:
+    """
+    Publish an event to the stream of the wallet once the current database
+    transaction commits.
+    """
+    client = get_redis_client()
+    if client is None:
+        return
+
+    message = json.dumps({'event': event, 'data': data}, cls=DjangoJSONEncoder)
+
+    def send():
+        try:
+            client.publish(channel_name(wallet_uuid), message)
+        except Exception as e:
+            logger.warning("Publishing %s event of wallet %s failed: %s", event, wallet_uuid, e)
+
+    db_transaction.on_commit(send)
+
+
+def publish_transaction(transaction) -> None:
+    data = {
+        'uuid': transaction.uuid,
+        'sender': transaction.sender_id,
+        'receiver': transaction.receiver_id,
+        'amount': from_minor(transaction.amount),
+        'status': transaction.status,
+        'error_message': transaction.error_message,
+    }
+    publish(transaction.sender_id, 'transaction', data)
+    if transaction.status == transaction.Status.SUCCESS:
+        publish(transaction.receiver_id, 'transaction', data)
+
+
+def publish_deposit(wallet_uuid, amount, balance) -> None:
+    publish(wallet_uuid, 'deposit', {
+        'wallet': wallet_uuid,
+        'amount': from_minor(amount),
+        'balance': from_minor(balance),
+    })
+
+
+class EventHub:
+    """
+    Shares one Redis subscription between the event streams of an event
+    loop.
+    """
+
+    def __init__(self, url):
+        import redis.asyncio
+
+        self.client = redis.asyncio.from_url(url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.queues = defaultdict(set)
+        self.lock = asyncio.Lock()
+        self.reader = None
+
+    async def subscribe(self, wallet_uuid) -> asyncio.Queue:
+        queue = asyncio.Queue(QUEUE_SIZE)
+        channel = channel_name(wallet_uuid)
+        async with self.lock:
+            if not self.queues[channel]:
+                await self.pubsub.subscribe(channel)
+            self.queues[channel].add(queue)
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self.read())
+        return queue
+
+    async def unsubscribe(self, wallet_uuid, queue: asyncio.Queue) -> None:
+        channel = channel_name(wallet_uuid)
+        async with self.lock:
+            self.queues[channel].discard(queue)
+            if not self.queues[channel]:
+                del self.queues[channel]
+                await self.pubsub.unsubscribe(channel)
+
+    async def read(self) -> None:
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Reading wallet events failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if message is None or message['type'] != 'message':
+                continue
+
+            channel = message['channel'].decode()
+            for queue in list(self.queues.get(channel, ())):
+                try:
+                    queue.put_nowait(message['data'])
+                except asyncio.QueueFull:
+                    logger.warning("Dropped an event of %s for a slow client.", channel)
+
+
+_hubs = {}
+
+
+def get_hub():
+    """
+    Return the hub of the running event loop, or ``None`` without the Redis
+    cache.
+    """
+    url = get_redis_url()
+    if url is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        # drop the hubs of closed loops, e.g. of earlier test cases
+        for closed in [other for other in _hubs if other.is_closed()]:
+            del _hubs[closed]
+        _hubs[loop] = EventHub(url)
+    return _hubs[loop]
@@ -0,0 +1,52 @@
+"""
+Per-sender settlement lanes.
+
+With ``WITHDRAWAL_LANES`` set, every withdrawal is published to the
+``settlement-lane-<n>`` queue of its sender instead of the shared
+``settlement`` queue. Each lane queue is consumed by a single worker
+process with the ``solo`` pool (see ``manage.py settlement_lanes``), so the
+withdrawals of a sender run one after another in the order of their ETAs,
+and different senders run in parallel on different lanes without waiting
+for each other's sender row lock.
+
+The lane of a sender is chosen by jump consistent hashing of its UUID, so
+changing the number of lanes only moves the senders which have to move:
+going from ``n`` to ``n + 1`` lanes moves about ``1 / (n + 1)`` of them.
+Withdrawals already waiting on a lane are still executed there.
+"""
+import uuid
+
+from django.conf import settings
+
+QUEUE_PREFIX = 'settlement-lane-'
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Map the 64-bit ``key`` to one of ``buckets`` buckets (Lamping and Veach,
+    "A Fast, Minimal Memory, Consistent Hash Algorithm").
+    """
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return bucket
+
+
+def lane_of(sender_id, lanes: int) -> int:
+    return jump_hash(uuid.UUID(str(sender_id)).int & 0xFFFFFFFFFFFFFFFF, lanes)
+
+
+def queue_name(lane: int) -> str:
+    return f'{QUEUE_PREFIX}{lane}'
+
+
+def routing(sender_id) -> dict:
+    """
+    Return the ``apply_async`` options routing a withdrawal of the sender to
+    its lane, or no options (the ``settlement`` queue) without lanes.
+    """
+    if not settings.WITHDRAWAL_LANES:
+        return {}
+    return {'queue': queue_name(lane_of(sender_id, settings.WITHDRAWAL_LANES))}
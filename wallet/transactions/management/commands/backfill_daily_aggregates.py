@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from transactions.models import WalletDailyAggregate
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the daily balance aggregates of all wallets from the settled '
+        'transactions. Run it while no withdrawals are processed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to backfill the aggregates on.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            count = WalletDailyAggregate.objects.db_manager(options['database']).backfill()
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {count} daily aggregates'))
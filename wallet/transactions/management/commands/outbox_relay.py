@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from transactions.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = 'Publish the scheduled withdrawals of the outbox to the broker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Maximum number of withdrawals published per batch.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.5,
+            help='Seconds to wait when the outbox is empty.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Publish the available withdrawals and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # like a request, every batch releases its connection afterwards
+            close_old_connections()
+            published = relay_outbox(options['batch_size'])
+            if published:
+                self.stdout.write(f'Published {published} withdrawals')
+            if published < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,106 @@
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.money import from_minor
+from transactions.reconciliation import reconcile, uuid_ranges
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify that the balance of every wallet equals its deposits plus its '
+        'successful incoming minus outgoing transactions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ranges',
+            type=int,
+            default=256,
+            help='Number of wallet UUID ranges to split the audit into.',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes verifying the ranges.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='reconcile-checkpoint.json',
+            help='File recording the verified ranges. An existing checkpoint '
+                 'of the same number of ranges is resumed.',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint.',
+        )
+        parser.add_argument(
+            '--report',
+            default=None,
+            help='Write the discrepancies as CSV to this file instead of stdout.',
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to reconcile.',
+        )
+
+    def handle(self, *args, **options):
+        ranges = uuid_ranges(options['ranges'])
+        checkpoint = self.load_checkpoint(options)
+        done = checkpoint['done']
+        pending = [(low, high) for low, high in ranges if str(low) not in done]
+        if done:
+            self.stdout.write(f'Resuming: {len(done)} of {len(ranges)} ranges already verified')
+
+        for result in reconcile(pending, options['processes'], options['database']):
+            done[result['low']] = result
+            self.save_checkpoint(options['checkpoint'], checkpoint)
+            self.stderr.write(f'{len(done)}/{len(ranges)} ranges verified', ending='\r')
+        self.stderr.write('')
+
+        wallets = sum(result['wallets'] for result in done.values())
+        discrepancies = sorted(
+            discrepancy for result in done.values() for discrepancy in result['discrepancies'])
+        self.write_report(options['report'], discrepancies)
+
+        summary = f'Verified {wallets} wallets, {len(discrepancies)} discrepancies'
+        if discrepancies:
+            raise CommandError(summary, returncode=2)
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def load_checkpoint(self, options):
+        empty = {'ranges': options['ranges'], 'done': {}}
+        if options['restart'] or not os.path.exists(options['checkpoint']):
+            return empty
+        with open(options['checkpoint']) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('ranges') != options['ranges']:
+            raise CommandError(
+                f'The checkpoint {options["checkpoint"]} has {checkpoint.get("ranges")} ranges, '
+                f'use --ranges {checkpoint.get("ranges")} or --restart.')
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        # replace the file atomically, so an interrupted run keeps a valid checkpoint
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(f'{path}.tmp', path)
+
+    def write_report(self, path, discrepancies):
+        if not path and not discrepancies:
+            return
+        f = open(path, 'w', newline='') if path else self.stdout
+        try:
+            writer = csv.writer(f)
+            writer.writerow(['wallet', 'balance', 'expected', 'difference'])
+            for wallet, balance, expected in discrepancies:
+                writer.writerow([wallet, from_minor(balance), from_minor(expected),
+                                 from_minor(balance - expected)])
+        finally:
+            if path:
+                f.close()
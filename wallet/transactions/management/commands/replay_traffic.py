@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import traffic
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay captured API traffic (see TRAFFIC_CAPTURE_PATH) against a '
+        'running stack, keeping the order of the requests of every wallet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help='The JSON lines file of captured requests.')
+        parser.add_argument(
+            '--base-url',
+            default='http://localhost:8000',
+            help='The stack to replay the requests against.',
+        )
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=1.0,
+            help='Time scale of the replay, e.g. 10 for ten times as fast; '
+                 '0 sends the requests as fast as possible.',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Number of threads sending requests.',
+        )
+        parser.add_argument(
+            '--initial-balance',
+            type=Decimal,
+            default=Decimal('1000000.00'),
+            help='Balance deposited into every wallet before the replay.',
+        )
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0 or options['concurrency'] < 1:
+            raise CommandError('--speed must not be negative and --concurrency must be positive.')
+        try:
+            records = traffic.load(options['capture'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read the capture: {e}')
+
+        base_url = options['base_url']
+        names = traffic.pseudonyms(records)
+        self.stdout.write(f'Creating {len(names)} wallets on {base_url}')
+        try:
+            with requests.Session() as session:
+                wallets = traffic.create_wallets(
+                    session, base_url, names, options['initial_balance'])
+        except requests.RequestException as e:
+            raise CommandError(f'Cannot create the wallets: {e}')
+
+        self.stdout.write(f'Replaying {len(records)} requests at speed {options["speed"] or "max"}')
+        result = traffic.replay(
+            records, base_url, wallets, options['speed'], options['concurrency'])
+
+        latencies = result['latencies']
+        rate = result['requests'] / result['elapsed'] if result['elapsed'] else 0
+        self.stdout.write(f'{result["requests"]} requests in {result["elapsed"]:.1f}s ({rate:.0f}/s)')
+        for status, count in sorted(result['statuses'].items(), key=str):
+            self.stdout.write(f'  {status}: {count}')
+        if latencies:
+            self.stdout.write('Latency (ms): ' + ', '.join(
+                f'p{p} {latencies[min(len(latencies) - 1, len(latencies) * p // 100)]:.1f}'
+                for p in (50, 95, 99)
+            ))
@@ -0,0 +1,82 @@
+import signal
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.lanes import queue_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Run one solo Celery worker per settlement lane (see WITHDRAWAL_LANES) '
+        'and restart the workers which exit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lanes',
+            default=None,
+            help='The lanes to run, e.g. "0-7", by default all of them. Lets '
+                 'several containers share the lanes.',
+        )
+        parser.add_argument(
+            '--loglevel',
+            default='info',
+            help='Log level of the workers.',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.WITHDRAWAL_LANES:
+            raise CommandError('Settlement lanes are disabled, set WITHDRAWAL_LANES.')
+        lanes = self.parse_lanes(options['lanes'])
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        workers = {lane: self.start(lane, options['loglevel']) for lane in lanes}
+        self.stdout.write(f'Started lanes {lanes[0]}-{lanes[-1]}')
+        while not self.stopping:
+            time.sleep(1)
+            for lane, worker in workers.items():
+                if worker.poll() is not None and not self.stopping:
+                    self.stderr.write(f'Lane {lane} exited with {worker.returncode}, restarting')
+                    workers[lane] = self.start(lane, options['loglevel'])
+
+        # a warm shutdown lets every lane finish its current withdrawal
+        for worker in workers.values():
+            if worker.poll() is None:
+                worker.send_signal(signal.SIGTERM)
+        for worker in workers.values():
+            worker.wait()
+
+    def parse_lanes(self, value):
+        if value is None:
+            return list(range(settings.WITHDRAWAL_LANES))
+        first, _, last = value.partition('-')
+        try:
+            lanes = list(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise CommandError(f'Invalid lanes "{value}", expected e.g. "3" or "0-7".')
+        if not lanes or lanes[-1] >= settings.WITHDRAWAL_LANES:
+            raise CommandError(f'The lanes must be within 0-{settings.WITHDRAWAL_LANES - 1}.')
+        return lanes
+
+    def start(self, lane, loglevel):
+        # the solo pool runs one withdrawal at a time; gossip, mingle and
+        # heartbeats would only add chatter between the many lane workers
+        return subprocess.Popen([
+            sys.executable, '-m', 'celery', '-A', 'wallet', 'worker',
+            '--pool', 'solo',
+            '--queues', queue_name(lane),
+            '--hostname', f'lane{lane}@%h',
+            '--loglevel', loglevel,
+            '--prefetch-multiplier', '1',
+            '--without-gossip', '--without-mingle', '--without-heartbeat',
+        ])
+
+    def stop(self, signum, frame):
+        self.stopping = True
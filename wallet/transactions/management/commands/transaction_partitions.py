@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transactions.partitions import detach_partitions, ensure_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the monthly partitions of the transaction table for the '
+        'upcoming months and detach the partitions older than the retention '
+        'period.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Number of future months to create partitions for.',
+        )
+        parser.add_argument(
+            '--retain-months',
+            type=int,
+            default=None,
+            help='Detach partitions that ended more than this many months ago. '
+                 'Nothing is detached if omitted.',
+        )
+        parser.add_argument(
+            '--archive-schema',
+            default=None,
+            help='Move detached partitions to this schema.',
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to manage the partitions on.',
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+
+        for name in ensure_partitions(options['months_ahead'], using=using):
+            self.stdout.write(self.style.SUCCESS(f'Created partition {name}'))
+
+        if options['retain_months'] is not None:
+            before = month_start(timezone.now(), -options['retain_months'])
+            for name in detach_partitions(before, options['archive_schema'], using=using):
+                self.stdout.write(self.style.SUCCESS(f'Detached partition {name}'))
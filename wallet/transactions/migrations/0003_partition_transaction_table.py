@@ -0,0 +1,101 @@
+"""
+Convert ``transactions_transaction`` into a table declaratively partitioned
+by month on ``created``.
+
+The existing table is not copied. It is renamed to
+``transactions_transaction_legacy`` and attached as the partition covering
+everything up to the start of next month, so the migration only has to
+replace its primary key index with one on ``(uuid, created)``. Attaching
+would scan the whole legacy table under an ``ACCESS EXCLUSIVE`` lock to
+check the partition bound, so the bound is first added as a ``NOT VALID``
+check constraint and validated, which scans the table while it still
+accepts writes, and the attach then skips the scan. New months
+get their own partitions (see ``manage.py transaction_partitions``) and
+anything that does not match a monthly partition lands in
+``transactions_transaction_default``.
+
+PostgreSQL requires the partition key to be part of every unique constraint,
+so the primary key becomes ``(uuid, created)``. Django keeps treating
+``uuid`` as the primary key, which is safe because UUIDs are generated with
+``uuid4``.
+"""
+from django.db import migrations, transaction
+from django.utils import timezone
+
+TABLE = 'transactions_transaction'
+LEGACY = f'{TABLE}_legacy'
+DEFAULT = f'{TABLE}_default'
+BOUND = f'{TABLE}_legacy_bound'
+
+
+def month_start(value, months=0):
+    value = timezone.localtime(value).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_table(apps, schema_editor):
+    next_month = month_start(timezone.now(), 1)
+    month_after = month_start(timezone.now(), 2)
+
+    # each in its own transaction: validating only takes a SHARE UPDATE
+    # EXCLUSIVE lock, which doesn't block reads or writes
+    schema_editor.execute(
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {BOUND} "
+        f"CHECK (created < '{next_month.isoformat()}') NOT VALID")
+    schema_editor.execute(f'ALTER TABLE {TABLE} VALIDATE CONSTRAINT {BOUND}')
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for statement in partition_statements(next_month, month_after):
+            schema_editor.execute(statement)
+
+
+def partition_statements(next_month, month_after):
+    return [
+        f'ALTER TABLE {TABLE} RENAME TO {LEGACY}',
+        f'ALTER TABLE {LEGACY} DROP CONSTRAINT {TABLE}_pkey',
+        f'CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE (created)',
+        # the bound is copied with the other constraints, the parent doesn't need it
+        f'ALTER TABLE {TABLE} DROP CONSTRAINT {BOUND}',
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (uuid, created)',
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_sender_id_fk FOREIGN KEY (sender_id) '
+        f'REFERENCES transactions_wallet (uuid) DEFERRABLE INITIALLY DEFERRED',
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_receiver_id_fk FOREIGN KEY (receiver_id) '
+        f'REFERENCES transactions_wallet (uuid) DEFERRABLE INITIALLY DEFERRED',
+        f'CREATE INDEX {TABLE}_sender_id_idx ON {TABLE} (sender_id)',
+        f'CREATE INDEX {TABLE}_receiver_id_idx ON {TABLE} (receiver_id)',
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{next_month.isoformat()}')",
+        f'ALTER TABLE {LEGACY} DROP CONSTRAINT {BOUND}',
+        f"CREATE TABLE {TABLE}_p{next_month:%Y%m} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{next_month.isoformat()}') TO ('{month_after.isoformat()}')",
+        f'CREATE TABLE {DEFAULT} PARTITION OF {TABLE} DEFAULT',
+    ]
+
+
+def unpartition_table(apps, schema_editor):
+    partitioned = f'{TABLE}_partitioned'
+
+    schema_editor.execute(f'ALTER TABLE {TABLE} RENAME TO {partitioned}')
+    schema_editor.execute(
+        f'ALTER TABLE {partitioned} RENAME CONSTRAINT {TABLE}_pkey TO {partitioned}_pkey')
+    model = apps.get_model('transactions', 'Transaction')
+    schema_editor.create_model(model)
+    # the column order of the partitioned table may differ, e.g. after 0007
+    columns = ', '.join(field.column for field in model._meta.local_concrete_fields)
+    schema_editor.execute(f'INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {partitioned}')
+    schema_editor.execute(f'DROP TABLE {partitioned}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0002_add_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table, elidable=False),
+    ]
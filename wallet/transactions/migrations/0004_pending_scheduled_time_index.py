@@ -0,0 +1,63 @@
+"""
+Add the partial index of the pending withdrawals by scheduled time to the
+partitioned transaction table without blocking writes.
+
+Like in 0012, the index of the parent is created ``ON ONLY`` the parent, and
+the index of every partition is built ``CONCURRENTLY`` and then attached,
+which makes the parent index valid. Partitions created afterwards get the
+index when they are attached.
+
+The migration is not atomic, ``CREATE INDEX CONCURRENTLY`` can't run in a
+transaction.
+"""
+from django.db import migrations, models
+
+TABLE = 'transactions_transaction'
+INDEX = 'pending_scheduled_time_idx'
+DEFINITION = "(scheduled_time) WHERE status = 'PENDING'"
+
+
+def partitions(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT inhrelid::regclass::text FROM pg_inherits '
+            'WHERE inhparent = %s::regclass ORDER BY 1',
+            [TABLE],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def create_index(apps, schema_editor):
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY {TABLE} {DEFINITION}')
+    for partition in partitions(schema_editor):
+        # named like the indexes PostgreSQL creates when a partition is attached
+        name = f'{partition}_scheduled_time_idx'
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {partition} {DEFINITION}')
+        schema_editor.execute(f'ALTER INDEX {INDEX} ATTACH PARTITION {name}')
+
+
+def drop_index(apps, schema_editor):
+    # drops the attached indexes of the partitions too
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0003_partition_transaction_table'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_index, drop_index, elidable=False),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='transaction',
+                    index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['scheduled_time'], name='pending_scheduled_time_idx'),
+                ),
+            ],
+        ),
+    ]
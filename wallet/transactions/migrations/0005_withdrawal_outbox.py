@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-19 03:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_pending_scheduled_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WithdrawalOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('eta', models.DateTimeField(help_text='The time the withdrawal is scheduled at.', verbose_name='ETA')),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='The number of failed publish attempts.', verbose_name='Attempts')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='The time of the next publish attempt.', verbose_name='Available At')),
+                ('last_error', models.TextField(blank=True, help_text='The error of the last failed publish attempt.', verbose_name='Last Error')),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='The date and time when this object was created.', verbose_name='Created')),
+                ('transaction', models.ForeignKey(db_constraint=False, help_text='The withdrawal to schedule.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transactions.transaction', verbose_name='Transaction')),
+            ],
+            options={
+                'verbose_name': 'Withdrawal Outbox Entry',
+                'verbose_name_plural': 'Withdrawal Outbox',
+                'indexes': [models.Index(fields=['available_at', 'id'], name='outbox_available_at_idx')],
+            },
+        ),
+    ]
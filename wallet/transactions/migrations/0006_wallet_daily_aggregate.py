@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-19 03:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_withdrawal_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('inflow', models.DecimalField(decimal_places=2, default=0, help_text='The total amount received on the day.', max_digits=14, verbose_name='Inflow')),
+                ('outflow', models.DecimalField(decimal_places=2, default=0, help_text='The total amount sent on the day.', max_digits=14, verbose_name='Outflow')),
+                ('closing_balance', models.DecimalField(decimal_places=2, help_text='The balance of the wallet at the end of the day.', max_digits=10, verbose_name='Closing Balance')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_aggregates', to='transactions.wallet', verbose_name='Wallet')),
+            ],
+            options={
+                'verbose_name': 'Wallet Daily Aggregate',
+                'verbose_name_plural': 'Wallet Daily Aggregates',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='walletdailyaggregate',
+            constraint=models.UniqueConstraint(fields=('wallet', 'day'), name='unique_wallet_day'),
+        ),
+    ]
@@ -0,0 +1,162 @@
+"""
+Store balances and amounts as ``bigint`` minor units instead of
+``numeric(10, 2)``.
+
+Converting the columns in place with ``ALTER COLUMN ... TYPE`` would
+rewrite the wallets, the whole transaction ledger and the aggregates under
+``ACCESS EXCLUSIVE`` locks. So every table is converted in stages, and only
+the last one takes a lock, for metadata changes only:
+
+1. A nullable ``bigint`` column is added next to every column.
+2. A trigger writes ``column * 100`` to the new column on every insert and
+   update, so rows written by the running code are converted too.
+3. The existing rows are converted in batches of ``BATCH_SIZE``, in the
+   order of their primary keys, each batch in its own transaction.
+4. The ``NOT NULL`` and check constraints of the new columns are added
+   ``NOT VALID`` and validated, which scans the table without blocking
+   writes.
+5. In one short transaction for all tables, the trigger and the old columns
+   are dropped and the new columns and constraints take the old names.
+   ``SET NOT NULL`` uses the validated constraint instead of a scan.
+
+Deploy the code storing minor units right after the migration: once the
+columns are swapped, the old code would write major units. The migration is
+not atomic, a failed run has to be cleaned up before running it again.
+
+Reversing converts the columns back in place with ``ALTER COLUMN ... TYPE``,
+which rewrites the tables under ``ACCESS EXCLUSIVE`` locks, and fails if a
+value does not fit into ``numeric(10, 2)`` anymore.
+"""
+from django.db import migrations, models, transaction
+
+import transactions.validators
+
+BATCH_SIZE = 10000
+
+# table: (primary key column, converted columns, check constraints of the columns)
+TABLES = {
+    'transactions_wallet': ('uuid', ['balance'], {'positive_balance': '{balance} >= 0'}),
+    'transactions_transaction': ('uuid', ['amount'], {'positive_amount': '{amount} >= 0'}),
+    'transactions_walletdailyaggregate': ('id', ['inflow', 'outflow', 'closing_balance'], {}),
+}
+
+
+def minor(name):
+    return f'{name}_minor'
+
+
+def convert_columns(apps, schema_editor):
+    for table, (pk, columns, checks) in TABLES.items():
+        add_columns(schema_editor, table, columns)
+        backfill(schema_editor, table, pk, columns)
+        add_constraints(schema_editor, table, columns, checks)
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for table, (pk, columns, checks) in TABLES.items():
+            swap_columns(schema_editor, table, columns, checks)
+
+
+def add_columns(schema_editor, table, columns):
+    schema_editor.execute(
+        f'ALTER TABLE {table} '
+        + ', '.join(f'ADD COLUMN {minor(column)} bigint' for column in columns))
+    schema_editor.execute(
+        f'CREATE FUNCTION {minor(table)}() RETURNS trigger AS $$ BEGIN '
+        + ' '.join(f'NEW.{minor(column)} := (NEW.{column} * 100)::bigint;' for column in columns)
+        + ' RETURN NEW; END $$ LANGUAGE plpgsql')
+    schema_editor.execute(
+        f'CREATE TRIGGER {minor(table)} BEFORE INSERT OR UPDATE ON {table} '
+        f'FOR EACH ROW EXECUTE FUNCTION {minor(table)}()')
+
+
+def backfill(schema_editor, table, pk, columns):
+    assignments = ', '.join(f'{minor(column)} = ({column} * 100)::bigint' for column in columns)
+    last = None
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f'WITH batch AS ('
+                f'SELECT {pk} FROM {table} {"" if last is None else f"WHERE {pk} > %(last)s"} '
+                f'ORDER BY {pk} LIMIT %(size)s) '
+                f'UPDATE {table} SET {assignments} FROM batch WHERE {table}.{pk} = batch.{pk} '
+                f'RETURNING {table}.{pk}',
+                {'last': last, 'size': BATCH_SIZE},
+            )
+            keys = [key for key, in cursor.fetchall()]
+            if not keys:
+                return
+            last = max(keys)
+
+
+def add_constraints(schema_editor, table, columns, checks):
+    constraints = {f'{minor(column)}_not_null': f'{minor(column)} IS NOT NULL' for column in columns}
+    for name, check in checks.items():
+        constraints[minor(name)] = check.format(**{column: minor(column) for column in columns})
+
+    for name, check in constraints.items():
+        schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({check}) NOT VALID')
+        schema_editor.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}')
+
+
+def swap_columns(schema_editor, table, columns, checks):
+    schema_editor.execute(f'DROP TRIGGER {minor(table)} ON {table}')
+    schema_editor.execute(f'DROP FUNCTION {minor(table)}()')
+    # drops the check constraints of the old columns too
+    schema_editor.execute(
+        f'ALTER TABLE {table} ' + ', '.join(f'DROP COLUMN {column}' for column in columns))
+    for column in columns:
+        schema_editor.execute(f'ALTER TABLE {table} RENAME COLUMN {minor(column)} TO {column}')
+        schema_editor.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL')
+        schema_editor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {minor(column)}_not_null')
+    for name in checks:
+        schema_editor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {minor(name)} TO {name}')
+
+
+def revert_columns(apps, schema_editor):
+    for table, (pk, columns, checks) in TABLES.items():
+        schema_editor.execute(
+            f'ALTER TABLE {table} '
+            + ', '.join(f'ALTER COLUMN {column} TYPE numeric(10, 2) USING {column} / 100.0' for column in columns))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0006_wallet_daily_aggregate'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(convert_columns, revert_columns, elidable=False),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='wallet',
+                    name='balance',
+                    field=models.BigIntegerField(default=0, help_text='The current balance of the wallet in minor units.', validators=[transactions.validators.validate_non_negative_amount], verbose_name='Balance'),
+                ),
+                migrations.AlterField(
+                    model_name='transaction',
+                    name='amount',
+                    field=models.BigIntegerField(help_text='The amount of the transaction in minor units.', validators=[transactions.validators.validate_positive_amount], verbose_name='Amount'),
+                ),
+                migrations.AlterField(
+                    model_name='walletdailyaggregate',
+                    name='inflow',
+                    field=models.BigIntegerField(default=0, help_text='The total amount received on the day in minor units.', verbose_name='Inflow'),
+                ),
+                migrations.AlterField(
+                    model_name='walletdailyaggregate',
+                    name='outflow',
+                    field=models.BigIntegerField(default=0, help_text='The total amount sent on the day in minor units.', verbose_name='Outflow'),
+                ),
+                migrations.AlterField(
+                    model_name='walletdailyaggregate',
+                    name='closing_balance',
+                    field=models.BigIntegerField(help_text='The balance of the wallet at the end of the day in minor units.', verbose_name='Closing Balance'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-19 03:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deposit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField(help_text='The amount of the deposit in minor units.', verbose_name='Amount')),
+                ('kind', models.CharField(choices=[('DEPOSIT', 'Deposit'), ('OPENING', 'Opening Balance')], default='DEPOSIT', max_length=10, verbose_name='Kind')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('wallet', models.ForeignKey(help_text='The wallet the amount was deposited to.', on_delete=django.db.models.deletion.CASCADE, related_name='deposits', to='transactions.wallet', verbose_name='Wallet')),
+            ],
+            options={
+                'verbose_name': 'Deposit',
+                'verbose_name_plural': 'Deposits',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='deposit',
+            constraint=models.CheckConstraint(check=models.Q(('amount__gt', 0), ('kind', 'OPENING'), _connector='OR'), name='positive_deposit_amount', violation_error_message='The amount must be positive. Got %(show_value)s.'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+"""
+Record the part of every wallet balance which is not explained by settled
+transactions as an ``OPENING`` deposit, since deposits were not recorded
+before ``0008_deposit``.
+
+The balances and the transaction sums are read by the same statement, so
+they are consistent even while withdrawals settle. Transactions of already
+detached partitions are not in the sums, so their net amounts end up in the
+opening deposits too.
+"""
+from django.db import migrations
+
+OPENING_BALANCES_SQL = """
+    WITH incoming AS (
+        SELECT receiver_id AS wallet_id, sum(amount) AS amount
+        FROM transactions_transaction WHERE status = 'SUCCESS'
+        GROUP BY receiver_id
+    ), outgoing AS (
+        SELECT sender_id AS wallet_id, sum(amount) AS amount
+        FROM transactions_transaction WHERE status = 'SUCCESS'
+        GROUP BY sender_id
+    ), openings AS (
+        SELECT wallet.uuid AS wallet_id,
+               wallet.balance - coalesce(incoming.amount, 0) + coalesce(outgoing.amount, 0) AS amount
+        FROM transactions_wallet AS wallet
+        LEFT JOIN incoming ON incoming.wallet_id = wallet.uuid
+        LEFT JOIN outgoing ON outgoing.wallet_id = wallet.uuid
+    )
+    INSERT INTO transactions_deposit (wallet_id, amount, kind, created)
+    SELECT wallet_id, amount, 'OPENING', now() FROM openings WHERE amount <> 0
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_deposit'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=OPENING_BALANCES_SQL,
+            reverse_sql="DELETE FROM transactions_deposit WHERE kind = 'OPENING'",
+        ),
+    ]
@@ -0,0 +1,39 @@
+"""
+Record the sender of every outbox entry, so the relay can route the
+withdrawal to the settlement lane of the sender without reading the
+partitioned transaction table. Existing entries are filled in from their
+transactions.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+FILL_SENDERS_SQL = """
+    UPDATE transactions_withdrawaloutbox AS outbox
+    SET sender_id = transaction.sender_id
+    FROM transactions_transaction AS transaction
+    WHERE transaction.uuid = outbox.transaction_id
+"""
+
+
+class Migration(migrations.Migration):
+    # the deferred foreign key checks of the filled in rows would make the
+    # final ALTER TABLE fail inside the same transaction
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0009_opening_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawaloutbox',
+            name='sender',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transactions.wallet', verbose_name='Sender'),
+        ),
+        migrations.RunSQL(FILL_SENDERS_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='withdrawaloutbox',
+            name='sender',
+            field=models.ForeignKey(db_index=False, help_text='The sender of the withdrawal, selects its settlement lane.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transactions.wallet', verbose_name='Sender'),
+        ),
+    ]
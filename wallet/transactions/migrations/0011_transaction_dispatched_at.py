@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_outbox_sender'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='The time the fair dispatcher last sent the withdrawal to the workers.', null=True, verbose_name='Dispatched At'),
+        ),
+    ]
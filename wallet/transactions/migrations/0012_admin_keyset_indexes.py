@@ -0,0 +1,67 @@
+"""
+Add the ``(scheduled_time, uuid)`` index of the admin's keyset pages to the
+partitioned transaction table without blocking writes.
+
+A plain ``CREATE INDEX`` on the partitioned table locks every partition
+against writes while it builds, and ``CONCURRENTLY`` isn't supported on
+partitioned tables. So the index of the parent is created ``ON ONLY`` the
+parent, which builds nothing and stays invalid, the index of every partition
+is built concurrently and then attached, and the parent index becomes valid
+once all partitions have theirs. Partitions created afterwards get the index
+when they are attached (see :mod:`transactions.partitions`).
+
+The migration is not atomic, ``CREATE INDEX CONCURRENTLY`` can't run in a
+transaction. It can be run again after a failure: a concurrent build that
+failed leaves an invalid index which must be dropped first.
+"""
+from django.db import migrations, models
+
+TABLE = 'transactions_transaction'
+INDEX = 'scheduled_time_idx'
+COLUMNS = '(scheduled_time, uuid)'
+
+
+def partitions(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT inhrelid::regclass::text FROM pg_inherits '
+            'WHERE inhparent = %s::regclass ORDER BY 1',
+            [TABLE],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def create_index(apps, schema_editor):
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY {TABLE} {COLUMNS}')
+    for partition in partitions(schema_editor):
+        # named like the indexes PostgreSQL creates when a partition is attached
+        name = f'{partition}_scheduled_time_uuid_idx'
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {partition} {COLUMNS}')
+        schema_editor.execute(f'ALTER INDEX {INDEX} ATTACH PARTITION {name}')
+
+
+def drop_index(apps, schema_editor):
+    # drops the attached indexes of the partitions too
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0011_transaction_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_index, drop_index, elidable=False),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='transaction',
+                    index=models.Index(fields=['scheduled_time', 'uuid'], name='scheduled_time_idx'),
+                ),
+            ],
+        ),
+    ]
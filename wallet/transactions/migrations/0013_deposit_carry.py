@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-19 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0012_admin_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='deposit',
+            name='positive_deposit_amount',
+        ),
+        migrations.AlterField(
+            model_name='deposit',
+            name='kind',
+            field=models.CharField(choices=[('DEPOSIT', 'Deposit'), ('OPENING', 'Opening Balance'), ('CARRY', 'Carried Forward')], default='DEPOSIT', max_length=10, verbose_name='Kind'),
+        ),
+        migrations.AddConstraint(
+            model_name='deposit',
+            constraint=models.CheckConstraint(check=models.Q(('amount__gt', 0), ('kind__in', ['OPENING', 'CARRY']), _connector='OR'), name='positive_deposit_amount', violation_error_message='The amount must be positive. Got %(show_value)s.'),
+        ),
+    ]
@@ -1,9 +1,13 @@
 import uuid
 
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db import models, transaction
-from django.db.models import Q, F
+from django.core.exceptions import ValidationError
+from django.db import DataError, connections, models, router, transaction
+from django.db.models import Case, F, Q, Value, When
 
+from . import events
+from .money import from_minor
 from .validators import (
     validate_positive_amount,
     validate_non_negative_amount,
@@ -41,25 +45,160 @@ class UUIDModel(models.Model):
         abstract = True
 
 
+class WalletManager(models.Manager):
+    DEPOSIT_SQL = """
+        WITH wallet AS (
+            UPDATE {table} SET balance = balance + %(amount)s, updated = %(now)s
+            WHERE uuid = %(uuid)s
+            RETURNING uuid, balance
+        ), deposit AS (
+            INSERT INTO {deposit_table} (wallet_id, amount, kind, created)
+            SELECT uuid, %(amount)s, %(kind)s, %(now)s FROM wallet
+        )
+        SELECT balance FROM wallet
+    """
+
+    @transaction.atomic
+    def deposit(self, uuid, amount):
+        """
+        Deposit the given amount to the wallet with the given UUID.
+
+        Returns:
+            int: The new balance of the wallet in minor units.
+
+        Raises:
+            Wallet.DoesNotExist: If no wallet with the given UUID exists.
+            ValidationError: If the amount is not positive or the balance
+                would exceed its maximum.
+
+        The balance is incremented and the :class:`Deposit` recorded by a
+        single statement, which also locks the wallet row until the
+        transaction is committed, and the daily aggregate of the wallet is updated in the same
+        transaction. The balance limits are enforced by the database. A
+        ``deposit`` event is published to the wallet's stream on commit.
+        """
+        validate_positive_amount(amount)
+        using = self._db or router.db_for_write(self.model)
+        try:
+            with connections[using].cursor() as cursor:
+                cursor.execute(
+                    self.DEPOSIT_SQL.format(
+                        table=self.model._meta.db_table,
+                        deposit_table=Deposit._meta.db_table,
+                    ),
+                    {'amount': amount, 'now': timezone.now(), 'uuid': uuid,
+                     'kind': Deposit.Kind.DEPOSIT},
+                )
+                row = cursor.fetchone()
+        except DataError:
+            raise ValidationError({'balance': _('The balance would exceed its maximum.')})
+        if row is None:
+            raise self.model.DoesNotExist(f'Wallet {uuid} does not exist.')
+
+        WalletDailyAggregate.objects.db_manager(using).record_changes([(uuid, amount, 0, row[0])])
+        events.publish_deposit(uuid, amount, row[0])
+        return row[0]
+
+    @transaction.atomic
+    def transfer(self, sender_uuid, receiver_uuid, amount):
+        """
+        Transfer the given amount between two wallets immediately, without
+        the transaction service.
+
+        Returns:
+            Transaction: The successful transaction of the transfer.
+
+        Raises:
+            Wallet.DoesNotExist: If one of the wallets does not exist.
+            ValidationError: If the amount is not positive, the wallets are
+                the same or the sender has insufficient funds.
+
+        Both wallets are locked in the order of their UUIDs, so concurrent
+        transfers in opposite directions can't deadlock, and settled like a
+        withdrawal in the same database transaction.
+        """
+        validate_positive_amount(amount)
+        if str(sender_uuid) == str(receiver_uuid):
+            raise ValidationError(_("Sender and receiver must be different."))
+
+        wallets = {
+            str(wallet.uuid): wallet
+            for wallet in self.select_for_update().filter(
+                uuid__in=[sender_uuid, receiver_uuid]).order_by('uuid')
+        }
+        if len(wallets) != 2:
+            raise self.model.DoesNotExist(_("Both wallets must exist."))
+        sender = wallets[str(sender_uuid)]
+        receiver = wallets[str(receiver_uuid)]
+
+        if sender.balance < amount:
+            raise ValidationError(
+                _("Insufficient funds. Available balance: %(available_balance)s. "
+                  "Required amount: %(required_amount)s."),
+                params={'available_balance': from_minor(sender.balance),
+                        'required_amount': from_minor(amount)},
+            )
+
+        sender.balance -= amount
+        receiver.balance += amount
+        self.apply_balance_changes({sender.uuid: -amount, receiver.uuid: amount})
+        WalletDailyAggregate.objects.record_changes([
+            (sender.uuid, 0, amount, sender.balance),
+            (receiver.uuid, amount, 0, receiver.balance),
+        ])
+        transfer = Transaction.objects.create(
+            sender=sender,
+            receiver=receiver,
+            amount=amount,
+            scheduled_time=timezone.now(),
+            status=Transaction.Status.SUCCESS,
+        )
+        events.publish_transaction(transfer)
+        return transfer
+
+    def touch(self, uuids):
+        """
+        Set the ``updated`` time of the wallets, e.g. when a transaction of
+        theirs is created or settled, so their ETags change.
+        """
+        return self.filter(uuid__in=uuids).update(updated=timezone.now())
+
+    def apply_balance_changes(self, changes):
+        """
+        Add the amounts of ``changes`` (wallet UUID to amount) to the
+        balances of the wallets with a single ``UPDATE``.
+
+        The wallets should be locked by the caller.
+        """
+        if not changes:
+            return 0
+        return self.filter(uuid__in=changes).update(
+            balance=F('balance') + Case(
+                *[When(uuid=uuid, then=Value(amount)) for uuid, amount in changes.items()],
+                output_field=models.BigIntegerField(),
+            ),
+            updated=timezone.now(),
+        )
+
+
 class Wallet(UUIDModel, TimeStampedModel):
-    balance = models.DecimalField(
-        max_digits=10,
-        decimal_places=2,
-        default=0.0,
+    balance = models.BigIntegerField(
+        default=0,
         verbose_name=_("Balance"),
-        help_text=_("The current balance of the wallet."),
+        help_text=_("The current balance of the wallet in minor units."),
         validators=[
             validate_non_negative_amount,
         ],
     )
 
-    @transaction.atomic
+    objects = WalletManager()
+
     def deposit(self, amount):
         """
         Deposit the given amount to the wallet.
 
         Args:
-            amount (Decimal): The amount to deposit.
+            amount (int): The amount to deposit in minor units.
 
         Raises:
             Wallet.DoesNotExist: If no wallet with the given UUID exists.
@@ -68,23 +207,29 @@ class Wallet(UUIDModel, TimeStampedModel):
         Returns:
             None
 
-        This method is decorated with `@transaction.atomic`, which ensures that the entire
-        operation is treated as a single transaction. It first validates that the amount
-        is positive using `validate_positive_amount`. Then, it retrieves the wallet with
-        the given UUID using `Wallet.objects.select_for_update().get(uuid=self.uuid)`.
-        Next, it updates the balance of the wallet by adding the given amount to it. After
-        that, it calls `full_clean()` to validate the updated balance. Finally, it saves
-        the updated wallet object.
+        See :meth:`WalletManager.deposit`. The balance of this instance is
+        set to the new balance.
+        """
+        self.balance = Wallet.objects.deposit(self.uuid, amount)
 
-        Note: The `select_for_update()` method is used to lock the wallet row in the database
-        until the transaction is committed or rolled back, preventing any concurrent
-        modifications to the wallet balance.
+    def transfer(self, receiver, amount):
         """
-        validate_positive_amount(amount)
-        wallet = Wallet.objects.select_for_update().get(uuid=self.uuid)
-        wallet.balance += amount
-        wallet.full_clean()
-        wallet.save()
+        Transfer the given amount to the receiver wallet immediately.
+
+        Args:
+            receiver (Wallet): The wallet to transfer to.
+            amount (int): The amount to transfer in minor units.
+
+        Returns:
+            Transaction: The successful transaction of the transfer.
+
+        See :meth:`WalletManager.transfer`. The balances of both instances
+        are set to the new balances.
+        """
+        transfer = Wallet.objects.transfer(self.uuid, receiver.uuid, amount)
+        self.balance = transfer.sender.balance
+        receiver.balance = transfer.receiver.balance
+        return transfer
 
     def __str__(self):
         return str(self.uuid)
@@ -127,11 +272,9 @@ class Transaction(UUIDModel, TimeStampedModel):
         verbose_name=_("Receiver Wallet"),
         help_text=_("The wallet to which the transaction is made."),
     )
-    amount = models.DecimalField(
-        max_digits=10,
-        decimal_places=2,
+    amount = models.BigIntegerField(
         verbose_name=_("Amount"),
-        help_text=_("The amount of the transaction."),
+        help_text=_("The amount of the transaction in minor units."),
         validators=[
             validate_positive_amount,
         ],
@@ -158,6 +301,13 @@ class Transaction(UUIDModel, TimeStampedModel):
         verbose_name=_("Error Message"),
         help_text=_("The error message if the transaction failed."),
     )
+    dispatched_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("Dispatched At"),
+        help_text=_("The time the fair dispatcher last sent the withdrawal to the workers."),
+    )
 
     def __str__(self):
         return str(self.uuid)
@@ -169,6 +319,16 @@ class Transaction(UUIDModel, TimeStampedModel):
         verbose_name = _("Transaction")
         verbose_name_plural = _("Transactions")
 
+        indexes = [
+            # due withdrawals lookup of the batch and fair dispatchers
+            models.Index(
+                fields=['scheduled_time'],
+                condition=Q(status='PENDING'),
+                name='pending_scheduled_time_idx',
+            ),
+            # keyset pages of the admin, also when filtered by status
+            models.Index(fields=['scheduled_time', 'uuid'], name='scheduled_time_idx'),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=Q(amount__gte=0),
@@ -185,3 +345,257 @@ class Transaction(UUIDModel, TimeStampedModel):
                 ),
             ),
         ]
+
+
+class Deposit(models.Model):
+    """
+    A deposit to a wallet.
+
+    The opening balances of the wallets from before deposits were recorded
+    are stored as deposits of the ``OPENING`` kind, and the net amount of
+    the settled transactions of a detached partition as a deposit of the
+    ``CARRY`` kind (see :func:`transactions.partitions.detach_partitions`),
+    so the balance of every wallet is the sum of its deposits and settled
+    transactions (see :mod:`transactions.reconciliation`).
+    """
+    class Kind(models.TextChoices):
+        DEPOSIT = 'DEPOSIT', _('Deposit')
+        OPENING = 'OPENING', _('Opening Balance')
+        CARRY = 'CARRY', _('Carried Forward')
+
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='deposits',
+        verbose_name=_("Wallet"),
+        help_text=_("The wallet the amount was deposited to."),
+    )
+    amount = models.BigIntegerField(
+        verbose_name=_("Amount"),
+        help_text=_("The amount of the deposit in minor units."),
+    )
+    kind = models.CharField(
+        max_length=10,
+        choices=Kind,
+        default=Kind.DEPOSIT,
+        verbose_name=_("Kind"),
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        editable=False,
+        verbose_name=_("Created"),
+    )
+
+    def __str__(self):
+        return f'{self.wallet_id} +{self.amount}'
+
+    class Meta:
+        verbose_name = _("Deposit")
+        verbose_name_plural = _("Deposits")
+
+        constraints = [
+            models.CheckConstraint(
+                check=Q(amount__gt=0) | Q(kind__in=['OPENING', 'CARRY']),
+                name="positive_deposit_amount",
+                violation_error_message=_(
+                    "The amount must be positive. Got %(show_value)s."
+                ),
+            ),
+        ]
+
+
+class WithdrawalOutbox(models.Model):
+    """
+    A withdrawal waiting to be scheduled on the broker.
+
+    Rows are inserted in the same database transaction as their withdrawal
+    and published by the ``outbox_relay`` command, so scheduling survives a
+    broker outage and the broker is never on the request path.
+    """
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.CASCADE,
+        # the partitioned transaction table can't be referenced by a foreign key
+        db_constraint=False,
+        related_name='+',
+        verbose_name=_("Transaction"),
+        help_text=_("The withdrawal to schedule."),
+    )
+    sender = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        # only read together with the entry, never looked up
+        db_index=False,
+        related_name='+',
+        verbose_name=_("Sender"),
+        help_text=_("The sender of the withdrawal, selects its settlement lane."),
+    )
+    eta = models.DateTimeField(
+        verbose_name=_("ETA"),
+        help_text=_("The time the withdrawal is scheduled at."),
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Attempts"),
+        help_text=_("The number of failed publish attempts."),
+    )
+    available_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Available At"),
+        help_text=_("The time of the next publish attempt."),
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_("Last Error"),
+        help_text=_("The error of the last failed publish attempt."),
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created"),
+        help_text=_("The date and time when this object was created."),
+    )
+
+    def __str__(self):
+        return str(self.transaction_id)
+
+    class Meta:
+        verbose_name = _("Withdrawal Outbox Entry")
+        verbose_name_plural = _("Withdrawal Outbox")
+
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='outbox_available_at_idx'),
+        ]
+
+
+class WalletDailyAggregateManager(models.Manager):
+    RECORD_SQL = """
+        INSERT INTO {table} AS aggregate (wallet_id, day, inflow, outflow, closing_balance)
+        VALUES {values}
+        ON CONFLICT (wallet_id, day) DO UPDATE SET
+            inflow = aggregate.inflow + EXCLUDED.inflow,
+            outflow = aggregate.outflow + EXCLUDED.outflow,
+            closing_balance = EXCLUDED.closing_balance
+    """
+
+    BACKFILL_SQL = """
+        WITH movements AS (
+            SELECT receiver_id AS wallet_id, amount AS inflow, 0 AS outflow, updated
+            FROM {transaction_table} WHERE status = %(success)s
+            UNION ALL
+            SELECT sender_id, 0, amount, updated
+            FROM {transaction_table} WHERE status = %(success)s
+            UNION ALL
+            SELECT wallet_id, amount, 0, created
+            FROM {deposit_table} WHERE kind = %(deposit)s
+        ), flows AS (
+            SELECT wallet_id, (updated AT TIME ZONE %(time_zone)s)::date AS day,
+                   sum(inflow) AS inflow, sum(outflow) AS outflow
+            FROM movements
+            GROUP BY 1, 2
+        )
+        INSERT INTO {table} (wallet_id, day, inflow, outflow, closing_balance)
+        SELECT flows.wallet_id, flows.day, flows.inflow, flows.outflow,
+               wallet.balance - coalesce(sum(flows.inflow - flows.outflow) OVER (
+                   PARTITION BY flows.wallet_id ORDER BY flows.day DESC
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ), 0)
+        FROM flows JOIN {wallet_table} AS wallet ON wallet.uuid = flows.wallet_id
+        ON CONFLICT (wallet_id, day) DO UPDATE SET
+            inflow = EXCLUDED.inflow,
+            outflow = EXCLUDED.outflow,
+            closing_balance = EXCLUDED.closing_balance
+    """
+
+    def record_changes(self, changes, day=None):
+        """
+        Add balance changes to the aggregates of their wallets and day.
+
+        ``changes`` holds ``(wallet UUID, inflow, outflow, new balance)``
+        tuples with at most one tuple per wallet. The wallets must be
+        locked, the new balances become the closing balances of the day.
+        Runs a single upsert, so the cost doesn't depend on the number of
+        transactions of the wallets. The rows are written in the order of
+        the wallet UUIDs, so concurrent upserts can't deadlock.
+        """
+        changes = sorted(changes, key=lambda change: str(change[0]))
+        if not changes:
+            return
+        day = day or timezone.localdate()
+        with connections[self._db or router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                self.RECORD_SQL.format(
+                    table=self.model._meta.db_table,
+                    values=', '.join(['(%s, %s, %s, %s, %s)'] * len(changes)),
+                ),
+                [value for uuid, inflow, outflow, balance in changes
+                 for value in (uuid, day, inflow, outflow, balance)],
+            )
+
+    def backfill(self):
+        """
+        Rebuild the aggregates of all wallets from the settled transactions
+        and the deposits.
+
+        The closing balances are derived backwards from the current wallet
+        balances. Opening balances and amounts carried forward from detached
+        partitions are not flows of any day. Run it while no transactions
+        settle.
+        """
+        with connections[self._db or router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                self.BACKFILL_SQL.format(
+                    table=self.model._meta.db_table,
+                    transaction_table=Transaction._meta.db_table,
+                    wallet_table=Wallet._meta.db_table,
+                    deposit_table=Deposit._meta.db_table,
+                ),
+                {
+                    'success': Transaction.Status.SUCCESS,
+                    'deposit': Deposit.Kind.DEPOSIT,
+                    'time_zone': timezone.get_current_timezone_name(),
+                },
+            )
+            return cursor.rowcount
+
+
+class WalletDailyAggregate(models.Model):
+    """
+    Inflow, outflow and closing balance of a wallet on a day (in the time
+    zone of the service), maintained as the balance changes.
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='daily_aggregates',
+        verbose_name=_("Wallet"),
+    )
+    day = models.DateField(
+        verbose_name=_("Day"),
+    )
+    inflow = models.BigIntegerField(
+        default=0,
+        verbose_name=_("Inflow"),
+        help_text=_("The total amount received on the day in minor units."),
+    )
+    outflow = models.BigIntegerField(
+        default=0,
+        verbose_name=_("Outflow"),
+        help_text=_("The total amount sent on the day in minor units."),
+    )
+    closing_balance = models.BigIntegerField(
+        verbose_name=_("Closing Balance"),
+        help_text=_("The balance of the wallet at the end of the day in minor units."),
+    )
+
+    objects = WalletDailyAggregateManager()
+
+    def __str__(self):
+        return f'{self.wallet_id} {self.day}'
+
+    class Meta:
+        verbose_name = _("Wallet Daily Aggregate")
+        verbose_name_plural = _("Wallet Daily Aggregates")
+
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'day'], name='unique_wallet_day'),
+        ]
@@ -0,0 +1,37 @@
+"""
+Money amounts are stored and computed as integers of minor units (1/100 of
+the currency unit). They are converted to and from ``Decimal`` amounts only
+at the boundaries of the service: the API serializers, the transaction
+service requests, the wallet events and the error messages.
+"""
+from decimal import Decimal
+
+DECIMAL_PLACES = 2
+
+MINOR_UNITS = 10 ** DECIMAL_PLACES
+
+# the digits of the largest amount accepted at the API, leaving headroom in
+# the bigint columns for sums of amounts
+MAX_DIGITS = 18
+
+
+def to_minor(amount) -> int:
+    """
+    Convert an amount to minor units.
+
+    Raises:
+        ValueError: If the amount has more decimal places than the minor
+            unit.
+    """
+    minor = Decimal(amount) * MINOR_UNITS
+    if minor != minor.to_integral_value():
+        raise ValueError(f'{amount} has more than {DECIMAL_PLACES} decimal places.')
+    return int(minor)
+
+
+def from_minor(minor: int) -> Decimal:
+    """
+    Convert minor units to a ``Decimal`` amount with ``DECIMAL_PLACES``
+    decimal places.
+    """
+    return Decimal(minor).scaleb(-DECIMAL_PLACES)
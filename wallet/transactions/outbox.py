@@ -0,0 +1,94 @@
+"""
+Transactional outbox for scheduling withdrawals.
+
+:func:`enqueue_withdrawal` records a withdrawal in the
+:class:`~transactions.models.WithdrawalOutbox` table inside the database
+transaction that creates it. :func:`relay_outbox`, run in a loop by the
+``outbox_relay`` management command, publishes the recorded withdrawals to
+the broker in batches and deletes them once published. Failed publishes are
+retried with an exponential backoff.
+
+Delivery is at least once: a relay that dies between publishing and
+committing publishes the same withdrawals again.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from . import lanes
+from .models import Transaction, WithdrawalOutbox
+from .tasks import process_withdrawal
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = timedelta(minutes=5)
+
+
+def enqueue_withdrawal(transaction: Transaction) -> WithdrawalOutbox:
+    return WithdrawalOutbox.objects.create(
+        transaction=transaction,
+        sender_id=transaction.sender_id,
+        eta=transaction.scheduled_time,
+    )
+
+
+def backoff(attempts: int) -> timedelta:
+    return min(timedelta(seconds=2 ** attempts), MAX_BACKOFF)
+
+
+@db_transaction.atomic
+def relay_outbox(batch_size: int = 100) -> int:
+    """
+    Publish up to ``batch_size`` available outbox entries.
+
+    Args:
+        batch_size (int): The maximum number of entries to publish.
+
+    Returns:
+        int: The number of published entries.
+
+    The entries are locked with ``SKIP LOCKED``, so several relays can run
+    concurrently. All entries of a batch are published over one broker
+    connection, each to the settlement lane of its sender (see
+    :mod:`transactions.lanes`). The batch stops at the first publish error,
+    the failed entry is postponed and the rest are picked up by the next
+    batch.
+    """
+    now = timezone.now()
+    entries = list(
+        WithdrawalOutbox.objects
+        .select_for_update(skip_locked=True)
+        .filter(available_at__lte=now)
+        .order_by('available_at', 'id')[:batch_size]
+    )
+    if not entries:
+        return 0
+
+    published = []
+    try:
+        with process_withdrawal.app.producer_or_acquire() as producer:
+            for entry in entries:
+                process_withdrawal.apply_async(
+                    (entry.transaction_id,),
+                    eta=entry.eta,
+                    producer=producer,
+                    **lanes.routing(entry.sender_id),
+                )
+                published.append(entry.pk)
+    except Exception as e:
+        failed = entries[len(published)]
+        failed.attempts += 1
+        failed.last_error = str(e)
+        failed.available_at = now + backoff(failed.attempts)
+        failed.save(update_fields=['attempts', 'last_error', 'available_at'])
+        logger.error(
+            "Publishing withdrawal %s failed (attempt %s): %s",
+            failed.transaction_id,
+            failed.attempts,
+            e,
+        )
+
+    WithdrawalOutbox.objects.filter(pk__in=published).delete()
+    return len(published)
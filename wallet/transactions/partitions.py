@@ -0,0 +1,212 @@
+"""
+This module manages the monthly range partitions of the transaction table.
+
+``transactions_transaction`` is partitioned by range on ``created`` (see
+migration ``0003_partition_transaction_table``). Every monthly partition
+covers one calendar month in the project time zone and is named
+``transactions_transaction_pYYYYMM``. Rows that do not fall into any monthly
+partition are stored in ``transactions_transaction_default``.
+
+The :func:`ensure_partitions` function creates the partitions for the
+upcoming months and :func:`detach_partitions` detaches (and optionally
+archives) the partitions that are older than a cut-off.
+
+Detaching removes the settled transactions of a partition from the ledger,
+which ``manage.py reconcile`` derives the balances from. So the net amount
+of every wallet's settled transactions in the partition is carried forward
+as a ``CARRY`` deposit in the same database transaction as the detach.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Deposit, Transaction
+
+TABLE = Transaction._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+BOUND_PATTERN = re.compile(
+    r"FOR VALUES FROM \((?:MINVALUE|'(?P<lower>[^']+)')\) "
+    r"TO \((?:MAXVALUE|'(?P<upper>[^']+)')\)"
+)
+
+# the net amount of the settled transactions of a partition per wallet
+CARRY_FORWARD_SQL = """
+    INSERT INTO {deposit_table} (wallet_id, amount, kind, created)
+    SELECT wallet_id, sum(amount), %(carry)s, now()
+    FROM (
+        SELECT receiver_id AS wallet_id, amount FROM {partition} WHERE status = %(success)s
+        UNION ALL
+        SELECT sender_id, -amount FROM {partition} WHERE status = %(success)s
+    ) AS movements
+    GROUP BY wallet_id
+    HAVING sum(amount) <> 0
+"""
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Partition:
+    """
+    A partition of the transaction table.
+
+    ``lower`` and ``upper`` are ``None`` for ``MINVALUE`` and ``MAXVALUE``
+    bounds. Both are ``None`` for the default partition.
+    """
+    name: str
+    lower: datetime | None
+    upper: datetime | None
+    is_default: bool = False
+
+    def covers(self, value: datetime) -> bool:
+        if self.is_default:
+            return False
+        return (self.lower is None or self.lower <= value) and \
+            (self.upper is None or value < self.upper)
+
+
+def month_start(value: datetime, months: int = 0) -> datetime:
+    """
+    Return the start of the month of ``value`` in the current time zone,
+    shifted by ``months`` months.
+    """
+    value = timezone.localtime(value).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f'{TABLE}_p{start:%Y%m}'
+
+
+def list_partitions(using: str = 'default') -> list[Partition]:
+    """
+    Return the partitions currently attached to the transaction table.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) '
+            'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass ORDER BY c.relname',
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        if bound == 'DEFAULT':
+            partitions.append(Partition(name, None, None, is_default=True))
+            continue
+        match = BOUND_PATTERN.match(bound)
+        lower, upper = match.group('lower'), match.group('upper')
+        partitions.append(Partition(
+            name,
+            datetime.fromisoformat(lower) if lower else None,
+            datetime.fromisoformat(upper) if upper else None,
+        ))
+    return partitions
+
+
+def create_partition(start: datetime, end: datetime, using: str = 'default') -> str:
+    """
+    Create the partition for ``[start, end)`` and attach it to the
+    transaction table.
+
+    Rows of that range which are already stored in the default partition are
+    moved into the new partition before it is attached, otherwise attaching
+    would fail.
+    """
+    name = partition_name(start)
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE {name} '
+            f'(LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        )
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            f'WHERE created >= %s AND created < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved',
+            [start, end],
+        )
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}')
+
+    logger.info('Created partition %s for values %s', name, bounds)
+    return name
+
+
+def ensure_partitions(months_ahead: int = 3, now: datetime | None = None,
+                      using: str = 'default') -> list[str]:
+    """
+    Make sure every month from the current one up to ``months_ahead`` months
+    ahead is covered by a partition.
+
+    Returns:
+        list[str]: The names of the created partitions.
+    """
+    start = month_start(now or timezone.now())
+    partitions = list_partitions(using)
+
+    created = []
+    for month in range(months_ahead + 1):
+        lower, upper = month_start(start, month), month_start(start, month + 1)
+        if any(partition.covers(lower) for partition in partitions):
+            continue
+        created.append(create_partition(lower, upper, using))
+    return created
+
+
+def detach_partitions(before: datetime, archive_schema: str | None = None,
+                      using: str = 'default') -> list[str]:
+    """
+    Detach every partition whose range ends on or before ``before``.
+
+    Detached partitions are kept as regular tables. When ``archive_schema``
+    is given they are moved to that schema. Partitions which still hold
+    pending transactions are never detached. The net amounts of the settled
+    transactions of the partition are recorded as ``CARRY`` deposits of
+    their wallets.
+
+    Returns:
+        list[str]: The names of the detached partitions.
+    """
+    detached = []
+    for partition in list_partitions(using):
+        if partition.is_default or partition.upper is None or partition.upper > before:
+            continue
+
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {partition.name} WHERE status = %s)',
+                [Transaction.Status.PENDING],
+            )
+            if cursor.fetchone()[0]:
+                logger.warning(
+                    'Partition %s still has pending transactions. Skipping.',
+                    partition.name,
+                )
+                continue
+
+            cursor.execute(
+                CARRY_FORWARD_SQL.format(deposit_table=Deposit._meta.db_table, partition=partition.name),
+                {'success': Transaction.Status.SUCCESS, 'carry': Deposit.Kind.CARRY},
+            )
+            cursor.execute(
+                f'ALTER TABLE {TABLE} DETACH PARTITION {partition.name}')
+            if archive_schema:
+                schema = connections[using].ops.quote_name(archive_schema)
+                cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+                cursor.execute(
+                    f'ALTER TABLE {partition.name} SET SCHEMA {schema}')
+
+        logger.info('Detached partition %s', partition.name)
+        detached.append(partition.name)
+    return detached
@@ -0,0 +1,123 @@
+"""
+Reconciliation of the wallet balances.
+
+The balance of every wallet must equal the sum of its deposits (including
+the opening balances and the amounts carried forward from detached
+partitions) plus its successful incoming minus its successful outgoing
+transactions. The UUID
+space is split into ranges which are verified independently, each by one
+set-based statement, so the ranges can be checked by a pool of processes
+and a run can be resumed range by range (see ``manage.py reconcile``).
+
+Every statement reads the balances and the sums from the same snapshot, so
+a settlement which commits during the run can't cause a false discrepancy.
+"""
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import django
+from django.db import connections
+
+RECONCILE_SQL = """
+    WITH wallets AS (
+        SELECT uuid, balance FROM {wallet_table}
+        WHERE uuid BETWEEN %(low)s AND %(high)s
+    ), deposits AS (
+        SELECT wallet_id, sum(amount) AS amount FROM {deposit_table}
+        WHERE wallet_id BETWEEN %(low)s AND %(high)s
+        GROUP BY wallet_id
+    ), incoming AS (
+        SELECT receiver_id AS wallet_id, sum(amount) AS amount FROM {transaction_table}
+        WHERE receiver_id BETWEEN %(low)s AND %(high)s AND status = %(success)s
+        GROUP BY receiver_id
+    ), outgoing AS (
+        SELECT sender_id AS wallet_id, sum(amount) AS amount FROM {transaction_table}
+        WHERE sender_id BETWEEN %(low)s AND %(high)s AND status = %(success)s
+        GROUP BY sender_id
+    ), expected AS (
+        SELECT wallets.uuid, wallets.balance,
+               coalesce(deposits.amount, 0) + coalesce(incoming.amount, 0)
+               - coalesce(outgoing.amount, 0) AS expected
+        FROM wallets
+        LEFT JOIN deposits ON deposits.wallet_id = wallets.uuid
+        LEFT JOIN incoming ON incoming.wallet_id = wallets.uuid
+        LEFT JOIN outgoing ON outgoing.wallet_id = wallets.uuid
+    )
+    SELECT NULL, count(*), NULL FROM expected
+    UNION ALL
+    SELECT uuid, balance, expected FROM expected WHERE balance <> expected
+"""
+
+
+def uuid_ranges(count: int) -> list[tuple[uuid.UUID, uuid.UUID]]:
+    """
+    Split the UUID space into ``count`` contiguous, inclusive ranges.
+    """
+    bounds = [i * 2 ** 128 // count for i in range(count + 1)]
+    return [(uuid.UUID(int=low), uuid.UUID(int=high - 1)) for low, high in zip(bounds, bounds[1:])]
+
+
+def reconcile_range(low, high, using: str = 'default') -> dict:
+    """
+    Verify the balances of the wallets with UUIDs from ``low`` to ``high``.
+
+    Returns:
+        dict: The range, the number of ``wallets`` checked and the
+        ``discrepancies`` as ``(wallet UUID, balance, expected balance)``
+        lists.
+    """
+    # imported here, spawned workers import this module before Django is set up
+    from .models import Deposit, Transaction, Wallet
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            RECONCILE_SQL.format(
+                wallet_table=Wallet._meta.db_table,
+                deposit_table=Deposit._meta.db_table,
+                transaction_table=Transaction._meta.db_table,
+            ),
+            {'low': low, 'high': high, 'success': Transaction.Status.SUCCESS},
+        )
+        rows = cursor.fetchall()
+
+    # the row without a wallet holds the number of wallets checked
+    return {
+        'low': str(low),
+        'high': str(high),
+        'wallets': next(balance for wallet, balance, _ in rows if wallet is None),
+        'discrepancies': [
+            [str(wallet), balance, int(expected)]
+            for wallet, balance, expected in rows if wallet is not None
+        ],
+    }
+
+
+def _setup_worker():
+    django.setup()
+
+
+def reconcile(ranges, processes: int = 1, using: str = 'default',
+              initializer=_setup_worker, initargs=()):
+    """
+    Verify the given UUID ranges with a pool of ``processes`` processes, or
+    in this process if ``processes`` is 1. The pool processes are set up by
+    calling ``initializer`` with ``initargs``.
+
+    Yields:
+        dict: The result of every range (see :func:`reconcile_range`) as
+        soon as it is done, in no particular order.
+    """
+    if processes <= 1:
+        for low, high in ranges:
+            yield reconcile_range(low, high, using)
+        return
+
+    # spawned workers set Django up themselves instead of inheriting the
+    # connections and pool threads of this process
+    with ProcessPoolExecutor(processes, mp_context=get_context('spawn'),
+                             initializer=initializer, initargs=initargs) as executor:
+        futures = [executor.submit(reconcile_range, low, high, using)
+                   for low, high in ranges]
+        for future in as_completed(futures):
+            yield future.result()
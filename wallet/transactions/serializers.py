@@ -5,14 +5,33 @@ from django.utils import timezone
 
 from rest_framework import serializers
 
-from .models import Transaction, Wallet
+from .models import Transaction, Wallet, WalletDailyAggregate
+from .money import DECIMAL_PLACES, MAX_DIGITS, from_minor, to_minor
 from .validators import validate_positive_amount, FutureDateValidator
 
 
+class MoneyField(serializers.DecimalField):
+    """
+    A decimal amount in the API, integer minor units in the models.
+
+    The validators of the field see the decimal amount.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_digits', MAX_DIGITS)
+        kwargs.setdefault('decimal_places', DECIMAL_PLACES)
+        super().__init__(**kwargs)
+
+    def run_validation(self, data=serializers.empty):
+        value = super().run_validation(data)
+        return None if value is None else to_minor(value)
+
+    def to_representation(self, value):
+        return super().to_representation(from_minor(value))
+
+
 class TransactionNestedSerializer(serializers.HyperlinkedModelSerializer):
-    amount = serializers.DecimalField(
-        max_digits=10,
-        decimal_places=2,
+    amount = MoneyField(
         localize=True,
         read_only=True,
         label=_('Amount'),
@@ -25,9 +44,7 @@ class TransactionNestedSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class WalletSerializer(serializers.HyperlinkedModelSerializer):
-    balance = serializers.DecimalField(
-        max_digits=10,
-        decimal_places=2,
+    balance = MoneyField(
         localize=True,
         read_only=True,
         label=_('Balance'),
@@ -46,10 +63,36 @@ class WalletSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ['ur', 'uuid', 'balance', 'created', 'updated']
 
 
+class CompactWalletSerializer(serializers.BaseSerializer):
+    """
+    Read-only wallet representation of the compact renderer.
+
+    It skips the per-field localization and the hyperlinks of
+    :class:`WalletSerializer` and reads the nested transactions as plain
+    values, leaving the encoding to the renderer.
+    """
+    transaction_fields = ['uuid', 'amount', 'scheduled_time',
+                          'status', 'error_message', 'created', 'updated']
+
+    def to_representation(self, instance):
+        return {
+            'uuid': instance.uuid,
+            'balance': from_minor(instance.balance),
+            'created': instance.created,
+            'updated': instance.updated,
+            'outgoing_transactions': self.transactions(instance.outgoing_transactions),
+            'incoming_transactions': self.transactions(instance.incoming_transactions),
+        }
+
+    def transactions(self, queryset):
+        transactions = list(queryset.values(*self.transaction_fields))
+        for transaction in transactions:
+            transaction['amount'] = from_minor(transaction['amount'])
+        return transactions
+
+
 class DepositSerializer(serializers.Serializer):
-    amount = serializers.DecimalField(
-        max_digits=10,
-        decimal_places=2,
+    amount = MoneyField(
         min_value=Decimal('0.01'),
         write_only=True,
         label=_('Amount'),
@@ -61,9 +104,7 @@ class DepositSerializer(serializers.Serializer):
 
 
 class WithdrawRequestSerializer(serializers.Serializer):
-    amount = serializers.DecimalField(
-        max_digits=10,
-        decimal_places=2,
+    amount = MoneyField(
         min_value=Decimal('0.01'),
         label=_('Amount'),
         help_text=_('The amount of the withdrawal.'),
@@ -88,3 +129,67 @@ class WithdrawRequestSerializer(serializers.Serializer):
             raise serializers.ValidationError(
                 _('You cannot craete a withdraw request to yourself.'))
         return value
+
+
+class TransferRequestSerializer(serializers.Serializer):
+    amount = MoneyField(
+        min_value=Decimal('0.01'),
+        label=_('Amount'),
+        help_text=_('The amount of the transfer.'),
+        validators=[
+            validate_positive_amount,
+        ]
+    )
+    target = serializers.UUIDField(
+        label=_('Target'),
+        help_text=_('The wallet to which the amount is transferred.'),
+    )
+
+    def validate_target(self, value):
+        if str(value) == self.context['view'].kwargs['pk']:
+            raise serializers.ValidationError(
+                _('You cannot transfer to yourself.'))
+        return value
+
+
+class StatementRequestSerializer(serializers.Serializer):
+    start = serializers.DateField(
+        required=False,
+        label=_('Start'),
+        help_text=_('The first day of the statement. Defaults to 30 days before the end.'),
+    )
+    end = serializers.DateField(
+        required=False,
+        label=_('End'),
+        help_text=_('The last day of the statement. Defaults to today.'),
+    )
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - timezone.timedelta(days=30))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError(
+                _('The start of the statement must not be after its end.'))
+        return attrs
+
+
+class WalletDailyAggregateSerializer(serializers.ModelSerializer):
+    inflow = MoneyField(
+        localize=True,
+        read_only=True,
+        label=_('Inflow'),
+    )
+    outflow = MoneyField(
+        localize=True,
+        read_only=True,
+        label=_('Outflow'),
+    )
+    closing_balance = MoneyField(
+        localize=True,
+        read_only=True,
+        label=_('Closing Balance'),
+    )
+
+    class Meta:
+        model = WalletDailyAggregate
+        fields = ['day', 'inflow', 'outflow', 'closing_balance']
@@ -1,10 +1,11 @@
 import logging
 
+from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from .models import Transaction
-from .tasks import process_withdrawal
+from .models import Transaction, Wallet
+from .outbox import enqueue_withdrawal
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +13,20 @@ logger = logging.getLogger(__name__)
 @receiver(post_save, sender=Transaction)
 def schedule_withdrawal(sender, instance: Transaction, created, **kwargs):
 
-    logger.debug('Scheduling withdrawal for transaction %s', instance)
+    # withdrawals are only enqueued in the 'eta' mode, the batch and fair
+    # dispatchers collect the due ones themselves
+    if not created or settings.WITHDRAWAL_DISPATCH_MODE != 'eta':
+        return
 
+    if instance.status == Transaction.Status.PENDING:
+        logger.debug('Scheduling withdrawal for transaction %s', instance)
+        # written in the transaction of the withdrawal, published by outbox_relay
+        enqueue_withdrawal(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def touch_wallets(sender, instance: Transaction, created, **kwargs):
+    # a new withdrawal changes the representation of both wallets; settled
+    # transactions update the wallets in write_settlement
     if created and instance.status == Transaction.Status.PENDING:
-        process_withdrawal.apply_async_on_commit(
-            (instance.uuid,),
-            eta=instance.scheduled_time,
-        )
+        Wallet.objects.touch([instance.sender_id, instance.receiver_id])
@@ -2,20 +2,43 @@
 This module contains Celery tasks for processing transactions.
 
 The :func:`process_withdrawal` function is used to process withdrawal transactions.
+
+When ``WITHDRAWAL_DISPATCH_MODE`` is ``'batch'``, withdrawals are not
+scheduled one by one. The periodic :func:`dispatch_due_withdrawals` task
+collects the due withdrawals instead and :func:`process_withdrawal_batch`
+sends up to ``WITHDRAWAL_BATCH_SIZE`` of them to the provider in a single
+request.
+
+The periodic :func:`recover_stuck_withdrawals` task enqueues again the
+withdrawals which are still pending long after their scheduled time.
 """
+import json
 import logging
 import os
+from collections import defaultdict
+from urllib.parse import urljoin
+
 import requests
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.db import transaction as db_transaction
+from django.db.models import Case, Exists, OuterRef, Q, TextField, Value, When
 from celery import shared_task
 
-from .models import Wallet, Transaction
+from . import dispatcher, events, lanes, tracing
+from .models import Wallet, Transaction, WalletDailyAggregate, WithdrawalOutbox
+from .money import from_minor
 
 TRANSACTION_API_URL = os.environ.get('TRANSACTION_API_URL')
+TRANSACTION_API_BATCH_URL = os.environ.get(
+    'TRANSACTION_API_BATCH_URL',
+    urljoin(TRANSACTION_API_URL, 'batch/') if TRANSACTION_API_URL else None,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +64,11 @@ def process_withdrawal(transaction_uuid: str) -> None:
     `handle_transaction_failure` function. Finally, the sender,
     receiver, and transaction objects are saved.
 
+    Deliveries of a transaction which is not pending anymore are no-ops
+    and the transaction UUID is sent to the provider as the idempotency key,
+    so the task is safe to run more than once (``acks_late``, redelivered
+    ETA messages, recovered withdrawals).
+
     Note: - The function is decorated with `@shared_task` to make it a
     shared task. - The function is decorated with
     `@db_transaction.atomic` to ensure that all database operations
@@ -49,46 +77,276 @@ def process_withdrawal(transaction_uuid: str) -> None:
 
     """
 
-    try:
-        transaction = Transaction \
-            .objects \
-            .select_related('sender', 'receiver') \
-            .select_for_update() \
-            .get(uuid=transaction_uuid)
-    except Transaction.DoesNotExist as e:
-        logger.error(
-            "Transaction with ID %s does not exist. Skipping withdrawal processing.",
-            transaction_uuid,
+    with tracing.trace('process_withdrawal', transaction=transaction_uuid) as trace:
+        try:
+            with trace.span('lock'):
+                transaction = Transaction \
+                    .objects \
+                    .select_for_update() \
+                    .get(uuid=transaction_uuid)
+                # both wallets in the order of their UUIDs, like transfers and
+                # batches, so withdrawals in opposite directions can't deadlock
+                wallets = {
+                    wallet.uuid: wallet
+                    for wallet in Wallet.objects.select_for_update().filter(
+                        uuid__in=[transaction.sender_id, transaction.receiver_id]).order_by('uuid')
+                }
+        except Transaction.DoesNotExist as e:
+            logger.error(
+                "Transaction with ID %s does not exist. Skipping withdrawal processing.",
+                transaction_uuid,
+            )
+            raise e
+
+        transaction.sender = wallets[transaction.sender_id]
+        transaction.receiver = wallets[transaction.receiver_id]
+
+        trace.set(
+            sender=transaction.sender_id,
+            receiver=transaction.receiver_id,
+            amount=transaction.amount,
+            schedule_lag=(timezone.now() - transaction.scheduled_time).total_seconds(),
         )
-        raise e
 
-    try:
-        sender, receiver = transaction.sender, transaction.receiver
+        # a redelivered or re-enqueued message of a processed withdrawal
+        if transaction.status != Transaction.Status.PENDING:
+            logger.info(
+                "Transaction with ID %s is already %s. Skipping withdrawal processing.",
+                transaction_uuid,
+                transaction.status,
+            )
+            trace.set(status=transaction.status, duplicate=True)
+            return
+
+        try:
+            sender, receiver = transaction.sender, transaction.receiver
+
+            with trace.span('validate'):
+                validate_transaction_scheduled_time(transaction)
+                validate_transaction_amount(sender, transaction)
+
+            with trace.span('provider'):
+                request_transactions(
+                    idempotency_key=transaction.uuid,
+                    sender=sender.uuid,
+                    receiver=receiver.uuid,
+                    amount=from_minor(transaction.amount),
+                    scheduled_time=transaction.scheduled_time
+                )
+
+            handle_transaction_success(sender, receiver, transaction)
+
+        except Exception as e:
+            handle_transaction_failure(transaction, e)
+            trace.set(error=type(e).__name__, error_message=transaction.error_message)
+        finally:
+            with trace.span('save'):
+                save_objects(sender, receiver, transaction)
+            trace.set(status=transaction.status)
 
-        validate_transaction_scheduled_time(transaction)
-        validate_transaction_amount(sender, transaction)
 
-        request_transactions(
-            sender=sender.uuid,
-            receiver=receiver.uuid,
-            amount=transaction.amount,
-            scheduled_time=transaction.scheduled_time
+@shared_task
+def dispatch_due_withdrawals() -> int:
+    """
+    Process the due withdrawals in batches until no full batch is left.
+
+    Returns:
+        int: The number of processed withdrawals.
+
+    This task runs periodically (every ``WITHDRAWAL_BATCH_WINDOW`` seconds)
+    in the batch dispatch mode, so withdrawals that become due are coalesced
+    for at most one window. Concurrent runs skip the transactions locked by
+    each other.
+    """
+    processed = 0
+    while True:
+        count = process_withdrawal_batch(settings.WITHDRAWAL_BATCH_SIZE)
+        processed += count
+        if count < settings.WITHDRAWAL_BATCH_SIZE:
+            return processed
+
+
+@db_transaction.atomic
+def process_withdrawal_batch(limit: int) -> int:
+    """
+    Process up to ``limit`` due withdrawals with a single provider request.
+
+    Args:
+        limit (int): The maximum number of withdrawals in the batch.
+
+    Returns:
+        int: The number of processed withdrawals.
+
+    The due pending transactions are locked with ``SKIP LOCKED`` and their
+    wallets are locked in a fixed order to avoid deadlocks with concurrent
+    batches. Withdrawals of the same sender are validated against the
+    balance left after the previous withdrawals of the batch. The valid ones
+    are sent to the provider with :func:`request_transactions_batch` and the
+    per-item results are mapped back to the transaction statuses.
+    """
+    with tracing.trace('process_withdrawal_batch', limit=limit) as trace:
+        return _process_withdrawal_batch(limit, trace)
+
+
+def _process_withdrawal_batch(limit, trace) -> int:
+    with trace.span('lock'):
+        transactions = list(
+            Transaction.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=Transaction.Status.PENDING, scheduled_time__lte=timezone.now())
+            .order_by('scheduled_time', 'created')[:limit]
         )
+        if not transactions:
+            trace.set(size=0)
+            return 0
+
+        wallet_uuids = {t.sender_id for t in transactions} | {t.receiver_id for t in transactions}
+        wallets = {
+            wallet.uuid: wallet
+            for wallet in Wallet.objects.select_for_update().filter(uuid__in=wallet_uuids).order_by('uuid')
+        }
+
+    trace.set(
+        size=len(transactions),
+        max_schedule_lag=(timezone.now() - transactions[0].scheduled_time).total_seconds(),
+    )
 
-        handle_transaction_success(sender, receiver, transaction)
+    accepted = []
+    reserved = defaultdict(int)
+    with trace.span('validate'):
+        for transaction in transactions:
+            transaction.sender = wallets[transaction.sender_id]
+            transaction.receiver = wallets[transaction.receiver_id]
+            try:
+                validate_transaction_amount(
+                    transaction.sender, transaction, reserved[transaction.sender_id])
+            except ValidationError as e:
+                handle_transaction_failure(transaction, e)
+                continue
+            reserved[transaction.sender_id] += transaction.amount
+            accepted.append(transaction)
 
+    try:
+        with trace.span('provider'):
+            results = request_transactions_batch([
+                {
+                    'id': transaction.uuid,
+                    'sender': transaction.sender_id,
+                    'receiver': transaction.receiver_id,
+                    'amount': from_minor(transaction.amount),
+                    'scheduled_time': transaction.scheduled_time,
+                }
+                for transaction in accepted
+            ]) if accepted else {}
     except Exception as e:
-        handle_transaction_failure(transaction, e)
-    finally:
-        save_objects(sender, receiver, transaction)
+        trace.set(error=type(e).__name__, error_message=str(e))
+        results = {str(transaction.uuid): {'status': None, 'data': str(e)} for transaction in accepted}
+
+    for transaction in accepted:
+        result = results.get(str(transaction.uuid), {'data': _('No result from provider.')})
+        if result.get('status') == 200:
+            handle_transaction_success(transaction.sender, transaction.receiver, transaction)
+        else:
+            handle_transaction_failure(transaction, ValueError(result.get('data')))
+
+    with trace.span('save'):
+        save_batch(wallets, transactions)
+    trace.set(succeeded=sum(t.status == Transaction.Status.SUCCESS for t in transactions))
+    return len(transactions)
 
 
-def request_transactions(**kwargs) -> bool:
+@shared_task
+def dispatch_fair_withdrawals() -> int:
+    """
+    Send the next due withdrawals to the workers, fairly across senders.
+
+    Returns:
+        int: The number of dispatched withdrawals.
+
+    This task runs periodically (every ``WITHDRAWAL_FAIR_INTERVAL``
+    seconds) in the fair dispatch mode, see :mod:`transactions.dispatcher`.
+    The withdrawals are published after their ``dispatched_at`` time is
+    committed; the ones not published because of a broker error are
+    dispatched again after ``WITHDRAWAL_RECOVERY_GRACE`` seconds.
+    """
+    with tracing.trace('dispatch_fair_withdrawals') as trace:
+        with trace.span('select'), db_transaction.atomic():
+            withdrawals = dispatcher.select_fair_withdrawals()
+
+        if withdrawals:
+            with trace.span('publish'), process_withdrawal.app.producer_or_acquire() as producer:
+                for withdrawal in withdrawals:
+                    process_withdrawal.apply_async(
+                        (withdrawal['uuid'],),
+                        producer=producer,
+                        **lanes.routing(withdrawal['sender_id']),
+                    )
+        trace.set(dispatched=len(withdrawals), **dispatcher.lag_metrics(withdrawals))
+        return len(withdrawals)
+
+
+@shared_task
+def recover_stuck_withdrawals(chunk_size: int = 500) -> int:
+    """
+    Enqueue the withdrawals that are stuck in the pending status.
+
+    Args:
+        chunk_size (int): The number of transactions read per query.
+
+    Returns:
+        int: The number of enqueued withdrawals.
+
+    A withdrawal is stuck if it is still pending ``WITHDRAWAL_RECOVERY_GRACE``
+    seconds after its scheduled time and is not waiting in the outbox, e.g.
+    its worker died or its ETA message was lost. The stuck withdrawals are
+    read in keyset-paginated chunks from the pending scheduled time index.
+    Every withdrawal is enqueued at most once per grace period, so
+    overlapping runs and slow queues don't pile up duplicates.
+    """
+    grace = settings.WITHDRAWAL_RECOVERY_GRACE
+    stuck = Transaction.objects \
+        .filter(
+            status=Transaction.Status.PENDING,
+            scheduled_time__lt=timezone.now() - timezone.timedelta(seconds=grace),
+        ) \
+        .exclude(Exists(WithdrawalOutbox.objects.filter(transaction=OuterRef('pk')))) \
+        .order_by('scheduled_time', 'uuid') \
+        .values_list('scheduled_time', 'uuid', 'sender_id')
+
+    recovered = 0
+    last = None
+    while True:
+        chunk = stuck
+        if last is not None:
+            chunk = chunk.filter(
+                Q(scheduled_time__gt=last[0]) | Q(scheduled_time=last[0], uuid__gt=last[1]))
+        chunk = list(chunk[:chunk_size])
+
+        for _scheduled_time, uuid, sender_id in chunk:
+            if cache.add(f'withdrawal-recovery:{uuid}', True, timeout=grace):
+                process_withdrawal.apply_async((uuid,), **lanes.routing(sender_id))
+                recovered += 1
+
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+
+    if recovered:
+        logger.warning("Enqueued %s stuck withdrawals again.", recovered)
+    return recovered
+
+
+def request_transactions(idempotency_key=None, **kwargs) -> bool:
     """
     Sends a POST request to the TRANSACTION_API_URL with the given
     keyword arguments as data. If the TRANSACTION_API_URL is not set,
     raises a ValueError.
 
+    :param idempotency_key: Sent as the ``Idempotency-Key`` header. The
+        provider answers repeated requests with the same key with the
+        result of the first one instead of transferring again.
+    :type idempotency_key: str
+
     :param kwargs: Keyword arguments to be sent as data in the POST
         request.
     :type kwargs: dict
@@ -104,7 +362,8 @@ def request_transactions(**kwargs) -> bool:
         raise ValueError('Transaction API URL not set')
 
     try:
-        response = requests.post(TRANSACTION_API_URL, data=kwargs, timeout=5)
+        headers = {'Idempotency-Key': str(idempotency_key)} if idempotency_key else {}
+        response = requests.post(TRANSACTION_API_URL, data=kwargs, headers=headers, timeout=5)
         response.raise_for_status()
         return response.ok
     except requests.exceptions.RequestException as e:
@@ -112,6 +371,41 @@ def request_transactions(**kwargs) -> bool:
         raise e
 
 
+def request_transactions_batch(transfers: list[dict]) -> dict[str, dict]:
+    """
+    Sends the given transfers to the TRANSACTION_API_BATCH_URL in a single
+    JSON POST request. Every transfer must have an ``id`` key which the
+    provider echoes back in its result and uses as the idempotency key of
+    the transfer.
+
+    :param transfers: The transfers to request.
+    :type transfers: list[dict]
+
+    :return: The per-item results of the provider keyed by transfer id.
+        Every result has a ``status`` (200 on success) and a ``data`` key.
+    :rtype: dict[str, dict]
+
+    :raises ValueError: If the TRANSACTION_API_BATCH_URL is not set.
+    :raises requests.exceptions.RequestException: If an error occurs
+        during the request.
+    """
+    if not TRANSACTION_API_BATCH_URL:
+        raise ValueError('Transaction batch API URL not set')
+
+    try:
+        response = requests.post(
+            TRANSACTION_API_BATCH_URL,
+            data=json.dumps({'transfers': transfers}, cls=DjangoJSONEncoder),
+            headers={'Content-Type': 'application/json'},
+            timeout=5,
+        )
+        response.raise_for_status()
+        return {str(result['id']): result for result in response.json()['results']}
+    except requests.exceptions.RequestException as e:
+        logger.error("An error occurred while requesting a transaction batch: %s", e)
+        raise e
+
+
 def validate_transaction_scheduled_time(transaction: Transaction) -> None:
     if transaction.scheduled_time > timezone.now():
         time_remaining = (transaction.scheduled_time -
@@ -122,20 +416,20 @@ def validate_transaction_scheduled_time(transaction: Transaction) -> None:
         )
 
 
-def validate_transaction_amount(sender: Wallet, transaction: Transaction) -> None:
-    if sender.balance < transaction.amount:
+def validate_transaction_amount(sender: Wallet, transaction: Transaction,
+                                reserved: int = 0) -> None:
+    if sender.balance - reserved < transaction.amount:
         raise ValidationError(
             _("Insufficient funds. Available balance: %(available_balance)s. "
               "Required amount: %(required_amount)s."),
-            params={'available_balance': sender.balance,
-                    'required_amount': transaction.amount},
+            params={'available_balance': from_minor(sender.balance - reserved),
+                    'required_amount': from_minor(transaction.amount)},
         )
 
 
 def handle_transaction_success(sender: Wallet, receiver: Wallet, transaction: Transaction) -> None:
     sender.balance -= transaction.amount
     receiver.balance += transaction.amount
-
     transaction.status = Transaction.Status.SUCCESS
 
 
@@ -151,8 +445,7 @@ def handle_transaction_failure(transaction: Transaction, e: Exception) -> None:
 
 def save_objects(sender: Wallet, receiver: Wallet, transaction: Transaction) -> None:
     try:
-        for obj in [sender, receiver, transaction]:
-            obj.save()
+        write_settlement({sender.uuid: sender, receiver.uuid: receiver}, [transaction])
 
     except Exception as e:
         # if celery result backend retry policy is configured in the future
@@ -170,3 +463,64 @@ def save_objects(sender: Wallet, receiver: Wallet, transaction: Transaction) ->
         # and it will rollback the transaction
         # so there's no data loss
         raise e
+
+
+def save_batch(wallets, transactions) -> None:
+    try:
+        write_settlement(wallets, transactions)
+
+    except Exception as e:
+        logger.critical(
+            "Unexpected error occurred while saving a withdrawal batch: %s. "
+            "Transaction IDs: %s. "
+            "Can't recover.",
+            e,
+            [transaction.uuid for transaction in transactions],
+        )
+        raise e
+
+
+def write_settlement(wallets, transactions) -> None:
+    """
+    Write the outcome of settled transactions with the locked wallets.
+
+    Only the changed columns are written, in at most three statements: the
+    net balance change of every wallet as ``balance + change``, the daily
+    aggregates and the status of the transactions. The balance limits are
+    enforced by the database constraints instead of ``full_clean()``.
+    The wallets of failed transactions get a zero change, which only sets
+    their ``updated`` time (their version, see ``views.wallet_etag``). The
+    outcomes are published to the event streams of the wallets on commit.
+    """
+    now = timezone.now()
+    inflow = defaultdict(int)
+    outflow = defaultdict(int)
+    settled = set()
+    for transaction in transactions:
+        transaction.updated = now
+        settled.update((transaction.sender_id, transaction.receiver_id))
+        if transaction.status == Transaction.Status.SUCCESS:
+            outflow[transaction.sender_id] += transaction.amount
+            inflow[transaction.receiver_id] += transaction.amount
+
+    Wallet.objects.apply_balance_changes(
+        {uuid: inflow[uuid] - outflow[uuid] for uuid in settled})
+    changed = inflow.keys() | outflow.keys()
+    if changed:
+        WalletDailyAggregate.objects.record_changes(
+            (uuid, inflow[uuid], outflow[uuid], wallets[uuid].balance) for uuid in changed)
+
+    # filtering on the creation times prunes the partitions of the table
+    Transaction.objects.filter(
+        uuid__in=[transaction.uuid for transaction in transactions],
+        created__range=(min(t.created for t in transactions), max(t.created for t in transactions)),
+    ).update(
+        status=Case(*[When(uuid=t.uuid, then=Value(t.status)) for t in transactions]),
+        error_message=Case(
+            *[When(uuid=t.uuid, then=Value(t.error_message)) for t in transactions],
+            output_field=TextField(),
+        ),
+        updated=now,
+    )
+    for transaction in transactions:
+        events.publish_transaction(transaction)
@@ -0,0 +1,15 @@
+"""
+Process pool helpers of the tests, importable by spawned processes before
+Django is set up.
+"""
+import django
+
+
+def setup_test_worker(using, name):
+    """
+    Set a spawned worker up like ``reconciliation._setup_worker``, connected
+    to the test database ``name`` of the parent.
+    """
+    django.setup()
+    from django.conf import settings
+    settings.DATABASES[using]['NAME'] = name
@@ -0,0 +1,112 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from transactions import admin
+from transactions.models import Transaction, Wallet
+
+
+class LargeTableAdminTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        sender, receiver = Wallet.objects.create(balance=10000), Wallet.objects.create()
+        self.transactions = [
+            Transaction.objects.create(
+                sender=sender,
+                receiver=receiver,
+                amount=100,
+                scheduled_time=timezone.now() + timezone.timedelta(minutes=2),
+            )
+            for _ in range(5)
+        ]
+        # two withdrawals at the same time are ordered by their UUIDs
+        scheduled_time = timezone.now() + timezone.timedelta(hours=1)
+        Transaction.objects \
+            .filter(uuid__in=[t.uuid for t in self.transactions[:2]]) \
+            .update(scheduled_time=scheduled_time)
+        Transaction.objects \
+            .filter(uuid=self.transactions[2].uuid) \
+            .update(status=Transaction.Status.FAILED)
+
+    def pages(self, url):
+        uuids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            cl = response.context['cl']
+            uuids += [t.uuid for t in cl.result_list]
+            url = cl.next_cursor and reverse('admin:transactions_transaction_changelist') + cl.next_page_url
+        return uuids
+
+    @mock.patch.object(admin.TransactionAdmin, 'list_per_page', 2)
+    def test_keyset_pages(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        self.assertEqual(
+            self.pages(url),
+            list(Transaction.objects.order_by('-scheduled_time', '-uuid').values_list('uuid', flat=True)),
+        )
+        self.assertEqual(self.pages(f'{url}?status__exact=PENDING'), [
+            uuid
+            for uuid in Transaction.objects.order_by('-scheduled_time', '-uuid').values_list('uuid', flat=True)
+            if uuid != self.transactions[2].uuid
+        ])
+
+    @mock.patch.object(admin.TransactionAdmin, 'list_per_page', 2)
+    def test_page_query_count(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        next_page = url + self.client.get(url).context['cl'].next_page_url
+        # session, user, the page with the wallets, the estimate and the count
+        with self.assertNumQueries(5):
+            response = self.client.get(next_page)
+        self.assertContains(response, '5 Transactions')
+
+    def test_invalid_cursor(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        response = self.client.get(f'{url}?after=yesterday,1')
+        self.assertRedirects(response, f'{url}?e=1', fetch_redirect_response=False)
+
+    def test_estimated_count(self):
+        queryset = Transaction.objects.order_by('uuid')
+        paginator = admin.EstimatedCountPaginator(queryset, 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.estimated)
+
+        with mock.patch.object(admin, 'EXACT_COUNT_LIMIT', 0):
+            for queryset in [Transaction.objects.order_by('uuid'), Transaction.objects.filter(status='FAILED').order_by('uuid')]:
+                with self.subTest(filtered=bool(queryset.query.where)):
+                    paginator = admin.EstimatedCountPaginator(queryset, 2)
+                    self.assertGreaterEqual(paginator.count, 0)
+                    self.assertTrue(paginator.estimated)
+
+    def test_wallet_search(self):
+        wallet = self.transactions[0].sender
+        url = reverse('admin:transactions_wallet_changelist')
+        response = self.client.get(url, {'q': str(wallet.uuid)})
+        self.assertEqual([w.uuid for w in response.context['cl'].result_list], [wallet.uuid])
+        self.assertIn('"uuid" = ', str(response.context['cl'].queryset.query))
+
+        response = self.client.get(url, {'q': str(wallet.uuid)[:8]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_amounts_in_major_units(self):
+        response = self.client.get(reverse('admin:transactions_transaction_changelist'))
+        self.assertContains(response, '<td class="field-display_amount">1.00</td>', count=5, html=True)
+
+        transaction = self.transactions[0]
+        scheduled_time = timezone.localtime() + timezone.timedelta(days=1)
+        response = self.client.post(reverse('admin:transactions_transaction_add'), {
+            'sender': transaction.sender_id,
+            'receiver': transaction.receiver_id,
+            'amount': '100',
+            'scheduled_time_0': scheduled_time.strftime('%Y-%m-%d'),
+            'scheduled_time_1': scheduled_time.strftime('%H:%M:%S'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Transaction.objects.latest('created').amount, 10000)
+
+        response = self.client.get(reverse('admin:transactions_transaction_change', args=[transaction.uuid]))
+        self.assertContains(response, 'value="1.00"')
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from transactions.models import Transaction, Wallet, WalletDailyAggregate
+from transactions.tasks import process_withdrawal
+
+
+class WalletDailyAggregateTest(TestCase):
+    def setUp(self):
+        self.sender = Wallet.objects.create()
+        self.receiver = Wallet.objects.create()
+        self.sender.deposit(10000)
+        self.today = timezone.localdate()
+
+    @mock.patch('transactions.tasks.request_transactions')
+    def settle(self, amount, request_transactions):
+        transaction = Transaction.objects.create(
+            sender=self.sender,
+            receiver=self.receiver,
+            amount=amount,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects \
+            .filter(uuid=transaction.uuid) \
+            .update(scheduled_time=timezone.now())
+        process_withdrawal(str(transaction.uuid))
+
+    def aggregates(self):
+        return list(
+            WalletDailyAggregate.objects
+            .order_by('wallet', 'day')
+            .values_list('wallet_id', 'day', 'inflow', 'outflow', 'closing_balance')
+        )
+
+    def test_incremental_aggregates(self):
+        self.settle(3000)
+        self.settle(2000)
+
+        self.assertEqual(
+            WalletDailyAggregate.objects.filter(wallet=self.sender)
+            .values_list('day', 'inflow', 'outflow', 'closing_balance').get(),
+            (self.today, 10000, 5000, 5000),
+        )
+        self.assertEqual(
+            WalletDailyAggregate.objects.filter(wallet=self.receiver)
+            .values_list('day', 'inflow', 'outflow', 'closing_balance').get(),
+            (self.today, 5000, 0, 5000),
+        )
+
+    def test_backfill(self):
+        self.settle(3000)
+        receiver_aggregate = [a for a in self.aggregates() if a[0] == self.receiver.uuid]
+
+        WalletDailyAggregate.objects.all().delete()
+        WalletDailyAggregate.objects.backfill()
+
+        self.assertEqual(
+            self.aggregates(),
+            sorted([
+                (self.sender.uuid, self.today, 10000, 3000, 7000),
+                *receiver_aggregate,
+            ]),
+        )
+
+    def test_statement(self):
+        self.settle(3000)
+        WalletDailyAggregate.objects.create(
+            wallet=self.sender,
+            day=self.today - timezone.timedelta(days=40),
+            inflow=1000,
+            closing_balance=1000,
+        )
+        url = reverse('wallet-statement', kwargs={'pk': self.sender.uuid})
+
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{
+            'day': self.today.isoformat(),
+            'inflow': '100.00',
+            'outflow': '30.00',
+            'closing_balance': '70.00',
+        }])
+
+        response = APIClient().get(url, {'start': self.today - timezone.timedelta(days=50)})
+        self.assertEqual(len(response.json()), 2)
+
+        response = APIClient().get(url, {'start': self.today, 'end': self.today - timezone.timedelta(days=1)})
+        self.assertEqual(response.status_code, 400)
@@ -1,13 +1,20 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from transactions.coalescing import CoalescedDepositTimeout
 from transactions.models import Transaction, Wallet
 from transactions.tasks import process_withdrawal
+from transactions.throttling import WalletRateThrottle
 
 
 class WalletApiTest(TestCase):
@@ -20,6 +27,13 @@ class WalletApiTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Wallet.objects.count(), 2)
 
+    @mock.patch('transactions.views.coalesce_deposit', side_effect=CoalescedDepositTimeout('The deposit timed out.'))
+    @mock.patch('transactions.views.coalescing_enabled', return_value=True)
+    def test_coalesced_deposit_timeout(self, coalescing_enabled, coalesce_deposit):
+        response = self.client.patch(reverse(
+            'wallet-deposit', kwargs={'pk': self.wallet_uuid}), data={'amount': 100})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
     def test_retrieve_wallet(self):
         response = self.client.get(
             reverse('wallet-detail', kwargs={'pk': self.wallet_uuid}))
@@ -31,12 +45,178 @@ class WalletApiTest(TestCase):
             'wallet-deposit', kwargs={'pk': self.wallet_uuid}), data={'amount': 100})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(Wallet.objects.get(
-            uuid=self.wallet_uuid).balance, 100)
+            uuid=self.wallet_uuid).balance, 10000)
+
+    def test_retrieve_compact_wallet(self):
+        receiver = Wallet.objects.create()
+        transaction = Transaction.objects.create(
+            sender_id=self.wallet_uuid,
+            receiver=receiver,
+            amount=123450,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        response = self.client.get(
+            reverse('wallet-detail', kwargs={'pk': self.wallet_uuid}),
+            HTTP_ACCEPT='application/vnd.wallet.compact+json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.wallet.compact+json')
+
+        data = response.json()
+        self.assertNotIn('url', data)
+        self.assertEqual(data['balance'], '0.00')
+        self.assertEqual(data['incoming_transactions'], [])
+        [outgoing] = data['outgoing_transactions']
+        self.assertEqual(outgoing['uuid'], str(transaction.uuid))
+        # not localized
+        self.assertEqual(outgoing['amount'], '1234.50')
+
+    @mock.patch.object(WalletRateThrottle, 'get_rate', lambda self: '2/min')
+    def test_deposit_throttling(self):
+        cache.clear()
+        url = reverse('wallet-deposit', kwargs={'pk': self.wallet_uuid})
+        responses = [self.client.patch(url, data={'amount': 1}) for _ in range(3)]
+
+        self.assertEqual([r.status_code for r in responses], [200, 200, 429])
+        # one token every 30 seconds
+        self.assertEqual(responses[-1]['Retry-After'], '30')
+
+        other_wallet = Wallet.objects.create()
+        response = self.client.patch(
+            reverse('wallet-deposit', kwargs={'pk': other_wallet.uuid}), data={'amount': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create()
+        self.url = reverse('wallet-detail', kwargs={'pk': self.wallet.uuid})
+
+    def assertModified(self, etag):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def withdraw(self, amount):
+        transaction = Transaction.objects.create(
+            sender=self.wallet,
+            receiver=self.receiver,
+            amount=amount,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects.filter(uuid=transaction.uuid).update(scheduled_time=timezone.now())
+        return transaction
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_representations(self):
+        etags = {
+            self.client.get(self.url)['ETag'],
+            self.client.get(self.url, HTTP_ACCEPT='application/vnd.wallet.compact+json')['ETag'],
+            self.client.get(self.url, HTTP_ACCEPT_LANGUAGE='fa')['ETag'],
+            self.client.get(reverse('wallet-statement', kwargs={'pk': self.wallet.uuid}),
+                            {'start': '2024-01-01', 'end': '2024-01-31'})['ETag'],
+        }
+        self.assertEqual(len(etags), 4)
+
+    @mock.patch('transactions.tasks.request_transactions')
+    def test_changes(self, request_transactions):
+        etag = self.client.get(self.url)['ETag']
+
+        self.wallet.deposit(100)
+        etag = self.assertModified(etag)
+
+        transaction = self.withdraw(100000)
+        etag = self.assertModified(etag)
+
+        process_withdrawal(transaction.uuid)
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, Transaction.Status.FAILED)
+        self.assertModified(etag)
+
+    def test_missing_wallet(self):
+        response = self.client.get(
+            reverse('wallet-detail', kwargs={'pk': '00000000-0000-0000-0000-000000000000'}),
+            HTTP_IF_NONE_MATCH='"0"',
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(os.environ.get('DJANGO_CACHE_URL'), 'Deposit coalescing needs Redis.')
+@override_settings(WALLET_DEPOSIT_COALESCE_WINDOW=50)
+@mock.patch.object(WalletRateThrottle, 'get_rate', lambda self: None)
+class DepositCoalescingTest(TransactionTestCase):
+    def test_concurrent_deposits(self):
+        wallet = Wallet.objects.create()
+        url = reverse('wallet-deposit', kwargs={'pk': wallet.uuid})
+
+        def deposit(amount):
+            try:
+                return APIClient().patch(url, data={'amount': amount}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(8) as executor:
+            statuses = list(executor.map(deposit, range(1, 9)))
+
+        self.assertEqual(statuses, [200] * 8)
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, 3600)
+
+    @mock.patch('transactions.coalescing.time.sleep')
+    def test_single_deposit_does_not_wait(self, sleep):
+        wallet = Wallet.objects.create()
+        response = APIClient().patch(reverse('wallet-deposit', kwargs={'pk': wallet.uuid}), data={'amount': 1})
+        self.assertEqual(response.status_code, 200)
+        sleep.assert_not_called()
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, 100)
+
+
+class TransferApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create()
+        self.url = reverse('wallet-transfer', kwargs={'pk': self.sender.uuid})
+
+    def test_transfer(self):
+        response = self.client.post(self.url, data={'target': self.receiver.uuid, 'amount': '30.00'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['balance'], '70.00')
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, 3000)
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, Transaction.Status.SUCCESS)
+
+    def test_transfer_with_insufficient_funds(self):
+        response = self.client.post(self.url, data={'target': self.receiver.uuid, 'amount': '130.00'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_to_self(self):
+        response = self.client.post(self.url, data={'target': self.sender.uuid, 'amount': '30.00'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transfer_to_missing_wallet(self):
+        response = self.client.post(self.url, data={
+            'target': '00000000-0000-0000-0000-000000000000', 'amount': '30.00'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class TransactionApiTest(TestCase):
     def setUp(self):
         self.client = APIClient()
-        self.sender_uuid = str(Wallet.objects.create(balance='100').uuid)
+        self.sender_uuid = str(Wallet.objects.create(balance=10000).uuid)
         self.receiver_uuid = str(Wallet.objects.create().uuid)
     
     def test_create_transaction(self):
@@ -51,7 +231,7 @@ class TransactionApiTest(TestCase):
         assert transaction
         self.assertEqual(str(transaction.sender.uuid), self.sender_uuid)
         self.assertEqual(str(transaction.receiver.uuid), self.receiver_uuid)
-        self.assertEqual(transaction.amount, 100)
+        self.assertEqual(transaction.amount, 10000)
 
         transaction.scheduled_time -= timezone.timedelta(minutes=2)
         transaction.save()
@@ -62,4 +242,4 @@ class TransactionApiTest(TestCase):
 
         self.assertEqual(transaction.status, 'SUCCESS')
         self.assertEqual(Wallet.objects.get(uuid=self.sender_uuid).balance, 0)
-        self.assertEqual(Wallet.objects.get(uuid=self.receiver_uuid).balance, 100)
\ No newline at end of file
+        self.assertEqual(Wallet.objects.get(uuid=self.receiver_uuid).balance, 10000)
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from transactions.models import Transaction, Wallet
+from transactions.tasks import process_withdrawal
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EventsUnavailableTest(TestCase):
+    def test_events_need_redis(self):
+        wallet = Wallet.objects.create()
+        response = self.client.get(reverse('wallet-events', kwargs={'pk': wallet.uuid}))
+        self.assertEqual(response.status_code, 503)
+
+
+@skipUnless(os.environ.get('DJANGO_CACHE_URL'), 'Event streams need Redis.')
+class WalletEventsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender = Wallet.objects.create(balance=10000)
+        cls.receiver = Wallet.objects.create()
+
+    async def read_event(self, stream):
+        chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+        event, data = chunk.strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_missing_wallet(self):
+        response = await self.async_client.get(
+            reverse('wallet-events', kwargs={'pk': '00000000-0000-0000-0000-000000000000'}))
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('transactions.tasks.request_transactions')
+    async def test_stream(self, request_transactions):
+        response = await self.async_client.get(
+            reverse('wallet-events', kwargs={'pk': self.sender.uuid}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+
+        def deposit():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.sender.deposit(5000)
+
+        await sync_to_async(deposit)()
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'deposit')
+        self.assertEqual(data['balance'], '150.00')
+
+        def withdraw():
+            transaction = Transaction.objects.create(
+                sender=self.sender,
+                receiver=self.receiver,
+                amount=3000,
+                scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+            )
+            Transaction.objects \
+                .filter(uuid=transaction.uuid) \
+                .update(scheduled_time=timezone.now())
+            with self.captureOnCommitCallbacks(execute=True):
+                process_withdrawal(str(transaction.uuid))
+            return transaction
+
+        transaction = await sync_to_async(withdraw)()
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'transaction')
+        self.assertEqual(data['uuid'], str(transaction.uuid))
+        self.assertEqual(data['status'], Transaction.Status.SUCCESS)
+
+        await stream.aclose()
@@ -1,6 +1,7 @@
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.db.utils import IntegrityError
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -11,48 +12,109 @@ from transactions.models import Wallet, Transaction
 class WalletModelTest(TestCase):
     def test_wallet_creation(self):
         wallet = Wallet.objects.create()
-        self.assertEqual(wallet.balance, Decimal('0.00'))
+        self.assertEqual(wallet.balance, 0)
 
     def test_wallet_creation_with_balance(self):
-        wallet = Wallet.objects.create(balance=Decimal('100.00'))
-        self.assertEqual(wallet.balance, Decimal('100.00'))
+        wallet = Wallet.objects.create(balance=10000)
+        self.assertEqual(wallet.balance, 10000)
 
     def test_wallet_creation_with_negative_balance(self):
         with self.assertRaises(IntegrityError):
-            Wallet.objects.create(balance=Decimal('-100.00'))
+            Wallet.objects.create(balance=-10000)
 
     def test_wallet_deposit(self):
-        wallet = Wallet.objects.create(balance=Decimal('100.00'))
-        wallet.deposit(Decimal('50.00'))
+        wallet = Wallet.objects.create(balance=10000)
+        wallet.deposit(5000)
         wallet.refresh_from_db()
-        self.assertEqual(wallet.balance, Decimal('150.00'))
+        self.assertEqual(wallet.balance, 15000)
 
     def test_negative_deposit(self):
-        wallet = Wallet.objects.create(balance=Decimal('100.00'))
+        wallet = Wallet.objects.create(balance=10000)
         with self.assertRaises(ValidationError):
-            wallet.deposit(Decimal('-50.00'))
+            wallet.deposit(-5000)
 
     def test_zero_deposit(self):
-        wallet = Wallet.objects.create(balance=Decimal('100.00'))
+        wallet = Wallet.objects.create(balance=10000)
         with self.assertRaises(ValidationError):
-            wallet.deposit(Decimal('0.00'))
+            wallet.deposit(0)
+
+    def test_deposit_exceeding_max_balance(self):
+        wallet = Wallet.objects.create(balance=2 ** 63 - 1)
+        with self.assertRaises(ValidationError):
+            wallet.deposit(1)
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, 2 ** 63 - 1)
+
+    def test_deposit_to_missing_wallet(self):
+        with self.assertRaises(Wallet.DoesNotExist):
+            Wallet().deposit(5000)
+
+    def test_wallet_transfer(self):
+        sender = Wallet.objects.create(balance=10000)
+        receiver = Wallet.objects.create(balance=1000)
+        transfer = sender.transfer(receiver, 6000)
+        self.assertEqual((sender.balance, receiver.balance), (4000, 7000))
+
+        sender.refresh_from_db()
+        receiver.refresh_from_db()
+        transfer.refresh_from_db()
+        self.assertEqual((sender.balance, receiver.balance), (4000, 7000))
+        self.assertEqual(transfer.status, Transaction.Status.SUCCESS)
+        self.assertEqual(transfer.amount, 6000)
+
+    def test_transfer_with_insufficient_funds(self):
+        sender = Wallet.objects.create(balance=10000)
+        receiver = Wallet.objects.create()
+        with self.assertRaises(ValidationError):
+            sender.transfer(receiver, 10001)
+        sender.refresh_from_db()
+        self.assertEqual(sender.balance, 10000)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_to_missing_wallet(self):
+        sender = Wallet.objects.create(balance=10000)
+        with self.assertRaises(Wallet.DoesNotExist):
+            sender.transfer(Wallet(), 1000)
+
+
+class ConcurrentTransferTest(TransactionTestCase):
+    def test_opposite_transfers(self):
+        a = Wallet.objects.create(balance=100000)
+        b = Wallet.objects.create(balance=100000)
+
+        def transfer(i):
+            sender, receiver = (a, b) if i % 2 else (b, a)
+            try:
+                Wallet.objects.transfer(sender.uuid, receiver.uuid, i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(transfer, range(1, 41)))
+
+        a.refresh_from_db()
+        b.refresh_from_db()
+        # odd amounts go from a to b, even ones from b to a
+        self.assertEqual(a.balance, 100000 - 400 + 420)
+        self.assertEqual(b.balance, 100000 + 400 - 420)
+        self.assertEqual(Transaction.objects.count(), 40)
 
 
 class TransactionModelTest(TestCase):
     def setUp(self):
-        self.sender = Wallet.objects.create(balance=Decimal('100.00'))
-        self.receiver = Wallet.objects.create(balance=Decimal('50.00'))
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create(balance=5000)
 
     def test_transaction_creation(self):
         transaction = Transaction.objects.create(
             sender=self.sender,
             receiver=self.receiver,
-            amount=Decimal('20.00'),
+            amount=2000,
             scheduled_time=timezone.now() + timezone.timedelta(days=1),
         )
         self.assertEqual(transaction.sender, self.sender)
         self.assertEqual(transaction.receiver, self.receiver)
-        self.assertEqual(transaction.amount, Decimal('20.00'))
+        self.assertEqual(transaction.amount, 2000)
         self.assertEqual(transaction.status, 'PENDING')
     
     def test_transaction_creation_with_invalid_scheduled_time(self):
@@ -60,7 +122,7 @@ class TransactionModelTest(TestCase):
             Transaction(
                 sender=self.sender,
                 receiver=self.receiver,
-                amount=Decimal('20.00'),
+                amount=2000,
                 scheduled_time=timezone.now() - timezone.timedelta(days=1),
             ).full_clean()
     def test_transaction_creation_with_invalid_amount(self):
@@ -68,6 +130,6 @@ class TransactionModelTest(TestCase):
             Transaction.objects.create(
                 sender=self.sender,
                 receiver=self.receiver,
-                amount=Decimal('-20.00'),
+                amount=-2000,
                 scheduled_time=timezone.now() + timezone.timedelta(days=1),
             )
@@ -0,0 +1,28 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from transactions.money import from_minor, to_minor
+from transactions.serializers import MoneyField
+
+
+class MoneyTest(SimpleTestCase):
+    def test_to_minor(self):
+        self.assertEqual(to_minor(Decimal('1234.56')), 123456)
+        self.assertEqual(to_minor('0.01'), 1)
+        self.assertEqual(to_minor(7), 700)
+        self.assertEqual(to_minor(Decimal('99999999999999.99')), 9999999999999999)
+
+    def test_to_minor_rejects_fractions_of_minor_units(self):
+        with self.assertRaises(ValueError):
+            to_minor(Decimal('0.001'))
+
+    def test_from_minor(self):
+        self.assertEqual(str(from_minor(123456)), '1234.56')
+        self.assertEqual(str(from_minor(0)), '0.00')
+        self.assertEqual(str(from_minor(-5)), '-0.05')
+
+    def test_money_field(self):
+        field = MoneyField()
+        self.assertEqual(field.run_validation('12.30'), 1230)
+        self.assertEqual(field.to_representation(1230), '12.30')
@@ -0,0 +1,107 @@
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from transactions.lanes import lane_of, queue_name, routing
+from transactions.models import Transaction, Wallet, WithdrawalOutbox
+from transactions.outbox import relay_outbox
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create(balance=10000)
+
+    def create_transaction(self):
+        return Transaction.objects.create(
+            sender=self.sender,
+            receiver=self.receiver,
+            amount=1000,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+
+    def test_withdrawal_is_enqueued_once(self):
+        transaction = self.create_transaction()
+        transaction.status = Transaction.Status.SUCCESS
+        transaction.save()
+
+        entry = WithdrawalOutbox.objects.get()
+        self.assertEqual(entry.transaction_id, transaction.uuid)
+        self.assertEqual(entry.eta, transaction.scheduled_time)
+
+    @override_settings(WITHDRAWAL_DISPATCH_MODE='batch')
+    def test_batch_mode_skips_outbox(self):
+        self.create_transaction()
+        self.assertFalse(WithdrawalOutbox.objects.exists())
+
+    @mock.patch('transactions.outbox.process_withdrawal.apply_async')
+    def test_relay_publishes_and_deletes(self, apply_async):
+        transactions = [self.create_transaction() for _ in range(3)]
+
+        self.assertEqual(relay_outbox(batch_size=2), 2)
+        self.assertEqual(relay_outbox(batch_size=2), 1)
+        self.assertEqual(relay_outbox(batch_size=2), 0)
+
+        self.assertEqual(
+            [call.args[0] for call in apply_async.call_args_list],
+            [(t.uuid,) for t in transactions],
+        )
+        self.assertEqual(apply_async.call_args.kwargs['eta'], transactions[-1].scheduled_time)
+        self.assertFalse(WithdrawalOutbox.objects.exists())
+
+    @mock.patch('transactions.outbox.process_withdrawal.apply_async')
+    def test_relay_backs_off_on_publish_error(self, apply_async):
+        first, second = self.create_transaction(), self.create_transaction()
+        apply_async.side_effect = [None, ConnectionError('broker down')]
+
+        self.assertEqual(relay_outbox(), 1)
+
+        entry = WithdrawalOutbox.objects.get()
+        self.assertEqual(entry.transaction_id, second.uuid)
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, 'broker down')
+        self.assertGreater(entry.available_at, timezone.now())
+        # postponed entries are not retried before their backoff
+        self.assertEqual(relay_outbox(), 0)
+
+    @override_settings(WITHDRAWAL_LANES=8)
+    @mock.patch('transactions.outbox.process_withdrawal.apply_async')
+    def test_relay_routes_to_sender_lane(self, apply_async):
+        other_sender = Wallet.objects.create(balance=10000)
+        self.create_transaction()
+        Transaction.objects.create(
+            sender=other_sender,
+            receiver=self.receiver,
+            amount=1000,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        self.create_transaction()
+
+        relay_outbox()
+
+        self.assertEqual(
+            [call.kwargs['queue'] for call in apply_async.call_args_list],
+            [queue_name(lane_of(wallet.uuid, 8)) for wallet in [self.sender, other_sender, self.sender]],
+        )
+
+
+class LanesTestCase(SimpleTestCase):
+    def test_jump_hash(self):
+        keys = [uuid.uuid4() for _ in range(1000)]
+        for lanes in [1, 7, 16]:
+            with self.subTest(lanes=lanes):
+                assigned = [lane_of(key, lanes) for key in keys]
+                self.assertEqual(set(assigned), set(range(lanes)))
+                # adding a lane only moves senders to the new lane
+                for key, lane in zip(keys, assigned):
+                    self.assertIn(lane_of(key, lanes + 1), (lane, lanes))
+
+    def test_routing(self):
+        sender = uuid.uuid4()
+        with override_settings(WITHDRAWAL_LANES=0):
+            self.assertEqual(routing(sender), {})
+        with override_settings(WITHDRAWAL_LANES=4):
+            self.assertEqual(routing(sender), {'queue': queue_name(lane_of(sender, 4))})
+            self.assertEqual(routing(str(sender)), routing(sender))
@@ -0,0 +1,104 @@
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from transactions.models import Deposit, Wallet, Transaction
+from transactions.partitions import (
+    DEFAULT_PARTITION,
+    TABLE,
+    detach_partitions,
+    ensure_partitions,
+    list_partitions,
+    month_start,
+    partition_name,
+)
+from transactions.reconciliation import reconcile, uuid_ranges
+
+
+class PartitionsTestCase(TestCase):
+    def setUp(self):
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create(balance=10000)
+
+    def create_transaction(self, created, status=Transaction.Status.SUCCESS):
+        transaction = Transaction.objects.create(
+            sender=self.sender,
+            receiver=self.receiver,
+            amount=1000,
+            scheduled_time=created,
+        )
+        Transaction.objects.filter(uuid=transaction.uuid).update(
+            created=created, status=status)
+        return transaction
+
+    def partition_of(self, transaction):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT tableoid::regclass::text FROM {TABLE} WHERE uuid = %s',
+                [transaction.uuid],
+            )
+            return cursor.fetchone()[0]
+
+    def test_table_is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT relkind FROM pg_class WHERE relname = %s', [TABLE])
+            self.assertEqual(cursor.fetchone()[0], 'p')
+
+        names = [partition.name for partition in list_partitions()]
+        self.assertIn(DEFAULT_PARTITION, names)
+
+    def test_constraints_are_kept(self):
+        transaction = self.create_transaction(timezone.now())
+        self.assertEqual(Transaction.objects.get(uuid=transaction.uuid), transaction)
+
+        constraint_names = connection.introspection.get_constraints(
+            connection.cursor(), TABLE)
+        self.assertIn('positive_amount', constraint_names)
+        self.assertIn('sender_and_receiver_are_different', constraint_names)
+
+    def test_ensure_partitions_moves_rows_out_of_default_partition(self):
+        future = month_start(timezone.now(), 6)
+        transaction = self.create_transaction(future)
+        self.assertEqual(self.partition_of(transaction), DEFAULT_PARTITION)
+
+        created = ensure_partitions(months_ahead=6)
+
+        self.assertIn(partition_name(future), created)
+        self.assertEqual(self.partition_of(transaction), partition_name(future))
+        self.assertEqual(ensure_partitions(months_ahead=6), [])
+
+    def test_detach_partitions(self):
+        ensure_partitions(months_ahead=3)
+        month = month_start(timezone.now(), 2)
+        self.create_transaction(month)
+        pending = self.create_transaction(
+            month_start(timezone.now(), 3), status=Transaction.Status.PENDING)
+
+        detached = detach_partitions(month_start(timezone.now(), 4), 'archive')
+
+        self.assertIn(partition_name(month), detached)
+        self.assertNotIn(partition_name(month_start(timezone.now(), 3)), detached)
+        self.assertTrue(Transaction.objects.filter(uuid=pending.uuid).exists())
+        self.assertEqual(
+            Transaction.objects.filter(created__gte=month, created__lt=month_start(month, 1)).count(),
+            0,
+        )
+
+    def test_detached_history_is_carried_forward(self):
+        for wallet in [self.sender, self.receiver]:
+            Deposit.objects.create(wallet=wallet, amount=10000, kind=Deposit.Kind.OPENING)
+        ensure_partitions(months_ahead=3)
+        self.create_transaction(month_start(timezone.now(), 2))
+        self.create_transaction(month_start(timezone.now(), 2))
+        Wallet.objects.filter(uuid=self.sender.uuid).update(balance=8000)
+        Wallet.objects.filter(uuid=self.receiver.uuid).update(balance=12000)
+
+        detach_partitions(month_start(timezone.now(), 3))
+
+        self.assertEqual(
+            sorted(Deposit.objects.filter(kind=Deposit.Kind.CARRY).values_list('amount', flat=True)),
+            [-2000, 2000],
+        )
+        self.assertEqual([d for result in reconcile(uuid_ranges(2)) for d in result['discrepancies']], [])
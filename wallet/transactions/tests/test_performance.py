@@ -0,0 +1,159 @@
+"""
+Query count and latency budgets of the API endpoints and the withdrawal
+task at several history sizes.
+
+A budget failure lists the executed queries. The latency budgets are loose
+enough for slow CI machines and only catch regressions by an order of
+magnitude; the query counts are exact upper bounds.
+"""
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from transactions.models import Transaction, Wallet
+from transactions.renderers import COMPACT_MEDIA_TYPE
+from transactions.tasks import process_withdrawal
+from transactions.throttling import WalletRateThrottle
+
+HISTORY_SIZES = [0, 100, 10_000]
+
+# action: (max queries, max seconds per history size), the query counts
+# include the savepoints of the atomic blocks nested in the test transaction
+BUDGETS = {
+    'create': (3, {0: 0.5}),
+    'retrieve': (4, {0: 0.5, 100: 0.5, 10_000: 10}),
+    'retrieve_compact': (4, {0: 0.5, 100: 0.5, 10_000: 2}),
+    'retrieve_not_modified': (1, {0: 0.5, 100: 0.5, 10_000: 0.5}),
+    'deposit': (7, {0: 0.5, 100: 0.5, 10_000: 10}),
+    'withdraw': (13, {0: 0.5, 100: 0.5, 10_000: 10}),
+    'transfer': (9, {0: 0.5, 100: 0.5, 10_000: 10}),
+    'process_withdrawal': (7, {0: 0.5, 100: 0.5, 10_000: 0.5}),
+}
+
+
+class BudgetTestCase(TestCase):
+    @contextmanager
+    def assertWithinBudget(self, action, size):
+        max_queries, max_seconds = BUDGETS[action]
+        max_seconds = max_seconds[size]
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - started
+
+        queries = '\n'.join(
+            f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+        self.assertLessEqual(
+            len(context), max_queries,
+            f'{action} with {size} transactions executed {len(context)} queries, '
+            f'{max_queries} allowed:\n{queries}',
+        )
+        self.assertLessEqual(
+            elapsed, max_seconds,
+            f'{action} with {size} transactions took {elapsed:.3f}s, '
+            f'{max_seconds}s allowed:\n{queries}',
+        )
+
+
+@mock.patch.object(WalletRateThrottle, 'get_rate', lambda self: None)
+class ApiBudgetTest(BudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.wallets = {}
+        cls.counterparty = Wallet.objects.create(balance=100000000)
+        now = timezone.now()
+        for size in HISTORY_SIZES:
+            wallet = cls.wallets[size] = Wallet.objects.create(balance=100000000)
+            Transaction.objects.bulk_create([
+                Transaction(
+                    sender=wallet if i % 2 else cls.counterparty,
+                    receiver=cls.counterparty if i % 2 else wallet,
+                    amount=1000,
+                    scheduled_time=now + timezone.timedelta(minutes=i),
+                    status=Transaction.Status.SUCCESS,
+                )
+                for i in range(size)
+            ], batch_size=1000)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_create(self):
+        with self.assertWithinBudget('create', 0):
+            response = self.client.post(reverse('wallet-list'))
+        self.assertEqual(response.status_code, 201)
+
+    def test_retrieve(self):
+        for size, wallet in self.wallets.items():
+            with self.subTest(size=size):
+                url = reverse('wallet-detail', kwargs={'pk': wallet.uuid})
+                with self.assertWithinBudget('retrieve', size):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+                with self.assertWithinBudget('retrieve_compact', size):
+                    response = self.client.get(url, HTTP_ACCEPT=COMPACT_MEDIA_TYPE)
+                self.assertEqual(response.status_code, 200)
+
+                with self.assertWithinBudget('retrieve_not_modified', size):
+                    response = self.client.get(
+                        url, HTTP_ACCEPT=COMPACT_MEDIA_TYPE, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_deposit(self):
+        for size, wallet in self.wallets.items():
+            with self.subTest(size=size):
+                url = reverse('wallet-deposit', kwargs={'pk': wallet.uuid})
+                with self.assertWithinBudget('deposit', size):
+                    response = self.client.patch(url, data={'amount': 10})
+                self.assertEqual(response.status_code, 200)
+
+    def test_withdraw(self):
+        for size, wallet in self.wallets.items():
+            with self.subTest(size=size):
+                url = reverse('wallet-withdraw', kwargs={'pk': wallet.uuid})
+                with self.assertWithinBudget('withdraw', size):
+                    response = self.client.post(url, data={
+                        'target': self.counterparty.uuid,
+                        'amount': 10,
+                        'scheduled_time': timezone.now() + timezone.timedelta(minutes=2),
+                    })
+                self.assertEqual(response.status_code, 201)
+
+    def test_transfer(self):
+        for size, wallet in self.wallets.items():
+            with self.subTest(size=size):
+                url = reverse('wallet-transfer', kwargs={'pk': wallet.uuid})
+                with self.assertWithinBudget('transfer', size):
+                    response = self.client.post(url, data={
+                        'target': self.counterparty.uuid,
+                        'amount': 10,
+                    })
+                self.assertEqual(response.status_code, 201)
+
+    @mock.patch('transactions.tasks.request_transactions')
+    def test_process_withdrawal(self, request_transactions):
+        for size, wallet in self.wallets.items():
+            with self.subTest(size=size):
+                transaction = Transaction.objects.create(
+                    sender=wallet,
+                    receiver=self.counterparty,
+                    amount=1000,
+                    scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+                )
+                Transaction.objects \
+                    .filter(uuid=transaction.uuid) \
+                    .update(scheduled_time=timezone.now())
+
+                with self.assertWithinBudget('process_withdrawal', size):
+                    process_withdrawal(str(transaction.uuid))
+
+                transaction.refresh_from_db()
+                self.assertEqual(transaction.status, Transaction.Status.SUCCESS)
@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+import tempfile
+import uuid
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from transactions.models import Deposit, Wallet
+from transactions.reconciliation import reconcile, uuid_ranges
+from transactions.tests.pool import setup_test_worker
+
+
+class ReconciliationTest(TestCase):
+    def setUp(self):
+        self.wallets = [Wallet.objects.create() for _ in range(6)]
+        for i, wallet in enumerate(self.wallets):
+            wallet.deposit(10000 * (i + 1))
+        for sender, receiver in zip(self.wallets, self.wallets[1:]):
+            sender.transfer(receiver, 2500)
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+        self.report = os.path.join(self.directory.name, 'report.csv')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_uuid_ranges(self):
+        ranges = uuid_ranges(3)
+        self.assertEqual(ranges[0][0], uuid.UUID(int=0))
+        self.assertEqual(ranges[-1][1], uuid.UUID(int=2 ** 128 - 1))
+        for (_, high), (low, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(high.int + 1, low.int)
+
+    def test_deposits_are_recorded(self):
+        self.assertEqual(
+            list(Deposit.objects.filter(wallet=self.wallets[0]).values_list('amount', 'kind')),
+            [(10000, Deposit.Kind.DEPOSIT)],
+        )
+
+    def test_consistent_balances(self):
+        results = list(reconcile(uuid_ranges(4)))
+        self.assertEqual(sum(result['wallets'] for result in results), 6)
+        self.assertEqual([d for result in results for d in result['discrepancies']], [])
+
+    def test_discrepancies(self):
+        tampered = self.wallets[2]
+        Wallet.objects.filter(uuid=tampered.uuid).update(balance=1)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile', ranges=4, processes=1,
+                         checkpoint=self.checkpoint, report=self.report)
+
+        with open(self.report) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows, [
+            ['wallet', 'balance', 'expected', 'difference'],
+            [str(tampered.uuid), '0.01', '300.00', '-299.99'],
+        ])
+
+    def test_resume(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'ranges': 2, 'done': {str(uuid_ranges(2)[0][0]): {
+                'low': str(uuid_ranges(2)[0][0]), 'high': str(uuid_ranges(2)[0][1]),
+                'wallets': 100, 'discrepancies': [],
+            }}}, f)
+
+        # the first range is taken from the checkpoint
+        call_command('reconcile', ranges=2, processes=1, checkpoint=self.checkpoint)
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        second = [w for w in self.wallets if w.uuid >= uuid_ranges(2)[1][0]]
+        self.assertEqual(
+            sum(result['wallets'] for result in checkpoint['done'].values()), 100 + len(second))
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile', ranges=4, processes=1, checkpoint=self.checkpoint)
+
+
+class ReconciliationPoolTest(TransactionTestCase):
+    def test_spawned_workers(self):
+        wallets = [Wallet.objects.create() for _ in range(4)]
+        for wallet in wallets:
+            wallet.deposit(10000)
+        wallets[0].transfer(wallets[1], 2500)
+        Wallet.objects.filter(uuid=wallets[2].uuid).update(balance=1)
+
+        results = list(reconcile(uuid_ranges(4), processes=2, initializer=setup_test_worker,
+                                 initargs=('default', connection.settings_dict['NAME'])))
+
+        self.assertEqual(sum(result['wallets'] for result in results), 4)
+        self.assertEqual(
+            [d[0] for result in results for d in result['discrepancies']],
+            [str(wallets[2].uuid)],
+        )
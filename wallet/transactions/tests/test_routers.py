@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from transactions.models import Wallet
+from wallet.middleware import ReplicaRoutingMiddleware
+from wallet.routers import PrimaryReplicaRouter, replica_reads
+
+REPLICA_DATABASES = {
+    'default': settings.DATABASES['default'],
+    'replica': settings.DATABASES['default'],
+}
+
+
+@override_settings(DATABASES=REPLICA_DATABASES)
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(Wallet), 'default')
+
+    def test_replica_reads(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Wallet), 'replica')
+            self.assertEqual(self.router.db_for_write(Wallet), 'default')
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'transactions'))
+        self.assertTrue(self.router.allow_migrate('default', 'transactions'))
+
+    @override_settings(DATABASES={'default': settings.DATABASES['default']})
+    def test_without_replica(self):
+        with replica_reads():
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(Wallet), 'default')
+
+
+@override_settings(DATABASES=REPLICA_DATABASES)
+class PrimaryReplicaRouterTransactionTest(TestCase):
+    def test_replica_reads_inside_transaction(self):
+        # TestCase wraps every test in a transaction on the primary
+        with replica_reads():
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(Wallet), 'default')
+
+
+@override_settings(DATABASES=REPLICA_DATABASES)
+class ReplicaRoutingMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.replica_reads = None
+
+        def get_response(request):
+            self.replica_reads = PrimaryReplicaRouter().db_for_read(Wallet) == 'replica'
+            return HttpResponse()
+
+        self.middleware = ReplicaRoutingMiddleware(get_response)
+
+    def test_safe_request_reads_from_replica(self):
+        response = self.middleware(self.factory.get('/api/wallets/'))
+        self.assertTrue(self.replica_reads)
+        self.assertNotIn(settings.DATABASE_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_unsafe_request_pins_client_to_primary(self):
+        response = self.middleware(self.factory.patch('/api/wallets/'))
+        self.assertFalse(self.replica_reads)
+        self.assertEqual(
+            response.cookies[settings.DATABASE_REPLICA_PIN_COOKIE]['max-age'],
+            settings.DATABASE_REPLICA_PIN_SECONDS,
+        )
+
+    def test_pinned_client_reads_from_primary(self):
+        request = self.factory.get('/api/wallets/')
+        request.COOKIES[settings.DATABASE_REPLICA_PIN_COOKIE] = '1'
+        self.middleware(request)
+        self.assertFalse(self.replica_reads)
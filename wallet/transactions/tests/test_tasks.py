@@ -1,33 +1,44 @@
-from decimal import Decimal
+from threading import Event, Thread
 from time import sleep
+from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 
-from transactions.models import Wallet, Transaction
-from transactions.tasks import process_withdrawal, request_transactions
+from transactions.dispatcher import lag_metrics
+from transactions.models import Wallet, WalletDailyAggregate, Transaction, WithdrawalOutbox
+from transactions.tasks import (
+    dispatch_fair_withdrawals,
+    process_withdrawal,
+    process_withdrawal_batch,
+    recover_stuck_withdrawals,
+    request_transactions,
+)
+from wallet.celery import app
 
 
 TRANSACTION_TESTS = [
     {
-        'amount': Decimal('20.00'),
+        'amount': 2000,
         'status': 'SUCCESS',
-        'sender_balance': Decimal('80.00'),
-        'receiver_balance': Decimal('120.00'),
+        'sender_balance': 8000,
+        'receiver_balance': 12000,
     },
     {
-        'amount': Decimal('120.00'),
+        'amount': 12000,
         'status': 'FAILED',
-        'sender_balance': Decimal('100.00'),
-        'receiver_balance': Decimal('100.00'),
+        'sender_balance': 10000,
+        'receiver_balance': 10000,
     },
 ]
 
 
 class TasksTestCase(TestCase):
     def setUp(self):
-        self.sender = Wallet.objects.create(balance=Decimal('100.00'))
-        self.receiver = Wallet.objects.create(balance=Decimal('100.00'))
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create(balance=10000)
 
     def test_create_transaction_implemented(self):
         """
@@ -44,7 +55,10 @@ class TasksTestCase(TestCase):
         """
         request_transactions()
 
-    def test_process_withdrawal_task(self):
+    @mock.patch('transactions.tasks.requests.post')
+    def test_process_withdrawal_task(self, post):
+        # the provider accepts every transfer, the outcome depends on the balance
+        post.return_value.ok = True
         for transaction_test in TRANSACTION_TESTS:
             with self.subTest(name=transaction_test['status']):
                 self.setUp()
@@ -65,3 +79,251 @@ class TasksTestCase(TestCase):
                                  transaction_test['sender_balance'])
                 self.assertEqual(self.receiver.balance,
                                  transaction_test['receiver_balance'])
+
+    @mock.patch('transactions.tasks.request_transactions_batch')
+    def test_process_withdrawal_batch(self, request_transactions_batch):
+        request_transactions_batch.side_effect = lambda transfers: {
+            str(transfer['id']): {'id': transfer['id'], 'data': 'success', 'status': 200}
+            for transfer in transfers
+        }
+        other_receiver = Wallet.objects.create(balance=0)
+        transactions = [
+            Transaction.objects.create(
+                sender=self.sender,
+                receiver=receiver,
+                amount=6000,
+                scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+            )
+            for receiver in [self.receiver, other_receiver]
+        ]
+        not_due = Transaction.objects.create(
+            sender=self.receiver,
+            receiver=self.sender,
+            amount=1000,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects \
+            .filter(uuid__in=[t.uuid for t in transactions]) \
+            .update(scheduled_time=timezone.now())
+
+        self.assertEqual(process_withdrawal_batch(10), 2)
+
+        for transaction in [*transactions, not_due]:
+            transaction.refresh_from_db()
+        # the second withdrawal exceeds the balance left by the first one
+        self.assertEqual([t.status for t in transactions], ['SUCCESS', 'FAILED'])
+        # only the valid withdrawal is sent to the provider
+        request_transactions_batch.assert_called_once()
+        self.assertEqual(
+            [transfer['id'] for transfer in request_transactions_batch.call_args.args[0]],
+            [transactions[0].uuid],
+        )
+        self.assertEqual(not_due.status, 'PENDING')
+        for wallet, balance in [(self.sender, 4000), (self.receiver, 16000),
+                                (other_receiver, 0)]:
+            wallet.refresh_from_db()
+            self.assertEqual(wallet.balance, balance)
+
+        self.assertEqual(process_withdrawal_batch(10), 0)
+
+    @mock.patch('transactions.tasks.process_withdrawal.apply_async')
+    def test_recover_stuck_withdrawals(self, apply_async):
+        cache.clear()
+        transactions = [
+            Transaction.objects.create(
+                sender=self.sender,
+                receiver=self.receiver,
+                amount=1000,
+                scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+            )
+            for _ in range(5)
+        ]
+        # the last withdrawal is not due yet
+        stuck, in_outbox = transactions[:3], transactions[3]
+        Transaction.objects \
+            .filter(uuid__in=[t.uuid for t in [*stuck, in_outbox]]) \
+            .update(scheduled_time=timezone.now() - timezone.timedelta(hours=1))
+        WithdrawalOutbox.objects.exclude(transaction=in_outbox).delete()
+
+        self.assertEqual(recover_stuck_withdrawals(chunk_size=2), 3)
+        self.assertEqual(
+            {call.args[0] for call in apply_async.call_args_list},
+            {(t.uuid,) for t in stuck},
+        )
+        # enqueued withdrawals are not enqueued again within the grace period
+        self.assertEqual(recover_stuck_withdrawals(chunk_size=2), 0)
+
+    @mock.patch('transactions.tasks.request_transactions')
+    def test_process_withdrawal_is_idempotent(self, request_transactions):
+        transaction = Transaction.objects.create(
+            sender=self.sender,
+            receiver=self.receiver,
+            amount=2000,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects \
+            .filter(uuid=transaction.uuid) \
+            .update(scheduled_time=timezone.now())
+
+        for _ in range(2):
+            process_withdrawal(str(transaction.uuid))
+
+        request_transactions.assert_called_once()
+        self.assertEqual(request_transactions.call_args.kwargs['idempotency_key'], transaction.uuid)
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, 8000)
+
+
+@override_settings(
+    WITHDRAWAL_FAIR_MAX_IN_FLIGHT=4,
+    WITHDRAWAL_FAIR_SENDER_CONCURRENCY=2,
+    WITHDRAWAL_FAIR_BULK_THRESHOLD=5,
+    WITHDRAWAL_LANES=0,
+)
+@mock.patch('transactions.tasks.process_withdrawal.apply_async')
+class FairDispatchTestCase(TestCase):
+    def setUp(self):
+        self.receiver = Wallet.objects.create(balance=0)
+        self.bulk_sender = Wallet.objects.create(balance=10000)
+        # the bulk payout became due before the withdrawals of the others
+        self.bulk = [self.withdrawal(self.bulk_sender, minutes=10 - i) for i in range(5)]
+        self.small = [
+            self.withdrawal(Wallet.objects.create(balance=10000), minutes=minutes)
+            for minutes in [2, 1]
+        ]
+
+    def withdrawal(self, sender, minutes):
+        transaction = Transaction.objects.create(
+            sender=sender,
+            receiver=self.receiver,
+            amount=100,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=2),
+        )
+        Transaction.objects \
+            .filter(uuid=transaction.uuid) \
+            .update(scheduled_time=timezone.now() - timezone.timedelta(minutes=minutes))
+        return transaction
+
+    def dispatched(self, apply_async):
+        dispatched = [call.args[0][0] for call in apply_async.call_args_list]
+        apply_async.reset_mock()
+        return dispatched
+
+    def test_round_robin_by_sender(self, apply_async):
+        self.assertEqual(dispatch_fair_withdrawals(), 4)
+        # every sender gets a turn before the bulk sender's second one
+        self.assertEqual(
+            self.dispatched(apply_async),
+            [self.bulk[0].uuid, self.small[0].uuid, self.small[1].uuid, self.bulk[1].uuid],
+        )
+        self.assertEqual(
+            Transaction.objects.filter(dispatched_at__isnull=False).count(), 4,
+        )
+
+        # nothing more while the in-flight withdrawals are unsettled
+        self.assertEqual(dispatch_fair_withdrawals(), 0)
+
+        Transaction.objects \
+            .filter(uuid__in=[self.bulk[0].uuid, self.small[0].uuid]) \
+            .update(status=Transaction.Status.SUCCESS)
+        self.assertEqual(dispatch_fair_withdrawals(), 1)
+        # the bulk sender is capped at two withdrawals in flight
+        self.assertEqual(self.dispatched(apply_async), [self.bulk[2].uuid])
+
+    def test_redispatch_lost_withdrawals(self, apply_async):
+        dispatch_fair_withdrawals()
+        self.dispatched(apply_async)
+
+        Transaction.objects \
+            .filter(uuid=self.small[1].uuid) \
+            .update(dispatched_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(dispatch_fair_withdrawals(), 1)
+        self.assertEqual(self.dispatched(apply_async), [self.small[1].uuid])
+
+    def test_lag_metrics(self, apply_async):
+        metrics = lag_metrics([
+            {'tier': 'small', 'lag': 1.0},
+            {'tier': 'small', 'lag': 3.0},
+            {'tier': 'bulk', 'lag': 600.0},
+        ])
+        self.assertEqual(metrics['small_dispatched'], 2)
+        self.assertEqual(metrics['small_lag_max'], 3.0)
+        self.assertEqual(metrics['bulk_lag_p50'], 600.0)
+
+
+class TaskRoutingTestCase(SimpleTestCase):
+    def test_task_queues(self):
+        for task, queue in [
+            ('transactions.tasks.process_withdrawal', 'settlement'),
+            ('transactions.tasks.dispatch_due_withdrawals', 'settlement'),
+            ('transactions.tasks.dispatch_fair_withdrawals', 'settlement'),
+            ('transactions.tasks.recover_stuck_withdrawals', 'maintenance'),
+            ('transactions.tasks.unrouted', 'bulk'),
+        ]:
+            with self.subTest(task=task):
+                self.assertEqual(app.amqp.router.route({}, task)['queue'].name, queue)
+
+
+class ConcurrentWithdrawalsTestCase(TransactionTestCase):
+    def withdrawal(self, sender, receiver, amount):
+        transaction = Transaction.objects.create(
+            sender=sender,
+            receiver=receiver,
+            amount=amount,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects.filter(uuid=transaction.uuid).update(scheduled_time=timezone.now())
+        return transaction
+
+    def run_withdrawal(self, transaction):
+        try:
+            process_withdrawal(str(transaction.uuid))
+        finally:
+            connection.close()
+
+    def run_concurrently(self, slow, fast):
+        """
+        Process the ``fast`` withdrawal while the ``slow`` one waits for the
+        provider.
+        """
+        requested, release = Event(), Event()
+
+        def request_transactions(**kwargs):
+            if kwargs['idempotency_key'] == slow.uuid:
+                requested.set()
+                release.wait(10)
+
+        with mock.patch('transactions.tasks.request_transactions', request_transactions):
+            threads = [Thread(target=self.run_withdrawal, args=(transaction,)) for transaction in [slow, fast]]
+            threads[0].start()
+            self.assertTrue(requested.wait(10))
+            threads[1].start()
+            sleep(0.5)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+    def test_opposite_directions(self):
+        a, b = Wallet.objects.create(balance=10000), Wallet.objects.create(balance=10000)
+
+        self.run_concurrently(self.withdrawal(a, b, 2000), self.withdrawal(b, a, 1000))
+
+        self.assertEqual(
+            Transaction.objects.filter(status=Transaction.Status.SUCCESS).count(), 2)
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.balance, b.balance), (9000, 11000))
+
+    def test_shared_receiver(self):
+        receiver = Wallet.objects.create(balance=10000)
+
+        self.run_concurrently(
+            self.withdrawal(Wallet.objects.create(balance=10000), receiver, 2000),
+            self.withdrawal(Wallet.objects.create(balance=10000), receiver, 1000),
+        )
+
+        self.assertEqual(
+            Transaction.objects.filter(status=Transaction.Status.SUCCESS).count(), 2)
+        receiver.refresh_from_db()
+        self.assertEqual(receiver.balance, 13000)
+        self.assertEqual(WalletDailyAggregate.objects.get(wallet=receiver).closing_balance, 13000)
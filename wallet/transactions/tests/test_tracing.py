@@ -0,0 +1,61 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from transactions import tracing
+from transactions.models import Transaction, Wallet
+from transactions.tasks import process_withdrawal
+
+
+class TraceTest(SimpleTestCase):
+    @override_settings(TRACING=[])
+    def test_disabled(self):
+        with tracing.trace('test') as trace:
+            self.assertIs(trace, tracing.NOOP_TRACE)
+            with trace.span('stage'):
+                pass
+
+    @override_settings(TRACING=['log'])
+    def test_error_is_recorded(self):
+        with self.assertLogs('transactions.tracing') as logs, self.assertRaises(ValueError):
+            with tracing.trace('test', key='value') as trace:
+                with trace.span('stage'):
+                    raise ValueError('boom')
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['trace'], 'test')
+        self.assertEqual(record['key'], 'value')
+        self.assertEqual(record['error'], 'ValueError')
+        self.assertEqual(record['error_message'], 'boom')
+        self.assertIn('stage', record['stages'])
+
+
+@override_settings(TRACING=['log'])
+class WithdrawalTracingTest(TestCase):
+    @mock.patch('transactions.tasks.request_transactions')
+    def test_process_withdrawal_trace(self, request_transactions):
+        sender = Wallet.objects.create(balance=10000)
+        receiver = Wallet.objects.create()
+        transaction = Transaction.objects.create(
+            sender=sender,
+            receiver=receiver,
+            amount=1000,
+            scheduled_time=timezone.now() + timezone.timedelta(minutes=1),
+        )
+        Transaction.objects \
+            .filter(uuid=transaction.uuid) \
+            .update(scheduled_time=timezone.now())
+
+        with self.assertLogs('transactions.tracing') as logs:
+            process_withdrawal(str(transaction.uuid))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['trace'], 'process_withdrawal')
+        self.assertEqual(record['transaction'], str(transaction.uuid))
+        self.assertEqual(record['sender'], str(sender.uuid))
+        self.assertEqual(record['receiver'], str(receiver.uuid))
+        self.assertEqual(record['status'], 'SUCCESS')
+        self.assertGreaterEqual(record['schedule_lag'], 0)
+        self.assertEqual(list(record['stages']), ['lock', 'validate', 'provider', 'save'])
@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+
+from transactions import traffic
+from transactions.models import Wallet
+from transactions.throttling import WalletRateThrottle
+
+
+@mock.patch.object(WalletRateThrottle, 'get_rate', lambda self: None)
+class TrafficCaptureTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture.jsonl')
+        self.sender = Wallet.objects.create(balance=10000)
+        self.receiver = Wallet.objects.create()
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def withdraw(self):
+        return self.client.post(
+            reverse('wallet-withdraw', kwargs={'pk': self.sender.uuid}),
+            {
+                'amount': '10.00',
+                'target': str(self.receiver.uuid),
+                'scheduled_time': (timezone.now() + timezone.timedelta(minutes=2)).isoformat(),
+            },
+            format='json',
+        )
+
+    def test_capture(self):
+        with override_settings(TRAFFIC_CAPTURE_PATH=self.path, TRAFFIC_CAPTURE_SAMPLE_RATE=1.0):
+            self.assertEqual(self.withdraw().status_code, 201)
+            self.client.get(reverse('wallet-detail', kwargs={'pk': self.sender.uuid}))
+        traffic.get_recorder(self.path).flush()
+
+        withdrawal, retrieval = traffic.load(self.path)
+        sender = traffic.pseudonym(str(self.sender.uuid))
+        self.assertEqual(withdrawal['method'], 'POST')
+        self.assertEqual(withdrawal['path'], f'/api/wallets/{sender}/withdraw/')
+        self.assertEqual(withdrawal['status'], 201)
+        self.assertEqual(withdrawal['body']['amount'], '10.00')
+        self.assertEqual(withdrawal['body']['target'], traffic.pseudonym(str(self.receiver.uuid)))
+        self.assertNotIn('scheduled_time', withdrawal['body'])
+        self.assertAlmostEqual(withdrawal['body']['scheduled_delay'], 120, delta=5)
+        self.assertEqual(retrieval['path'], f'/api/wallets/{sender}/')
+        self.assertNotIn(str(self.sender.uuid), open(self.path).read())
+
+    def test_sampling(self):
+        with override_settings(TRAFFIC_CAPTURE_PATH=self.path, TRAFFIC_CAPTURE_SAMPLE_RATE=0.0):
+            self.assertEqual(self.withdraw().status_code, 201)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TrafficReplayTest(SimpleTestCase):
+    def session_factory(self, sent):
+        def request(method, url, json):
+            sent.append((method, url, json))
+            return SimpleNamespace(status_code=201)
+        return lambda: SimpleNamespace(request=request)
+
+    def test_replay(self):
+        records = [
+            {'ts': 100.0 + i, 'method': 'POST', 'path': f'/api/wallets/{wallet}/withdraw/',
+             'query': '', 'body': {'amount': str(i), 'target': other, 'scheduled_delay': 60}}
+            for i, (wallet, other) in enumerate([
+                ('00000000-0000-4000-8000-00000000000a', '00000000-0000-4000-8000-00000000000b'),
+                ('00000000-0000-4000-8000-00000000000b', '00000000-0000-4000-8000-00000000000a'),
+            ] * 5)
+        ]
+        self.assertEqual(traffic.pseudonyms(records), {
+            '00000000-0000-4000-8000-00000000000a', '00000000-0000-4000-8000-00000000000b'})
+        wallets = {
+            '00000000-0000-4000-8000-00000000000a': '11111111-1111-4111-8111-111111111111',
+            '00000000-0000-4000-8000-00000000000b': '22222222-2222-4222-8222-222222222222',
+        }
+        sent = []
+
+        result = traffic.replay(records, 'http://stack:8000', wallets, speed=0,
+                                concurrency=2, session_factory=self.session_factory(sent))
+
+        self.assertEqual(result['requests'], 10)
+        self.assertEqual(result['statuses'], {201: 10})
+        for wallet, target in [('1111', '2222'), ('2222', '1111')]:
+            requests = [(url, body) for _, url, body in sent if wallet * 2 in url]
+            # the requests of a wallet keep their order
+            self.assertEqual([body['amount'] for _, body in requests],
+                             [str(i) for i in range(10) if (i % 2) == (wallet == '2222')])
+            for url, body in requests:
+                self.assertTrue(url.startswith('http://stack:8000/api/wallets/'))
+                self.assertTrue(body['target'].startswith(target))
+                self.assertGreater(parse_datetime(body['scheduled_time']), timezone.now())
+
+    def test_speed(self):
+        records = [
+            {'ts': 100.0 + i * 0.5, 'method': 'GET', 'path': '/api/wallets/', 'query': ''}
+            for i in range(3)
+        ]
+        started = time.monotonic()
+        traffic.replay(records, 'http://stack:8000', {}, speed=10,
+                       session_factory=self.session_factory([]))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_load_orders_by_time(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            for ts in (3, 1, 2):
+                f.write(json.dumps({'ts': ts, 'method': 'GET', 'path': '/api/wallets/'}) + '\n')
+        try:
+            self.assertEqual([record['ts'] for record in traffic.load(f.name)], [1, 2, 3])
+        finally:
+            os.unlink(f.name)
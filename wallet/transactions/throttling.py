@@ -0,0 +1,93 @@
+"""
+Per-wallet rate limiting of the wallet actions.
+
+:class:`WalletRateThrottle` is a token bucket keyed by the wallet and the
+client. A bucket holds up to ``num`` tokens of the ``'num/period'`` rate of
+its scope and refills continuously, so clients may burst up to ``num``
+requests and then sustain the rate. Throttled requests get a 429 response
+with a ``Retry-After`` header.
+
+With a Redis cache the bucket is updated atomically by a Lua script. Other
+cache backends fall back to a non-atomic read-modify-write, which is good
+enough for a single process.
+"""
+import math
+import time
+
+from rest_framework.throttling import SimpleRateThrottle
+
+from .cache import get_redis_client
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'time', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+_scripts = {}
+
+
+def take_token(key: str, capacity: int, rate: float, cache) -> float:
+    """
+    Take a token from the bucket stored at ``key``.
+
+    Returns:
+        float: ``0`` if a token was taken, otherwise the seconds until the
+        next token is available.
+    """
+    now = time.time()
+    client = get_redis_client()
+    if client is not None:
+        script = _scripts.get(id(client.connection_pool))
+        if script is None:
+            script = _scripts[id(client.connection_pool)] = client.register_script(TOKEN_BUCKET_SCRIPT)
+        return float(script(keys=[key], args=[capacity, rate, now]))
+
+    tokens, last = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + max(0, now - last) * rate)
+    wait = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate
+    cache.set(key, (tokens, now), math.ceil(capacity / rate) + 1)
+    return wait
+
+
+class WalletRateThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle of the actions of a single wallet per client.
+    """
+    scope = 'wallet'
+    cache_format = 'throttle:%(scope)s:%(wallet)s:%(ident)s'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'wallet': view.kwargs.get(view.lookup_url_kwarg or view.lookup_field),
+            'ident': self.get_ident(request),
+        }
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        self._wait = take_token(self.key, self.num_requests, self.num_requests / self.duration, self.cache)
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
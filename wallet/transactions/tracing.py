@@ -0,0 +1,125 @@
+"""
+Lightweight tracing of the withdrawal pipeline.
+
+:func:`trace` measures a unit of work, e.g. one ``process_withdrawal`` run,
+and :meth:`Trace.span` the stages inside it::
+
+    with tracing.trace('process_withdrawal', transaction=uuid) as trace:
+        with trace.span('lock'):
+            ...
+        trace.set(status='SUCCESS')
+
+``TRACING`` in the settings selects the exporters, a list of:
+
+- ``'log'``: one JSON line per trace on the ``transactions.tracing``
+  logger with the attributes and the duration of every stage in
+  milliseconds.
+- ``'otel'``: an OpenTelemetry span per trace with a child span per stage.
+  Needs the ``opentelemetry-api`` package and a configured SDK.
+
+Without exporters :func:`trace` returns a shared no-op trace, so the
+instrumentation costs a function call per stage.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_noop_span = nullcontext()
+
+
+class NoopTrace:
+    def span(self, stage):
+        return _noop_span
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_TRACE = NoopTrace()
+
+
+class Trace:
+    def __init__(self, name, attributes, tracer=None):
+        self.name = name
+        self.attributes = attributes
+        self.durations = {}
+        self.tracer = tracer
+        self.otel_span = None
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            if self.tracer is not None:
+                with self.tracer.start_as_current_span(stage):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.durations[stage] = self.durations.get(stage, 0) + elapsed
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        if self.otel_span is not None:
+            self.otel_span.set_attributes(_otel_attributes(attributes))
+
+
+def _otel_attributes(attributes):
+    return {
+        key: value if isinstance(value, (bool, int, float, str)) else str(value)
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+def _tracer():
+    from opentelemetry import trace as otel_trace
+
+    return otel_trace.get_tracer('wallet.transactions')
+
+
+@contextmanager
+def trace(name, **attributes):
+    """
+    Trace a unit of work with the given attributes.
+
+    Yields:
+        Trace: The trace to record stages and attributes on, a no-op trace
+        if tracing is disabled.
+
+    An exception escaping the trace is recorded as its ``error`` attribute
+    and re-raised.
+    """
+    exporters = settings.TRACING
+    if not exporters:
+        yield NOOP_TRACE
+        return
+
+    tracer = _tracer() if 'otel' in exporters else None
+    current = Trace(name, attributes, tracer)
+    started = time.perf_counter()
+    try:
+        if tracer is not None:
+            with tracer.start_as_current_span(name) as otel_span:
+                current.otel_span = otel_span
+                otel_span.set_attributes(_otel_attributes(attributes))
+                yield current
+        else:
+            yield current
+    except Exception as e:
+        current.set(error=type(e).__name__, error_message=str(e))
+        raise
+    finally:
+        if 'log' in exporters:
+            logger.info(json.dumps({
+                'trace': name,
+                **current.attributes,
+                'duration': round((time.perf_counter() - started) * 1000, 3),
+                'stages': {stage: round(ms, 3) for stage, ms in current.durations.items()},
+            }, default=str))
@@ -0,0 +1,305 @@
+"""
+Capture and replay of the API traffic.
+
+:class:`TrafficRecorder` appends sampled API requests to a JSON lines file
+(see ``wallet.middleware.TrafficCaptureMiddleware``), one object per
+request::
+
+    {"ts": 1718000000.123, "method": "POST",
+     "path": "/api/wallets/<wallet>/withdraw/", "query": "",
+     "body": {"amount": "10.00", "target": "<wallet>", "scheduled_delay": 60.0},
+     "status": 201, "duration_ms": 4.2}
+
+The records are anonymized: every wallet UUID is replaced by a pseudonym
+derived from it with an HMAC of the ``SECRET_KEY``, so the requests of a
+wallet stay recognisable without revealing the wallet, and absolute
+``scheduled_time`` values become a ``scheduled_delay`` in seconds after the
+request. Sampling is by wallet, so a sampled wallet keeps all of its
+requests and the contention on it is preserved.
+
+The request thread only puts the record into a bounded queue; a daemon
+thread encodes and appends it. If the writer falls behind, records are
+dropped instead of slowing the requests down.
+
+:func:`replay` re-issues a capture against another stack (see
+``manage.py replay_traffic``).
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import cache
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+UUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+
+QUEUE_SIZE = 10000
+
+# requests with larger bodies are captured without the body
+MAX_BODY_SIZE = 4096
+
+
+def pseudonym(value: str) -> str:
+    """
+    Return the stable pseudonym UUID of the UUID ``value``.
+    """
+    digest = hmac.new(
+        f'traffic-capture:{settings.SECRET_KEY}'.encode(),
+        uuid.UUID(value).bytes,
+        hashlib.sha256,
+    ).digest()
+    return str(uuid.UUID(bytes=digest[:16], version=4))
+
+
+def anonymize(value, substitute=pseudonym):
+    """
+    Replace every UUID in ``value``, a string or a decoded JSON body, with
+    ``substitute(uuid)``.
+    """
+    if isinstance(value, str):
+        return UUID_RE.sub(lambda match: substitute(match.group().lower()), value)
+    if isinstance(value, dict):
+        return {key: anonymize(item, substitute) for key, item in value.items()}
+    if isinstance(value, list):
+        return [anonymize(item, substitute) for item in value]
+    return value
+
+
+def sampled(key: str, rate: float) -> bool:
+    """
+    Decide deterministically whether the requests of ``key`` are sampled.
+    """
+    return zlib.crc32(key.encode()) / 2 ** 32 < rate
+
+
+def capture_body(body: bytes, started: float):
+    """
+    Decode and anonymize a JSON request body; ``scheduled_time`` becomes
+    ``scheduled_delay``, the seconds from ``started`` (a timestamp) to it.
+    """
+    if not body or len(body) > MAX_BODY_SIZE:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and isinstance(data.get('scheduled_time'), str):
+        scheduled_time = parse_datetime(data.pop('scheduled_time'))
+        if scheduled_time is not None and scheduled_time.tzinfo is not None:
+            data['scheduled_delay'] = round(scheduled_time.timestamp() - started, 3)
+    return anonymize(data)
+
+
+class TrafficRecorder:
+    """
+    Append records to a JSON lines file from a background thread.
+    """
+
+    def __init__(self, path, queue_size: int = QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def record(self, record: dict):
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='traffic-capture', daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        """
+        Block until every queued record is written.
+        """
+        self.queue.join()
+
+    def run(self):
+        # a single write per batch on an O_APPEND file keeps the lines of
+        # several server processes from interleaving
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                os.write(fd, b''.join(
+                    json.dumps(record, separators=(',', ':')).encode() + b'\n'
+                    for record in batch
+                ))
+            except (OSError, TypeError, ValueError):
+                logger.exception('Failed to write %d captured requests', len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+@cache
+def get_recorder(path) -> TrafficRecorder:
+    """
+    Return the recorder of ``path``, shared by the request handlers of the
+    process.
+    """
+    return TrafficRecorder(path)
+
+
+def load(path) -> list[dict]:
+    """
+    Read a capture, ordered by the time of the requests.
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record['ts'])
+
+
+def wallet_of(record: dict):
+    """
+    Return the pseudonym of the wallet acting in ``record``, if any.
+    """
+    match = UUID_RE.search(record['path'])
+    return match.group() if match else None
+
+
+def pseudonyms(records) -> set[str]:
+    """
+    Return the pseudonyms of all wallets referenced by ``records``.
+    """
+    found = set()
+
+    def collect(value):
+        found.add(value)
+        return value
+
+    for record in records:
+        anonymize([record['path'], record.get('body')], collect)
+    return found
+
+
+def create_wallets(session, base_url, names, initial_balance) -> dict[str, str]:
+    """
+    Create a wallet with ``initial_balance`` for every pseudonym.
+
+    Returns:
+        dict: The UUID of the created wallet by pseudonym.
+    """
+    wallets = {}
+    for name in sorted(names):
+        response = session.post(urljoin(base_url, '/api/wallets/'), json={})
+        response.raise_for_status()
+        wallets[name] = response.json()['uuid']
+        if initial_balance:
+            session.patch(
+                urljoin(base_url, f'/api/wallets/{wallets[name]}/deposit/'),
+                json={'amount': str(initial_balance)},
+            ).raise_for_status()
+    return wallets
+
+
+def prepare(record: dict, wallets: dict[str, str]) -> dict:
+    """
+    Return the arguments of the request replaying ``record`` now.
+    """
+    def substitute(name):
+        return wallets.get(name, name)
+
+    body = anonymize(record.get('body'), substitute)
+    if isinstance(body, dict) and 'scheduled_delay' in body:
+        delay = timedelta(seconds=body.pop('scheduled_delay'))
+        body['scheduled_time'] = (timezone.now() + delay).isoformat()
+    path = anonymize(record['path'], substitute)
+    if record.get('query'):
+        path = f'{path}?{record["query"]}'
+    return {'method': record['method'], 'url': path, 'json': body}
+
+
+def lanes(records, count: int) -> list[list[dict]]:
+    """
+    Split ``records`` into ``count`` lanes; all requests of a wallet share a
+    lane, in their original order.
+    """
+    result = [[] for _ in range(count)]
+    for index, record in enumerate(records):
+        key = wallet_of(record) or str(index)
+        result[zlib.crc32(key.encode()) % count].append(record)
+    return result
+
+
+def replay(records, base_url: str, wallets: dict[str, str], speed: float = 1.0,
+           concurrency: int = 8, session_factory=requests.Session) -> dict:
+    """
+    Re-issue the ``records`` against ``base_url``.
+
+    A request is sent at its original offset from the first request divided
+    by ``speed``, or as soon as possible with a ``speed`` of 0. Every lane
+    (see :func:`lanes`) is replayed by one thread, so the requests of a
+    wallet are sent one after another in their original order.
+
+    Returns:
+        dict: The number of ``requests``, the ``statuses`` counted by HTTP
+        status (``'error'`` for failed connections), the ``latencies`` in
+        milliseconds and the ``elapsed`` seconds.
+    """
+    if not records:
+        return {'requests': 0, 'statuses': Counter(), 'latencies': [], 'elapsed': 0.0}
+    first = records[0]['ts']
+    started = time.monotonic()
+
+    def run(lane):
+        session = session_factory()
+        results = []
+        for record in lane:
+            if speed:
+                delay = started + (record['ts'] - first) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            kwargs = prepare(record, wallets)
+            kwargs['url'] = urljoin(base_url, kwargs['url'])
+            sent = time.perf_counter()
+            try:
+                status = session.request(**kwargs).status_code
+            except requests.RequestException:
+                status = 'error'
+            results.append((status, (time.perf_counter() - sent) * 1000))
+        return results
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = [
+            result
+            for lane_results in executor.map(run, lanes(records, concurrency))
+            for result in lane_results
+        ]
+    return {
+        'requests': len(results),
+        'statuses': Counter(status for status, _ in results),
+        'latencies': sorted(latency for _, latency in results),
+        'elapsed': time.monotonic() - started,
+    }
@@ -7,5 +7,6 @@ router = routers.DefaultRouter()
 router.register('wallets', views.WalletViewSet)
 
 urlpatterns = [
+    path('wallets/<uuid:pk>/events/', views.wallet_events, name='wallet-events'),
     path('', include(router.urls)),
 ]
@@ -1,12 +1,67 @@
+import asyncio
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
 
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 
-from .models import Wallet, Transaction
-from .serializers import WalletSerializer, DepositSerializer, WithdrawRequestSerializer
+from . import events
+from .coalescing import (
+    CoalescedDepositError,
+    CoalescedDepositTimeout,
+    coalesce_deposit,
+    coalescing_enabled,
+)
+from .models import Wallet, Transaction, WalletDailyAggregate
+from .renderers import CompactJSONRenderer
+from .serializers import (
+    CompactWalletSerializer,
+    DepositSerializer,
+    StatementRequestSerializer,
+    TransferRequestSerializer,
+    WalletDailyAggregateSerializer,
+    WalletSerializer,
+    WithdrawRequestSerializer,
+)
+from .throttling import WalletRateThrottle
+
+
+def apply_deposit(wallet_uuid, amount):
+    Wallet.objects.deposit(wallet_uuid, amount)
+
+
+def wallet_etag(request, pk=None, **kwargs):
+    """
+    Return the strong ETag of a wallet resource, or ``None`` if the wallet
+    does not exist.
+
+    ``Wallet.updated`` is the version of the wallet and its transactions:
+    every balance change, new withdrawal and settlement sets it. The URL,
+    the negotiated format and the language select the representation. The
+    version is read by one primary key lookup on the database the response
+    would be read from, so a lagging replica can't pair a new ETag with an
+    old body.
+    """
+    updated = Wallet.objects.filter(uuid=pk).values_list('updated', flat=True).first()
+    if updated is None:
+        return None
+    renderer = getattr(request, 'accepted_renderer', None)
+    representation = '|'.join([
+        updated.isoformat(),
+        request.get_full_path(),
+        getattr(renderer, 'format', ''),
+        getattr(request, 'LANGUAGE_CODE', ''),
+    ])
+    return hashlib.md5(representation.encode(), usedforsecurity=False).hexdigest()
 
 
 class WalletViewSet(mixins.CreateModelMixin,
@@ -15,24 +70,51 @@ class WalletViewSet(mixins.CreateModelMixin,
     queryset = Wallet.objects.all().order_by('-created')
     serializer_class = WalletSerializer
 
-    @action(detail=True, methods=['patch'], serializer_class=DepositSerializer)
+    def get_serializer_class(self):
+        if self.action == 'retrieve' and self.compact:
+            return CompactWalletSerializer
+        return super().get_serializer_class()
+
+    @property
+    def compact(self):
+        return isinstance(getattr(self.request, 'accepted_renderer', None), CompactJSONRenderer)
+
+    @method_decorator(condition(etag_func=wallet_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def wallet_response(self, pk, status_code):
+        wallet = self.get_queryset().get(uuid=pk)
+        serializer_class = CompactWalletSerializer if self.compact else WalletSerializer
+        serializer = serializer_class(wallet, context=self.get_serializer_context())
+        headers = self.get_success_headers({'uuid': pk})
+        return Response(serializer.data, status=status_code, headers=headers)
+
+    @action(detail=True, methods=['patch'], serializer_class=DepositSerializer,
+            throttle_classes=[WalletRateThrottle])
     def deposit(self, request, pk=None):
         deposit_request = self.get_serializer(data=request.data)
         deposit_request.is_valid(raise_exception=True)
         amount = deposit_request.validated_data['amount']
 
-        with transaction.atomic():
-            self.get_queryset() \
-                .select_for_update() \
-                .get(uuid=pk) \
-                .deposit(amount)
+        if coalescing_enabled():
+            try:
+                coalesce_deposit(pk, amount, apply_deposit)
+            except CoalescedDepositTimeout as e:
+                # the outcome is unknown, deposits have no idempotency key
+                return Response(
+                    {'detail': f'{e} It may have been applied, check the balance before retrying.'},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT,
+                )
+            except CoalescedDepositError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            apply_deposit(pk, amount)
 
-        headers = self.get_success_headers({'uuid': pk})
-        wallet = self.get_queryset().get(uuid=pk)
-        serializer = WalletSerializer(wallet, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
+        return self.wallet_response(pk, status.HTTP_200_OK)
 
-    @action(detail=True, methods=['post'], serializer_class=WithdrawRequestSerializer)
+    @action(detail=True, methods=['post'], serializer_class=WithdrawRequestSerializer,
+            throttle_classes=[WalletRateThrottle])
     def withdraw(self, request, pk=None):
         withdraw_request = self.get_serializer(data=request.data)
         withdraw_request.is_valid(raise_exception=True)
@@ -50,7 +132,77 @@ class WalletViewSet(mixins.CreateModelMixin,
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        headers = self.get_success_headers({'uuid': pk})
-        wallet = self.get_queryset().get(uuid=pk)
-        serializer = WalletSerializer(wallet, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        return self.wallet_response(pk, status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], serializer_class=TransferRequestSerializer,
+            throttle_classes=[WalletRateThrottle])
+    def transfer(self, request, pk=None):
+        transfer_request = self.get_serializer(data=request.data)
+        transfer_request.is_valid(raise_exception=True)
+
+        try:
+            Wallet.objects.transfer(
+                pk,
+                transfer_request.validated_data['target'],
+                transfer_request.validated_data['amount'],
+            )
+        except Wallet.DoesNotExist as e:
+            return Response({'detail': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({'detail': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.wallet_response(pk, status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], serializer_class=WalletDailyAggregateSerializer)
+    @method_decorator(condition(etag_func=wallet_etag))
+    def statement(self, request, pk=None):
+        statement_request = StatementRequestSerializer(data=request.query_params)
+        statement_request.is_valid(raise_exception=True)
+        wallet = self.get_object()
+
+        aggregates = WalletDailyAggregate.objects \
+            .filter(
+                wallet=wallet,
+                day__range=(statement_request.validated_data['start'],
+                            statement_request.validated_data['end']),
+            ) \
+            .order_by('day')
+        serializer = self.get_serializer(aggregates, many=True)
+        return Response(serializer.data)
+
+
+@require_GET
+async def wallet_events(request, pk):
+    """
+    Stream the events of the wallet as server-sent events, see
+    :mod:`transactions.events`.
+    """
+    hub = events.get_hub()
+    if hub is None:
+        return JsonResponse({'detail': 'Event streams are not available.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not await Wallet.objects.filter(uuid=pk).aexists():
+        raise Http404
+
+    return StreamingHttpResponse(
+        event_stream(hub, pk),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def event_stream(hub, wallet_uuid):
+    queue = await hub.subscribe(wallet_uuid)
+    try:
+        # the first chunk tells the client that it is subscribed
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), settings.WALLET_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            message = json.loads(message)
+            yield f'event: {message["event"]}\ndata: {json.dumps(message["data"])}\n\n'
+    finally:
+        await hub.unsubscribe(wallet_uuid, queue)
@@ -0,0 +1,121 @@
+"""
+PostgreSQL database backend with ``psycopg_pool`` connection pooling.
+
+Django 5.0 opens a new connection for every request and every Celery task
+unless ``CONN_MAX_AGE`` is set, and persistent connections do not work well
+with ASGI. This backend keeps a :class:`psycopg_pool.ConnectionPool` per
+database alias and process instead. Closing a Django connection, which
+happens at the end of every request and task, returns it to the pool.
+
+The pool is enabled by ``OPTIONS['pool']`` in the database settings, which
+holds the keyword arguments of the pool (``min_size``, ``max_size``,
+``max_lifetime``, ``max_idle``, ``timeout``, ...). ``CONN_HEALTH_CHECKS``
+enables checking connections when they are taken out of the pool and
+``CONN_MAX_AGE`` must be ``0``. Without ``OPTIONS['pool']`` the backend
+behaves exactly like ``django.db.backends.postgresql``.
+
+Pools are created lazily and keyed by process id, so forked processes
+(Celery prefork workers, pre-forking web servers) never share the sockets
+of their parent.
+"""
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from psycopg_pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # pooled connections would keep the test database in use
+        self.connection.close_pool()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        if not pool_options:
+            return None
+
+        key = (self.alias, os.getpid(), self.settings_dict['NAME'])
+        with _pools_lock:
+            if key not in _pools:
+                if self.settings_dict['CONN_MAX_AGE'] != 0:
+                    raise ImproperlyConfigured(
+                        'Connection pooling does not support persistent connections. '
+                        'Set CONN_MAX_AGE to 0.'
+                    )
+                connect_kwargs = self.get_connection_params()
+                # Django sets the right mode once it gets the connection
+                connect_kwargs['autocommit'] = True
+                _pools[key] = ConnectionPool(
+                    kwargs=connect_kwargs,
+                    configure=self._configure_connection,
+                    check=ConnectionPool.check_connection
+                    if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                    name=f'{self.alias}-{os.getpid()}',
+                    open=True,
+                    **pool_options,
+                )
+            return _pools[key]
+
+    def close_pool(self):
+        """
+        Close every pool of this database alias in the current process.
+        """
+        with _pools_lock:
+            for key in [key for key in _pools if key[:2] == (self.alias, os.getpid())]:
+                _pools.pop(key).close()
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        if self.pool is None:
+            return super().get_new_connection(conn_params)
+
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = base.IsolationLevel(
+            isolation_level if isolation_level is not None
+            else base.IsolationLevel.READ_COMMITTED
+        )
+        connection = self.pool.getconn()
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def init_connection_state(self):
+        if self.pool is None:
+            return super().init_connection_state()
+        # time zone and role are set once by the pool in _configure_connection
+        super(base.DatabaseWrapper, self).init_connection_state()
+
+    def _configure_connection(self, connection):
+        with connection.cursor() as cursor:
+            if self.timezone_name and \
+                    connection.info.parameter_status('TimeZone') != self.timezone_name:
+                cursor.execute(self.ops.set_time_zone_sql(), [self.timezone_name])
+            if role := self.settings_dict['OPTIONS'].get('assume_role'):
+                cursor.execute(self.ops.compose_sql('SET ROLE %s', [role]))
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+
+        with self.wrap_database_errors:
+            if getattr(self.connection, '_pool', None) is self.pool:
+                self.pool.putconn(self.connection)
+            # a connection inherited from the parent process is dropped
+            # without closing it, its socket belongs to the parent
+            self.connection = None
@@ -0,0 +1,86 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from transactions import traffic
+
+from .routers import REPLICA_DB_ALIAS, replica_reads
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve the reads of safe requests from the read replica.
+
+    After an unsafe request the client gets a short-lived cookie which pins
+    its following requests to the primary, so it always reads its own
+    writes even if the replica lags behind.
+    """
+
+    def __init__(self, get_response):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = settings.DATABASE_REPLICA_PIN_COOKIE in request.COOKIES
+
+        if request.method in SAFE_METHODS:
+            with replica_reads(not pinned):
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        response.set_cookie(
+            settings.DATABASE_REPLICA_PIN_COOKIE,
+            '1',
+            max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+        return response
+
+
+class TrafficCaptureMiddleware:
+    """
+    Record a sample of the API requests for ``manage.py replay_traffic``.
+
+    Enabled by ``TRAFFIC_CAPTURE_PATH``; the requests of a wallet are
+    sampled together at ``TRAFFIC_CAPTURE_SAMPLE_RATE`` and anonymized, see
+    :mod:`transactions.traffic`.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TRAFFIC_CAPTURE_PATH:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rate = settings.TRAFFIC_CAPTURE_SAMPLE_RATE
+        self.recorder = traffic.get_recorder(settings.TRAFFIC_CAPTURE_PATH)
+
+    def __call__(self, request):
+        path = request.path_info
+        # event streams last as long as the client listens, they can't be replayed
+        if not path.startswith('/api/') or path.endswith('/events/'):
+            return self.get_response(request)
+        match = traffic.UUID_RE.search(path)
+        key = match.group().lower() if match else str(uuid.uuid4())
+        if not traffic.sampled(key, self.rate):
+            return self.get_response(request)
+
+        ts = time.time()
+        started = time.perf_counter()
+        # read before the view, which may consume the stream
+        body = request.body
+        response = self.get_response(request)
+        self.recorder.record({
+            'ts': round(ts, 6),
+            'method': request.method,
+            'path': traffic.anonymize(path),
+            'query': traffic.anonymize(request.META.get('QUERY_STRING', '')),
+            'body': traffic.capture_body(body, ts),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+        return response
@@ -0,0 +1,54 @@
+"""
+Database routing between the primary database and its read replica.
+
+Every query goes to the ``default`` (primary) database unless the code runs
+inside :func:`replica_reads`. Inside it, reads are sent to the ``replica``
+database as long as one is configured and no transaction is open on the
+primary. Writes, locking reads (``select_for_update``), Celery tasks and
+management commands therefore always see the primary.
+
+:class:`wallet.middleware.ReplicaRoutingMiddleware` enables replica reads for
+safe HTTP requests.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Route the reads made inside the block to the read replica.
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        self.replica = REPLICA_DB_ALIAS if REPLICA_DB_ALIAS in settings.DATABASES else None
+
+    def db_for_read(self, model, **hints):
+        if self.replica is None or not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
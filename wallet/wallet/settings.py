@@ -59,6 +59,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'wallet.middleware.TrafficCaptureMiddleware',
+    'wallet.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,14 +96,42 @@ WSGI_APPLICATION = 'wallet.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'wallet.db.postgresql_pool',
         'NAME': read_secret('POSTGRES_DB_FILE'),
         'HOST': read_secret('POSTGRES_HOSTNAME_FILE'),
         'USER': read_secret('POSTGRES_USER_FILE'),
         'PASSWORD': read_secret('POSTGRES_PASSWORD_FILE'),
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
 
+# connection pooling, see wallet/db/postgresql_pool/base.py
+if pool_max_size := int(os.environ.get('DJANGO_DB_POOL_MAX_SIZE', '0')):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN_SIZE', '1')),
+        'max_size': pool_max_size,
+        'max_lifetime': float(os.environ.get('DJANGO_DB_POOL_MAX_LIFETIME', '1800')),
+        'max_idle': float(os.environ.get('DJANGO_DB_POOL_MAX_IDLE', '300')),
+        'timeout': float(os.environ.get('DJANGO_DB_POOL_TIMEOUT', '10')),
+    }
+
+if replica_host := read_secret('POSTGRES_REPLICA_HOSTNAME_FILE'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['wallet.routers.PrimaryReplicaRouter']
+
+# clients are pinned to the primary for this many seconds after a write
+DATABASE_REPLICA_PIN_SECONDS = int(
+    os.environ.get('DJANGO_DB_REPLICA_PIN_SECONDS', '5'))
+DATABASE_REPLICA_PIN_COOKIE = 'pin_primary'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -157,6 +187,9 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': os.environ.get('DJANGO_CACHE_URL')
+    } if os.environ.get('DJANGO_CACHE_URL') else {
+        # local development and tests without a cache server
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -166,9 +199,26 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'transactions.renderers.CompactJSONRenderer',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        # token bucket per wallet and client of the deposit and withdraw actions
+        'wallet': os.environ.get('DJANGO_WALLET_THROTTLE_RATE', '20/s') or None,
+    },
 }
 
+# coalesce the concurrent deposits to the same wallet into one balance
+# update, waiting up to this many milliseconds for a burst to collect, 0
+# disables coalescing
+WALLET_DEPOSIT_COALESCE_WINDOW = int(os.environ.get('DJANGO_WALLET_DEPOSIT_COALESCE_WINDOW', '0'))
+
+# seconds between keepalive comments on idle wallet event streams
+WALLET_EVENTS_KEEPALIVE = int(os.environ.get('DJANGO_WALLET_EVENTS_KEEPALIVE', '15'))
+
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
 CELERY_BROKER_CONNECTION_RETRY = True
 CELERY_BROKER_CHANNEL_ERROR_RETRY = True
@@ -177,9 +227,109 @@ CELERY_BROKER_CONNECTION_MAX_RETRIES = None # retry forever
 
 CELERY_CACHE_BACKEND = 'django-cache'
 
+# process_withdrawal is safe to run more than once, so messages are only
+# acknowledged after the task ran and the messages of a dead worker are
+# redelivered instead of lost
+CELERY_TASK_ACKS_LATE = os.environ.get('CELERY_TASK_ACKS_LATE', 'true').lower() == 'true'
+CELERY_TASK_REJECT_ON_WORKER_LOST = CELERY_TASK_ACKS_LATE
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', '4'))
+
 # timezone
 CELERY_TIMEZONE = 'Asia/Tehran'
 
+# every queue is consumed by its own workers (see compose.yaml), so bulk
+# jobs and housekeeping can never delay due withdrawals
+CELERY_TASK_DEFAULT_QUEUE = 'bulk'
+CELERY_TASK_ROUTES = {
+    'transactions.tasks.process_withdrawal': {'queue': 'settlement'},
+    'transactions.tasks.dispatch_due_withdrawals': {'queue': 'settlement'},
+    'transactions.tasks.dispatch_fair_withdrawals': {'queue': 'settlement'},
+    'transactions.tasks.recover_stuck_withdrawals': {'queue': 'maintenance'},
+}
+
+# how withdrawals are sent to the transaction provider:
+# 'eta' schedules a task per withdrawal at its scheduled time,
+# 'batch' sends the due withdrawals every WITHDRAWAL_BATCH_WINDOW seconds
+# with one provider request per WITHDRAWAL_BATCH_SIZE withdrawals,
+# 'fair' sends the due withdrawals round-robin by sender every
+# WITHDRAWAL_FAIR_INTERVAL seconds, see transactions/dispatcher.py
+WITHDRAWAL_DISPATCH_MODE = os.environ.get('WITHDRAWAL_DISPATCH_MODE', 'eta')
+WITHDRAWAL_BATCH_SIZE = int(os.environ.get('WITHDRAWAL_BATCH_SIZE', '100'))
+WITHDRAWAL_BATCH_WINDOW = float(os.environ.get('WITHDRAWAL_BATCH_WINDOW', '1'))
+
+# the fair dispatcher keeps at most WITHDRAWAL_FAIR_MAX_IN_FLIGHT withdrawals
+# dispatched and unsettled, at most WITHDRAWAL_FAIR_SENDER_CONCURRENCY per
+# sender; senders with WITHDRAWAL_FAIR_BULK_THRESHOLD due withdrawals are
+# reported in the bulk tier of the schedule lag metrics
+WITHDRAWAL_FAIR_INTERVAL = float(os.environ.get('WITHDRAWAL_FAIR_INTERVAL', '1'))
+WITHDRAWAL_FAIR_MAX_IN_FLIGHT = int(os.environ.get('WITHDRAWAL_FAIR_MAX_IN_FLIGHT', '64'))
+WITHDRAWAL_FAIR_SENDER_CONCURRENCY = int(os.environ.get('WITHDRAWAL_FAIR_SENDER_CONCURRENCY', '2'))
+WITHDRAWAL_FAIR_BULK_THRESHOLD = int(os.environ.get('WITHDRAWAL_FAIR_BULK_THRESHOLD', '100'))
+
+# number of settlement lanes of the 'eta' mode, see transactions/lanes.py:
+# withdrawals go to the settlement-lane-<n> queue of their sender instead of
+# the settlement queue, 0 disables the lanes
+WITHDRAWAL_LANES = int(os.environ.get('WITHDRAWAL_LANES', '0'))
+
+# pending withdrawals this many seconds past their scheduled time are
+# considered lost (dead worker, lost ETA message) and enqueued again
+WITHDRAWAL_RECOVERY_GRACE = int(os.environ.get('WITHDRAWAL_RECOVERY_GRACE', '300'))
+WITHDRAWAL_RECOVERY_INTERVAL = int(os.environ.get('WITHDRAWAL_RECOVERY_INTERVAL', '60'))
+
+CELERY_BEAT_SCHEDULE = {}
+if WITHDRAWAL_DISPATCH_MODE == 'batch':
+    CELERY_BEAT_SCHEDULE['dispatch-due-withdrawals'] = {
+        'task': 'transactions.tasks.dispatch_due_withdrawals',
+        'schedule': WITHDRAWAL_BATCH_WINDOW,
+        'options': {'expires': WITHDRAWAL_BATCH_WINDOW},
+    }
+elif WITHDRAWAL_DISPATCH_MODE == 'fair':
+    # the fair dispatcher also dispatches lost withdrawals again
+    CELERY_BEAT_SCHEDULE['dispatch-fair-withdrawals'] = {
+        'task': 'transactions.tasks.dispatch_fair_withdrawals',
+        'schedule': WITHDRAWAL_FAIR_INTERVAL,
+        'options': {'expires': WITHDRAWAL_FAIR_INTERVAL},
+    }
+else:
+    # the batch dispatcher picks up every due withdrawal by itself
+    CELERY_BEAT_SCHEDULE['recover-stuck-withdrawals'] = {
+        'task': 'transactions.tasks.recover_stuck_withdrawals',
+        'schedule': WITHDRAWAL_RECOVERY_INTERVAL,
+        'options': {'expires': WITHDRAWAL_RECOVERY_INTERVAL},
+    }
+
+# exporters of the withdrawal pipeline traces, see transactions/tracing.py:
+# 'log' (JSON lines on the transactions.tracing logger) and 'otel'
+TRACING = [exporter for exporter in os.environ.get('DJANGO_TRACING', '').split(',') if exporter]
+
+# JSON lines file recording a sample of the API requests, see
+# transactions/traffic.py; capture is disabled without it
+TRAFFIC_CAPTURE_PATH = os.environ.get('DJANGO_TRAFFIC_CAPTURE_PATH') or None
+
+# share of the wallets whose requests are captured
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get('DJANGO_TRAFFIC_CAPTURE_SAMPLE_RATE', '0.01'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'tracing': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'transactions.tracing': {
+            'handlers': ['tracing'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 if sentry_key := read_secret('SENTRY_KEY_FILE'):
     import sentry_sdk
 
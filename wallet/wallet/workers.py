@@ -0,0 +1,12 @@
+from uvicorn_worker import UvicornWorker
+
+
+class WalletUvicornWorker(UvicornWorker):
+    """
+    Uvicorn worker for gunicorn, see ``gunicorn.conf.py``.
+
+    Django's ASGI handler does not implement the lifespan protocol, so the
+    lifespan events are not sent at all.
+    """
+
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, 'lifespan': 'off'}